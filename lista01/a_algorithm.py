@@ -1,7 +1,11 @@
 import heapq
-from datetime import datetime
-from utils import time_to_minutes, print_path, log, reconstruct_path, calculate_total_travel_time
+from time import perf_counter
+from utils import time_to_minutes, print_path, reconstruct_path, calculate_total_travel_time
 from math import radians, sin, cos, sqrt, atan2
+from landmarks import get_landmarks
+from workspace import SearchWorkspace
+from instrumentation import emit, elapsed_ms
+from spatial import WALK_LINE, Footpath, get_footpaths
 
 #to do: avg speeds and deg to m numbers go to consts.
 
@@ -24,8 +28,11 @@ def manhattan_distance(node1, node2):
     return (abs(node1.lat - node2.lat) + abs(node1.lon - node2.lon)) * 111000 #deg to m
 
 
-def find_a_star_path(graph, start_name, dest_name, start_time, criteria, heuristic):
-    start_algorithm_time = datetime.now()
+def find_a_star_path(graph, start_name, dest_name, start_time, criteria, heuristic, stats=None, workspace=None, footpath_radius=None):
+    """stats - a dict the search counters (expanded, pushes, edges_scanned, ...) are added to
+    footpath_radius - walking between stops up to this many metres apart (e.g. spatial.FOOTPATH_RADIUS), 0 or None - no walking
+    """
+    start_algorithm_time = perf_counter()
     start_node = graph.get_node(start_name)
     dest_node = graph.get_node(dest_name)
     
@@ -34,36 +41,51 @@ def find_a_star_path(graph, start_name, dest_name, start_time, criteria, heurist
         return
     
     start_total = time_to_minutes(start_time)
-    distance = {node: float('inf') for node in graph.get_nodes()}
-    previous = {node: (None, None, None) for node in graph.get_nodes()}
-    transfers = {node: float('inf') for node in graph.get_nodes()}
-    distance[start_node] = 0
-    transfers[start_node] = 0
+    #labels by node.id, valid where stamp == epoch - every queued node is labelled
+    workspace = (workspace or SearchWorkspace(len(graph.get_nodes()))).reset()
+    stamp, epoch = workspace.stamp, workspace.epoch
+    distance, previous, transfers = workspace.distance, workspace.previous, workspace.transfers
+    stamp[start_node.id] = epoch
+    distance[start_node.id] = 0
+    transfers[start_node.id] = 0
+    previous[start_node.id] = (None, None, None)
     
     if heuristic == 'euclidean':
         heuristic_function = lambda node: euclidean_distance(node, dest_node) / 50  # avg speed 50 km/h
     elif heuristic == 'manhattan':
         heuristic_function = lambda node: manhattan_distance(node, dest_node) / 50
+    elif heuristic == 'alt':
+        #landmark lower bounds in minutes, one array per query
+        landmarks = get_landmarks(graph)
+        bounds, stop_ids = landmarks.lower_bounds(landmarks.stop_ids[dest_node.name]), landmarks.stop_ids
+        heuristic_function = lambda node: bounds[stop_ids[node.name]]
     else:
         heuristic_function = lambda node: haversine_distance(node, dest_node) / 50
         
     
+    footpaths = get_footpaths(graph, footpath_radius)
     priority_queue = [(0 + heuristic_function(start_node), 0, start_node, None, start_total)]
+    pushes, expanded, stale_pops, edges_scanned, out_edges = 1, 0, 0, 0, 0  #counters for the 'search' event
     
     while priority_queue:
         _, current_cost, current_stop, current_line, current_time = heapq.heappop(priority_queue)
+        expanded += 1
+        if current_cost > distance[current_stop.id]:
+            stale_pops += 1  #a cheaper label was found since the push - expanding this one would hang paths off a label that is gone
+            continue
         
         if current_stop == dest_node:
             break
         
-        for edge in current_stop.get_outgoing_edges():
-            dep_total = time_to_minutes(edge.dep_time)
-            if dep_total < current_time:
-                continue
+        out_edges += graph.get_out_degree(current_stop)
+        #per (line, next stop) only the first departure at or after current time and later ones that overtake it
+        for edge in graph.get_departures(current_stop, current_time, first_per_route=True):
+            edges_scanned += 1
+            dep_total = edge.dep_minutes
             
             wait_time = dep_total - current_time
             #penalties for t/p
-            new_transfer_count = transfers[current_stop] + (1 if current_line and edge.line != current_line else 0)
+            new_transfer_count = transfers[current_stop.id] + (1 if current_line and edge.line != current_line else 0)
             if criteria == 't':
                 total_edge_cost = (10 if (current_line and edge.line != current_line) else 0) + edge.travel_time + wait_time
             elif criteria == 'p':
@@ -71,21 +93,43 @@ def find_a_star_path(graph, start_name, dest_name, start_time, criteria, heurist
             
             #total_edge_cost = edge.travel_time + wait_time + transfer_penalty
             new_cost = current_cost + total_edge_cost
-            arr_total = time_to_minutes(edge.arr_time)
+            arr_total = edge.arr_minutes
             
             #closedList
-            if new_cost < distance[edge.end]:
-                distance[edge.end] = new_cost
-                transfers[edge.end] = new_transfer_count
-                previous[edge.end] = (current_stop, edge, edge.line)
+            end_id = edge.end.id
+            if stamp[end_id] != epoch or new_cost < distance[end_id]:
+                stamp[end_id] = epoch
+                distance[end_id] = new_cost
+                transfers[end_id] = new_transfer_count
+                previous[end_id] = (current_stop, edge, edge.line)
                 estimated_total_cost = new_cost + heuristic_function(edge.end) #f = g + h
                 heapq.heappush(priority_queue, (estimated_total_cost, new_cost, edge.end, edge.line, arr_total))
+                pushes += 1
+        
+        #walking to a stop nearby - no waiting, and boarding after a walk is a transfer unless nothing was ridden yet
+        if footpaths is not None:
+            for end, walk_minutes in footpaths[current_stop.id]:
+                new_cost = current_cost + walk_minutes
+                end_id = end.id
+                if stamp[end_id] != epoch or new_cost < distance[end_id]:
+                    walk = Footpath(current_stop, end, current_time, walk_minutes)
+                    stamp[end_id] = epoch
+                    distance[end_id] = new_cost
+                    transfers[end_id] = transfers[current_stop.id]
+                    previous[end_id] = (current_stop, walk, WALK_LINE)
+                    heapq.heappush(priority_queue, (new_cost + heuristic_function(end), new_cost, end, WALK_LINE if current_line is not None else None, walk.arr_minutes))
+                    pushes += 1
     
-    stop_algorithm_time = datetime.now()
-    log(f"A* execution time: {stop_algorithm_time - start_algorithm_time} seconds")
+    path, final_arrival_time = reconstruct_path(workspace, start_node, dest_node)
+    counters = {'pushes': pushes, 'pops': expanded, 'expanded': expanded - stale_pops, 'stale_pops': stale_pops,
+                'edges_scanned': edges_scanned, 'edges_skipped': out_edges - edges_scanned}
+    if stats is not None:
+        for name, value in counters.items():
+            stats[name] = stats.get(name, 0) + value
+    emit('search', engine='astar', criteria=criteria, heuristic=heuristic, duration_ms=elapsed_ms(start_algorithm_time), **counters,
+         path_length=len(path) if path else None)
     
-    path, final_arrival_time = reconstruct_path(previous, start_node, dest_node)
-    total_travel_time = calculate_total_travel_time(start_total, final_arrival_time)
+    total_travel_time = calculate_total_travel_time(start_total, final_arrival_time) if path else None
     #print(f'PATH: {path}')
-    return path, total_travel_time, distance[dest_node]
+    return path, total_travel_time, workspace.get_distance(dest_node)
     # 
@@ -0,0 +1,145 @@
+import heapq
+from time import perf_counter
+from utils import time_to_minutes, calculate_total_travel_time
+from instrumentation import emit, elapsed_ms
+from spatial import WALK_LINE, Footpath, get_footpaths
+
+#k alternative journeys from one search - a multi-label Dijkstra instead of re-running on modified graphs
+#
+#  every stop keeps up to k labels (arrival, transfers, line, lines ridden) instead of one; a new label is
+#  pruned when a kept one dominates it - no later, no more transfers and the same line (it can do everything
+#  the new one can) or the same sequence of lines (too similar to be worth a second label) - and evicts
+#  the kept labels it dominates; a full stop only takes a label arriving earlier than its latest one
+#  evicted labels already queued are skipped when popped
+#  labels reaching the destination become journeys unless their rides - the (line, boarding stop) pairs -
+#  overlap an accepted journey by more than max_similarity (Jaccard)
+#  work bound: the search stops after work_factor times the heap pops it needed for its first journey,
+#  i.e. what a single query costs, or once labels cost more than stretch times the best journey
+
+
+DEFAULT_K = 3
+MAX_SIMILARITY = 0.5
+STRETCH = 1.5  #alternatives cost at most STRETCH times the best journey...
+MIN_SLACK = 15  #...or the best journey + MIN_SLACK minutes, whichever is more
+WORK_FACTOR = 4
+
+
+def ride_signature(path):
+    """(line, boarding stop) pairs of the rides of a path, walks left out"""
+    rides, current_line = set(), None
+    for prev_node, _, _, line in path:
+        if line != current_line and line != WALK_LINE:
+            rides.add((line, prev_node.name))
+        current_line = line
+    return rides
+
+
+def similarity(rides, other_rides):
+    union = rides | other_rides
+    return len(rides & other_rides) / len(union) if union else 1.0
+
+
+def reconstruct_labels(labels, index):
+    """Path of a label, following the parent indexes back to the start"""
+    path = []
+    while labels[index][0] is not None:
+        parent, edge, stop, line = labels[index]
+        path.append((labels[parent][2], edge, stop, line))
+        index = parent
+    path.reverse()
+    return path
+
+
+def find_alternative_paths(graph, starting_stop_name, destination_stop_name, start_time, criteria, k=DEFAULT_K,
+                           max_similarity=MAX_SIMILARITY, work_factor=WORK_FACTOR, footpath_radius=None):
+    """Up to k diverse journeys [(path, total_travel_time)], best first - [] when the destination is unreachable"""
+    start_algorithm_time = perf_counter()
+    starting_stop = graph.get_node(starting_stop_name)
+    destination_stop = graph.get_node(destination_stop_name)
+
+    if not starting_stop or not destination_stop:
+        print("Error: Invalid start or destination stop")
+        return []
+
+    start_total = time_to_minutes(start_time)
+    transfer_penalty = 10 if criteria == 't' else 100
+    footpaths = get_footpaths(graph, footpath_radius)
+
+    labels = [(None, None, starting_stop, None)]  #(parent label index, edge, stop, line)
+    bags = {starting_stop.id: [(start_total, 0, None, (), 0)]}  #stop id -> kept (arrival, transfers, line, lines ridden, label index)
+    evicted = set()
+
+    #priority queue: (total_cost, arrival, transfers, label index, line, lines ridden)
+    priority_queue = [(0, start_total, 0, 0, None, ())]
+    journeys, accepted_rides = [], []
+    cost_limit, budget = None, None
+    pushes, pops, pruned = 1, 0, 0  #counters for the 'search' event
+
+    def push(cost, arrival, transfers, parent, edge, stop, line, lines):
+        nonlocal pushes, pruned
+        bag = bags.setdefault(stop.id, [])
+        kept = []
+        for label in bag:
+            kept_arrival, kept_transfers, kept_line, kept_lines, kept_index = label
+            if kept_line == line or kept_lines == lines:
+                if kept_arrival <= arrival and kept_transfers <= transfers:
+                    pruned += 1
+                    return
+                if arrival <= kept_arrival and transfers <= kept_transfers:
+                    evicted.add(kept_index)
+                    continue
+            kept.append(label)
+        #the destination is not capped - its labels may still be turned down as too similar journeys
+        if len(kept) >= k and stop != destination_stop:
+            latest = max(kept, key=lambda label: label[0])
+            if latest[0] <= arrival:
+                pruned += 1
+                return
+            kept.remove(latest)
+            evicted.add(latest[4])
+        labels.append((parent, edge, stop, line))
+        kept.append((arrival, transfers, line, lines, len(labels) - 1))
+        bags[stop.id] = kept
+        heapq.heappush(priority_queue, (cost, arrival, transfers, len(labels) - 1, line, lines))
+        pushes += 1
+
+    while priority_queue:
+        current_cost, current_time, current_transfers, index, current_line, current_lines = heapq.heappop(priority_queue)
+        pops += 1
+        if index in evicted:
+            continue
+        if (cost_limit is not None and current_cost > cost_limit) or (budget is not None and pops > budget):
+            break
+
+        current_stop = labels[index][2]
+        if current_stop == destination_stop:
+            path = reconstruct_labels(labels, index)
+            rides = ride_signature(path)
+            if all(similarity(rides, other) <= max_similarity for other in accepted_rides):
+                journeys.append((path, calculate_total_travel_time(start_total, current_time)))
+                accepted_rides.append(rides)
+                if cost_limit is None:
+                    cost_limit = max(current_cost * STRETCH, current_cost + MIN_SLACK)
+                    budget = pops * work_factor
+                if len(journeys) == k:
+                    break
+            continue
+
+        for neighbor_edge in graph.get_departures(current_stop, current_time, first_per_route=True):
+            #a transfer is a change of vehicle - another line, or any boarding after a walk
+            changes_line = bool(current_lines) and neighbor_edge.line != current_lines[-1]
+            new_cost = current_cost + (transfer_penalty if changes_line else 0) + (neighbor_edge.dep_minutes - current_time) + neighbor_edge.travel_time
+            new_lines = current_lines + (neighbor_edge.line,) if changes_line or not current_lines else current_lines
+            push(new_cost, neighbor_edge.arr_minutes, current_transfers + (1 if changes_line else 0), index,
+                 neighbor_edge, neighbor_edge.end, neighbor_edge.line, new_lines)
+
+        #walking to a stop nearby - the walk ends the ride, so whatever is boarded next is a transfer
+        if footpaths is not None:
+            walked_lines = current_lines + (WALK_LINE,) if current_lines and current_lines[-1] != WALK_LINE else current_lines
+            for end, walk_minutes in footpaths[current_stop.id]:
+                walk = Footpath(current_stop, end, current_time, walk_minutes)
+                push(current_cost + walk_minutes, walk.arr_minutes, current_transfers, index, walk, end, WALK_LINE, walked_lines)
+
+    emit('search', engine='alternatives', criteria=criteria, duration_ms=elapsed_ms(start_algorithm_time), pushes=pushes, pops=pops,
+         pruned=pruned, labels=len(labels), journeys=len(journeys), budget=budget)
+    return journeys
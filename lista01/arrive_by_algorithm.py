@@ -0,0 +1,132 @@
+import heapq
+from time import perf_counter
+from utils import time_to_minutes, calculate_total_travel_time
+from workspace import SearchWorkspace
+from instrumentation import emit, elapsed_ms, span
+from spatial import WALK_LINE, Footpath, get_footpaths
+
+#arrive-by queries - leave the start as late as possible and still reach the destination by a given time
+#
+#  find_dijkstra_path run backwards: the search starts at the destination with the arrive-by time and
+#  follows the reverse index (incoming edges sorted by arr_minutes) towards the start; the label of a stop
+#  is the latest time one can be there and still make it, the cost is waiting + riding counted from the
+#  arrive-by time (plus transfer penalties for 'p'), so for 't' the cheapest label at the start is exactly
+#  the latest departure - the search is label-setting, waiting at a stop never lets one leave later
+#  connections crossing midnight are skipped - riding them would mean leaving the day before
+
+
+def reconstruct_forward(next_hops, starting_stop, destination_stop):
+    """Path from the start along the next-hop labels, (None, None) if the start was not reached"""
+    with span('reconstruct') as event:
+        path = []
+        current = starting_stop
+        while current != destination_stop:
+            next_node, edge_used, line_used = next_hops.get(current, (None, None, None))
+            if next_node is None:
+                event['path_length'] = None
+                return None, None
+            path.append((current, edge_used, next_node, line_used))
+            current = next_node
+        event['path_length'] = len(path)
+    return path, path[0][1].dep_minutes if path else None
+
+
+def find_arrive_by_path(graph, starting_stop_name, destination_stop_name, arrive_time, criteria, workspace=None, footpath_radius=None):
+    """Latest departure from the start arriving at the destination by arrive_time
+
+    returns (path, total_travel_time) like find_dijkstra_path - the path starts at the latest departure,
+    so print_path(path, start, minutes_to_time(path[0][1].dep_minutes), total_travel_time) shows it
+    """
+    start_algorithm_time = perf_counter()
+    starting_stop = graph.get_node(starting_stop_name)
+    destination_stop = graph.get_node(destination_stop_name)
+
+    if not starting_stop or not destination_stop:
+        print("Error: Invalid start or destination stop")
+        return None, None
+
+    arrive_total = time_to_minutes(arrive_time)
+
+    #labels by node.id: distance - cost, latest - latest time at the stop, previous - the next hop towards the destination,
+    #transfers - changes between the lines ridden from the stop on
+    workspace = (workspace or SearchWorkspace(len(graph.get_nodes()))).reset()
+    stamp, epoch = workspace.stamp, workspace.epoch
+    distance, next_hops, latest, transfers = workspace.distance, workspace.previous, workspace.arrival, workspace.transfers
+
+    stamp[destination_stop.id] = epoch
+    distance[destination_stop.id] = 0
+    transfers[destination_stop.id] = 0
+    latest[destination_stop.id] = arrive_total
+    next_hops[destination_stop.id] = (None, None, None)
+
+    footpaths = get_footpaths(graph, footpath_radius)
+
+    #priority queue: (total_cost, -latest time, current_stop, line leaving current_stop)
+    priority_queue = [(0, -arrive_total, destination_stop, None)]
+    pushes, pops, stale_pops, edges_scanned = 1, 0, 0, 0  #counters for the 'search' event
+
+    while priority_queue:
+        current_cost, negative_time, current_stop, current_line = heapq.heappop(priority_queue)
+        current_time = -negative_time
+        pops += 1
+
+        if current_cost > distance[current_stop.id]:
+            stale_pops += 1
+            continue
+
+        if current_stop == starting_stop:
+            break
+
+        #per (line, previous stop) only the last arrival at or before current time and earlier ones that left later
+        for neighbor_edge in graph.get_arrivals(current_stop, current_time, last_per_route=True):
+            edges_scanned += 1
+            dep_total = neighbor_edge.dep_minutes
+            arr_total = neighbor_edge.arr_minutes
+            if dep_total > arr_total:
+                continue
+
+            wait_time = current_time - arr_total
+            new_transfer_count = transfers[current_stop.id] + (1 if (current_line is not None and neighbor_edge.line != current_line) else 0)
+            if criteria == 't':  #time-optimized - the cost is exactly how much earlier than arrive_total one leaves
+                total_edge_cost = neighbor_edge.travel_time + wait_time
+            else:  #transfer-optimized, the penalty grows with every transfer as in the forward engines
+                total_edge_cost = (100*new_transfer_count if (current_line is not None and neighbor_edge.line != current_line) else 0) + neighbor_edge.travel_time + wait_time
+
+            new_cost = current_cost + total_edge_cost
+            start_id = neighbor_edge.start.id
+            if stamp[start_id] != epoch or new_cost < distance[start_id]:
+                stamp[start_id] = epoch
+                distance[start_id] = new_cost
+                latest[start_id] = dep_total
+                transfers[start_id] = new_transfer_count
+                next_hops[start_id] = (current_stop, neighbor_edge, neighbor_edge.line)
+                heapq.heappush(priority_queue, (new_cost, -dep_total, neighbor_edge.start, neighbor_edge.line))
+                pushes += 1
+
+        #walking from a stop nearby - footpaths are symmetric, the walk ends when current_stop must be left;
+        #the line ridden before the walk is a transfer away from the one ridden after it
+        if footpaths is not None:
+            for start, walk_minutes in footpaths[current_stop.id]:
+                dep_total = current_time - walk_minutes
+                if dep_total < 0:
+                    continue
+                new_cost = current_cost + walk_minutes
+                start_id = start.id
+                if stamp[start_id] != epoch or new_cost < distance[start_id]:
+                    stamp[start_id] = epoch
+                    distance[start_id] = new_cost
+                    latest[start_id] = dep_total
+                    transfers[start_id] = transfers[current_stop.id]
+                    next_hops[start_id] = (current_stop, Footpath(start, current_stop, dep_total, walk_minutes), WALK_LINE)
+                    heapq.heappush(priority_queue, (new_cost, -dep_total, start, WALK_LINE if current_line is not None else None))
+                    pushes += 1
+
+    path, departure = reconstruct_forward(workspace, starting_stop, destination_stop)
+    emit('search', engine='arrive_by', criteria=criteria, duration_ms=elapsed_ms(start_algorithm_time), pushes=pushes, pops=pops,
+         stale_pops=stale_pops, edges_scanned=edges_scanned, path_length=len(path) if path else None)
+    if path is None:
+        print("Error reconstructing path")
+        return None, None
+
+    total_travel_time = calculate_total_travel_time(departure, path[-1][1].arr_minutes) if path else 0
+    return path, total_travel_time
@@ -0,0 +1,196 @@
+import io
+import os
+import csv
+import argparse
+import multiprocessing
+from contextlib import redirect_stdout
+from time import perf_counter
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from utils import get_graph, time_to_minutes, minutes_to_time
+from dijkstra_algorithm import find_dijkstra_path
+from a_algorithm import find_a_star_path
+from workspace import get_workspace
+from landmarks import get_landmarks
+from instrumentation import JsonLinesSink, set_sink
+from spatial import WALK_LINE
+
+#batch routing: many origin-destination queries against one graph loaded once
+#
+#  the graph is loaded in the parent and the workers are forked afterwards, so they inherit it
+#  copy-on-write instead of receiving a pickled copy with every task (with --compact the columns
+#  are a read-only mmap of the snapshot and stay shared for good)
+#  queries go out in small batches, results are written to the output csv as the batches finish,
+#  in completion order - the query column keeps the input row number
+#  a query that raises (a malformed time, a bug in an engine) is recorded with its error and the batch
+#  goes on, as do the queries of a batch whose worker died
+#
+#  usage: python batch.py queries.csv results.csv [--algorithm astar] [--criteria p] [--workers 4]
+#  the query csv is either headed (start_stop, end_stop, departure_time[, criteria]) like
+#  connection_graph.csv, or headerless in the output.csv layout
+
+BATCH_SIZE = 32
+RESULT_COLUMNS = ('query', 'start_stop', 'end_stop', 'departure_time', 'criteria', 'arrival_time',
+                  'travel_time', 'transfers', 'lines', 'error', 'latency_ms')
+OUTPUT_CSV_COLUMNS = {'departure_time': 3, 'start_stop': 5, 'end_stop': 6}
+
+_graph = None  #set in the parent before the pool forks
+_options = None
+
+
+def read_queries(filename, default_criteria):
+    """[(start, end, departure_time, criteria)] from a query csv"""
+    with open(filename, encoding='utf-8', newline='') as file:
+        rows = csv.reader(file)
+        first = next(rows, None)
+        if first is None:
+            return []
+        if 'start_stop' in first:
+            indices = {name: first.index(name) for name in ('start_stop', 'end_stop', 'departure_time')}
+            criteria_index = first.index('criteria') if 'criteria' in first else None
+        else:
+            indices, criteria_index = OUTPUT_CSV_COLUMNS, None
+            rows = [first] + list(rows)
+
+        queries = []
+        for row in rows:
+            if not row:
+                continue
+            criteria = row[criteria_index] if criteria_index is not None else default_criteria
+            queries.append((row[indices['start_stop']], row[indices['end_stop']], row[indices['departure_time']][:5], criteria))
+        return queries
+
+
+def route_query(start, end, start_time, criteria):
+    """(arrival_time, travel_time, transfers, lines) of one query, Nones when there is no path"""
+    algorithm, heuristic = _options
+    if algorithm == 'astar':
+        result = find_a_star_path(_graph, start, end, start_time, criteria, heuristic, workspace=get_workspace(_graph))
+        path, travel_time = result[:2] if result else (None, None)
+    else:
+        path, travel_time = find_dijkstra_path(_graph, start, end, start_time, criteria, get_workspace(_graph))
+    if not path:
+        return None, None, None, None
+
+    lines = []
+    for _, _, _, line in path:
+        if not lines or lines[-1] != line:
+            lines.append(line)
+    arrival = minutes_to_time(time_to_minutes(start_time) + travel_time)
+    return arrival, travel_time, max(len([line for line in lines if line != WALK_LINE]) - 1, 0), ' '.join(lines)
+
+
+def run_batch(batch):
+    """Result rows of (index, query) pairs, with the error (None if the query ran) and wall time of each query"""
+    rows = []
+    for index, (start, end, start_time, criteria) in batch:
+        start_query = perf_counter()
+        try:
+            with redirect_stdout(io.StringIO()):  #the engines print their errors
+                result, error = route_query(start, end, start_time, criteria), None
+        except Exception as exception:
+            result, error = (None, None, None, None), f"{type(exception).__name__}: {exception}"
+        latency = (perf_counter() - start_query) * 1000
+        rows.append((index, start, end, start_time, criteria) + result + (error, round(latency, 3)))
+    return rows
+
+
+def failed_batch(batch, error):
+    """Result rows of a batch that did not come back from its worker"""
+    return [(index, start, end, start_time, criteria, None, None, None, None, error, 0.0)
+            for index, (start, end, start_time, criteria) in batch]
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(fraction * len(sorted_values)))]
+
+
+class BatchStats:
+    def __init__(self, latencies, failed, errors, seconds, workers):
+        self.latencies = sorted(latencies)
+        self.failed = failed
+        self.errors = errors
+        self.seconds = seconds
+        self.workers = workers
+
+    def __str__(self):
+        count = len(self.latencies)
+        mean = sum(self.latencies) / count if count else 0.0
+        return (f"{count} queries ({self.failed} without a path, {self.errors} failed) in {self.seconds:.2f} s on {self.workers} workers, "
+                f"{count / self.seconds if self.seconds else 0.0:.1f} queries/s\n"
+                f"latency ms: mean {mean:.2f}, p50 {percentile(self.latencies, 0.5):.2f}, "
+                f"p90 {percentile(self.latencies, 0.9):.2f}, p99 {percentile(self.latencies, 0.99):.2f}, "
+                f"max {self.latencies[-1] if count else 0.0:.2f}")
+
+
+def route_batch(graph, queries, output_file, algorithm='dijkstra', heuristic='manhattan', workers=None, batch_size=BATCH_SIZE):
+    """Route every (start, end, departure_time, criteria) query and stream the results to output_file, returns BatchStats
+
+    workers=None uses every core, workers=1 (or a platform without fork) routes in this process
+    """
+    global _graph, _options
+    _graph, _options = graph, (algorithm, heuristic)
+    if algorithm == 'astar' and heuristic == 'alt':
+        get_landmarks(graph)  #built once here and inherited by the workers, not once per worker
+    workers = workers or os.cpu_count() or 1
+    numbered = list(enumerate(queries))
+    batches = [numbered[i:i + batch_size] for i in range(0, len(numbered), batch_size)]
+
+    latencies, failed, errors = [], 0, 0
+    start_time = perf_counter()
+    with open(output_file, 'w', encoding='utf-8', newline='') as file:
+        writer = csv.writer(file)
+        writer.writerow(RESULT_COLUMNS)
+
+        def write(rows):
+            nonlocal failed, errors
+            writer.writerows(rows)
+            file.flush()
+            for row in rows:
+                latencies.append(row[-1])
+                if row[-2] is not None:
+                    errors += 1
+                else:
+                    failed += row[5] is None
+
+        if workers == 1 or len(batches) <= 1 or 'fork' not in multiprocessing.get_all_start_methods():
+            workers = 1
+            for batch in batches:
+                write(run_batch(batch))
+        else:
+            with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('fork')) as executor:
+                futures = {executor.submit(run_batch, batch): batch for batch in batches}
+                for future in as_completed(futures):
+                    try:
+                        rows = future.result()
+                    except Exception as exception:  #the worker died (BrokenProcessPool) - its queries fail, not the run
+                        rows = failed_batch(futures[future], f"{type(exception).__name__}: {exception}")
+                    write(rows)
+
+    return BatchStats(latencies, failed, errors, perf_counter() - start_time, workers)
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description="Batch public transport routing")
+    parser.add_argument('queries', help="query csv (start_stop, end_stop, departure_time[, criteria])")
+    parser.add_argument('output', help="result csv, written as queries finish")
+    parser.add_argument('--algorithm', choices=['dijkstra', 'astar'], default='dijkstra')
+    parser.add_argument('--heuristic', choices=['euclidean', 'manhattan', 'haversine', 'alt'], default='manhattan')
+    parser.add_argument('--criteria', choices=['t', 'p'], default='t', help="used when the query csv has no criteria column")
+    parser.add_argument('--workers', type=int, default=None, help="worker processes (default: one per core)")
+    parser.add_argument('--compact', action='store_true', help="route on the memory-mapped compact graph")
+    parser.add_argument('--trace', default=None, help="append load and per-query search events to this file as JSON lines")
+    parser.add_argument('--delta-log', default=None, help="replay this timetable update log onto the graph")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    arguments = parse_arguments()
+    if arguments.trace:
+        set_sink(JsonLinesSink(arguments.trace))
+    graph = get_graph(compact=arguments.compact, verbose=True, delta_log=arguments.delta_log)
+    queries = read_queries(arguments.queries, arguments.criteria)
+    print(f"Routing {len(queries)} queries...")
+    stats = route_batch(graph, queries, arguments.output, arguments.algorithm, arguments.heuristic, arguments.workers)
+    print(stats)
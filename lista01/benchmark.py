@@ -0,0 +1,207 @@
+import io
+import sys
+import random
+import tracemalloc
+from contextlib import redirect_stdout
+from time import perf_counter
+from utils import get_graph
+from compact_graph import CompactGraph
+from dijkstra_algorithm import find_dijkstra_path
+from a_algorithm import find_a_star_path
+from landmarks import get_landmarks
+from raptor_algorithm import find_raptor_journeys
+from profile_algorithm import find_profile
+from trip_based_algorithm import find_trip_based_journeys
+from transfers import get_trip_transfers
+from workspace import INFINITY, NO_PREVIOUS, SearchWorkspace, get_workspace
+from graph import minutes_to_time
+
+#micro benchmarks for the graph backends and search engines
+#usage: python benchmark.py <name>  (run from the directory containing connection_graph.csv)
+
+
+def measure(function, repeat=1):
+    """Average wall time of function() in seconds and its last result"""
+    start = perf_counter()
+    for _ in range(repeat):
+        result = function()
+    return (perf_counter() - start) / repeat, result
+
+
+def measure_memory(function):
+    """Bytes still allocated by function() after it returns, and its result"""
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    result = function()
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return after - before, result
+
+
+def quietly(function, *args):
+    #the engines still print progress - keep it out of the timings output
+    with redirect_stdout(io.StringIO()):
+        return function(*args)
+
+
+def random_queries(graph, count, seed=0):
+    rng = random.Random(seed)
+    names = [node.name for node in graph.get_nodes() if node.get_outgoing_edges()]
+    return [(rng.choice(names), rng.choice(names), f"{rng.randint(6, 20):02d}:{rng.randint(0, 59):02d}") for _ in range(count)]
+
+
+def walk_objects(graph):
+    total = 0
+    for node in graph.get_nodes():
+        for edge in node.get_outgoing_edges():
+            total += edge.arr_minutes - edge.dep_minutes
+    return total
+
+
+def walk_columns(graph):
+    total = 0
+    dep_minutes, arr_minutes = graph.dep_minutes, graph.arr_minutes
+    for stop_id in range(len(graph.nodes)):
+        lo, hi = graph.get_edge_range(stop_id)
+        for index in range(lo, hi):
+            total += arr_minutes[index] - dep_minutes[index]
+    return total
+
+
+def benchmark_compact():
+    object_bytes, graph = measure_memory(lambda: quietly(get_graph))
+    compact_bytes, compact = measure_memory(lambda: CompactGraph.from_graph(graph))
+    print(f"Graph: {len(graph.nodes)} stops, {len(graph.edges)} connections")
+    print(f"Memory  objects: {object_bytes / 2**20:8.1f} MB   compact: {compact_bytes / 2**20:8.1f} MB   ({object_bytes / compact_bytes:.1f}x smaller)")
+
+    object_time, _ = measure(lambda: walk_objects(graph), repeat=3)
+    view_time, _ = measure(lambda: walk_objects(compact), repeat=3)
+    column_time, _ = measure(lambda: walk_columns(compact), repeat=3)
+    print(f"Full scan  objects: {object_time * 1000:8.1f} ms   compact views: {view_time * 1000:8.1f} ms   compact columns: {column_time * 1000:8.1f} ms")
+
+    queries = random_queries(graph, 20)
+    object_time, _ = measure(lambda: [quietly(find_dijkstra_path, graph, *query, 't') for query in queries])
+    compact_time, _ = measure(lambda: [quietly(find_dijkstra_path, compact, *query, 't') for query in queries])
+    print(f"Dijkstra ({len(queries)} queries)  objects: {object_time * 1000:8.1f} ms   compact views: {compact_time * 1000:8.1f} ms")
+
+
+def benchmark_profile(origin="PL. GRUNWALDZKI", destination="Wrocławski Park Przemysłowy", window_start="14:00", window_end="16:00"):
+    graph = quietly(get_graph)
+    minutes = range(int(window_start[:2]) * 60 + int(window_start[3:]), int(window_end[:2]) * 60 + int(window_end[3:]) + 1)
+    quietly(find_profile, graph, origin, destination, window_start, window_end, 't')  #build the trip timetable outside the timings
+
+    profile_time, profile = measure(lambda: quietly(find_profile, graph, origin, destination, window_start, window_end, 'p'))
+    raptor_time, _ = measure(lambda: [quietly(find_raptor_journeys, graph, origin, destination, minutes_to_time(minute)) for minute in minutes])
+    dijkstra_time, _ = measure(lambda: [quietly(find_dijkstra_path, graph, origin, destination, minutes_to_time(minute), 't') for minute in minutes])
+    print(f"{origin} -> {destination}, departures {window_start}-{window_end}: {len(profile)} Pareto-optimal journeys")
+    print(f"Profile query: {profile_time * 1000:8.1f} ms")
+    print(f"RAPTOR every minute ({len(minutes)} queries): {raptor_time * 1000:8.1f} ms ({raptor_time / profile_time:.1f}x slower)")
+    print(f"Dijkstra every minute ({len(minutes)} queries): {dijkstra_time * 1000:8.1f} ms ({dijkstra_time / profile_time:.1f}x slower)")
+
+
+def benchmark_alt(count=50):
+    graph = quietly(get_graph)
+    build_time, _ = measure(lambda: get_landmarks(graph))
+    print(f"Landmark preprocessing: {build_time * 1000:8.1f} ms")
+
+    queries = random_queries(graph, count)
+    for heuristic in ['euclidean', 'manhattan', 'haversine', 'alt']:
+        stats, costs = {}, []
+        elapsed, _ = measure(lambda: [costs.append(quietly(find_a_star_path, graph, *query, 't', heuristic, stats)[2]) for query in queries])
+        print(f"{heuristic:10}  nodes expanded: {stats['expanded'] / len(queries):8.1f}   latency: {elapsed / len(queries) * 1000:7.2f} ms   "
+              f"mean cost: {sum(costs) / len(costs):6.1f}")
+
+
+def benchmark_trip_based(count=100):
+    graph = quietly(get_graph)
+    preprocessing_time, transfers = measure(lambda: quietly(get_trip_transfers, graph))
+    print(f"Trip transfers: {len(transfers)} for {len(transfers.timetable.trips)} trips, loaded or computed in {preprocessing_time:.2f} s")
+
+    queries = random_queries(graph, count)
+    #both return the Pareto set over (arrival, transfers) - it has to be the same
+    mismatches = [query for query in queries
+                  if [journey[1:] for journey in quietly(find_trip_based_journeys, graph, *query)]
+                  != [journey[1:] for journey in quietly(find_raptor_journeys, graph, *query)]]
+    print(f"Pareto sets matching RAPTOR: {len(queries) - len(mismatches)}/{len(queries)}")
+    for query in mismatches[:5]:
+        print(f"  mismatch: {query}")
+    for name, function in [('Dijkstra (t)', lambda query: find_dijkstra_path(graph, *query, 't')),
+                           ('RAPTOR', lambda query: find_raptor_journeys(graph, *query)),
+                           ('trip-based', lambda query: find_trip_based_journeys(graph, *query))]:
+        elapsed, _ = measure(lambda: [quietly(function, query) for query in queries])
+        print(f"{name:12}  latency: {elapsed / len(queries) * 1000:7.2f} ms")
+
+
+def short_queries(graph, count, seed=0):
+    """Queries between neighbouring stops, where the search itself is tiny"""
+    rng = random.Random(seed)
+    queries = []
+    for node in rng.sample([node for node in graph.get_nodes() if node.get_outgoing_edges()], count):
+        edge = node.get_outgoing_edges()[len(node.get_outgoing_edges()) // 2]
+        queries.append((node.name, edge.end.name, edge.dep_time[:5]))
+    return queries
+
+
+class DictWorkspace:
+    """The labels the engines kept before SearchWorkspace - dicts over every stop built for each query
+
+    every stop is stamped with the one epoch, so the engines compare against the infinite initial
+    labels exactly like the dict-based code did
+    """
+    epoch = 1
+
+    def __init__(self, nodes):
+        self.nodes = nodes
+
+    def reset(self):
+        nodes = self.nodes
+        self.stamp = {node.id: 1 for node in nodes}
+        self.distance = {node.id: INFINITY for node in nodes}
+        self.arrival = {node.id: INFINITY for node in nodes}
+        self.transfers = {node.id: INFINITY for node in nodes}
+        self.previous = {node.id: NO_PREVIOUS for node in nodes}
+        return self
+
+    def get(self, node, default=NO_PREVIOUS):
+        return self.previous.get(node.id, default)
+
+    def get_distance(self, node):
+        return self.distance[node.id]
+
+
+def benchmark_workspace(count=200):
+    graph = quietly(get_graph)
+    queries = short_queries(graph, count)
+    nodes = graph.get_nodes()
+    dict_time, _ = measure(lambda: [({node: float('inf') for node in nodes}, {node: (None, None, None) for node in nodes},
+                                     {node: float('inf') for node in nodes}) for _ in range(100)])
+    array_time, _ = measure(lambda: [SearchWorkspace(len(nodes)) for _ in range(100)])
+    print(f"Graph: {len(nodes)} stops, {len(queries)} queries between neighbouring stops")
+    print(f"Label setup  per-query dicts: {dict_time * 10:7.3f} ms   fresh workspace: {array_time * 10:7.3f} ms   reused workspace: O(1) epoch bump")
+
+    for name, function in [('Dijkstra (t)', lambda query, workspace: find_dijkstra_path(graph, *query, 't', workspace)),
+                           ('A* manhattan', lambda query, workspace: find_a_star_path(graph, *query, 't', 'manhattan', workspace=workspace))]:
+        dict_workspace = DictWorkspace(nodes)
+        [quietly(function, query, None) for query in queries]  #warm up
+        dict_time, dict_results = measure(lambda: [quietly(function, query, dict_workspace) for query in queries], repeat=5)
+        fresh_time, _ = measure(lambda: [quietly(function, query, None) for query in queries], repeat=5)
+        reused_time, reused_results = measure(lambda: [quietly(function, query, get_workspace(graph)) for query in queries], repeat=5)
+        same = sum(dict_result[1] == reused_result[1] for dict_result, reused_result in zip(dict_results, reused_results))
+        print(f"{name:12}  latency  per-query dicts (before): {dict_time / len(queries) * 1000:7.3f} ms   "
+              f"fresh workspace: {fresh_time / len(queries) * 1000:7.3f} ms   reused workspace: {reused_time / len(queries) * 1000:7.3f} ms   "
+              f"same travel times: {same}/{len(queries)}")
+
+
+BENCHMARKS = {
+    'compact': benchmark_compact,
+    'profile': benchmark_profile,
+    'alt': benchmark_alt,
+    'trip_based': benchmark_trip_based,
+    'workspace': benchmark_workspace,
+}
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2 or sys.argv[1] not in BENCHMARKS:
+        print(f"Usage: python benchmark.py [{'|'.join(BENCHMARKS)}]")
+        sys.exit(1)
+    BENCHMARKS[sys.argv[1]]()
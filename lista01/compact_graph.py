@@ -0,0 +1,307 @@
+import sys
+import bisect
+from array import array
+from graph import Graph, Node, Edge, StopLookup, DerivedData, INFINITE_MINUTES, minutes_to_time
+
+#CompactGraph: the timetable in CSR form
+#  stops are integer ids 0..n-1, the outgoing connections of stop i are rows offsets[i]..offsets[i+1]-1
+#  of the parallel columns (targets, lines, dep_minutes, arr_minutes), sorted by dep_minutes within a stop
+#  stop and line names are interned once and referenced by id
+#  the reverse index (incoming rows per stop, sorted by arr_minutes) is another CSR built on the first arrive-by search
+#  bucket_offsets splits every stop's rows further into BUCKET_COUNT departure-time buckets: the rows of stop i
+#  departing in bucket b are bucket_offsets[i * BUCKET_COUNT + b]..bucket_offsets[i * BUCKET_COUNT + b + 1]-1
+#  (the lazy WindowedGraph materializes a bucket at a time)
+
+BUCKET_MINUTES = 60
+BUCKET_COUNT = 24 * 60 // BUCKET_MINUTES
+
+
+#Node-like view of one stop
+class CompactNode:
+    __slots__ = ('graph', 'id', 'name', 'lat', 'lon')
+
+    def __init__(self, graph, stop_id):
+        self.graph = graph
+        self.id = stop_id
+        self.name = graph.stop_names[stop_id]
+        self.lat = graph.stop_lat[stop_id]
+        self.lon = graph.stop_lon[stop_id]
+
+    def get_outgoing_edges(self):
+        return self.graph.get_outgoing_edges(self.id)
+
+    def get_departures(self, after_minutes, first_per_route=False):
+        return self.graph.get_departures(self, after_minutes, first_per_route)
+
+    def get_arrivals(self, before_minutes, last_per_route=False):
+        return self.graph.get_arrivals(self, before_minutes, last_per_route)
+
+    def __eq__(self, other):
+        if isinstance(other, CompactNode):
+            return self.name == other.name
+        return False
+
+    #arbitrary but necessary for heapq
+    def __lt__(self, other):
+        return self.name < other.name
+
+    def __hash__(self):
+        return hash(self.name)
+
+    def __str__(self):
+        return f"Node({self.name}, lat={self.lat}, lon={self.lon})"
+
+    def __repr__(self):
+        return f"CompactNode(id={self.id}, name='{self.name}', lat={self.lat}, lon={self.lon})"
+
+
+#Edge-like view of one connection row, fields are read from the columns on access
+class CompactEdge:
+    __slots__ = ('graph', 'index', 'start')
+
+    def __init__(self, graph, index, start):
+        self.graph = graph
+        self.index = index
+        self.start = start
+
+    @property
+    def end(self):
+        return self.graph.nodes[self.graph.targets[self.index]]
+
+    @property
+    def line(self):
+        return self.graph.line_names[self.graph.lines[self.index]]
+
+    @property
+    def dep_minutes(self):
+        return self.graph.dep_minutes[self.index]
+
+    @property
+    def arr_minutes(self):
+        return self.graph.arr_minutes[self.index]
+
+    @property
+    def travel_time(self):
+        return (self.graph.arr_minutes[self.index] - self.graph.dep_minutes[self.index]) % (24 * 60)
+
+    @property
+    def dep_time(self):
+        return f"{minutes_to_time(self.dep_minutes)}:00"
+
+    @property
+    def arr_time(self):
+        return f"{minutes_to_time(self.arr_minutes)}:00"
+
+    def __eq__(self, other):
+        if isinstance(other, CompactEdge):
+            return self.graph is other.graph and self.index == other.index
+        return False
+
+    def __hash__(self):
+        return hash(self.index)
+
+    def __str__(self):
+        return f"Edge({self.start}, {self.end}, line={self.line}, dep_time={self.dep_time}, arr_time={self.arr_time}, travel_time={self.travel_time})"
+
+    def __repr__(self):
+        return (
+            f"CompactEdge(start={self.start.name}, end={self.end.name}, "
+            f"line='{self.line}', dep_time={self.dep_time}, arr_time={self.arr_time}, travel_time={self.travel_time})"
+        )
+
+
+#read-only sequence of edge views over all rows, stands in for Graph.edges
+class CompactEdgeList:
+    def __init__(self, graph):
+        self.graph = graph
+
+    def __len__(self):
+        return len(self.graph.targets)
+
+    def __iter__(self):
+        for node in self.graph.nodes:
+            yield from node.get_outgoing_edges()
+
+    def __getitem__(self, index):
+        start_id = self.graph.get_edge_source(index)
+        return CompactEdge(self.graph, index, self.graph.nodes[start_id])
+
+
+
+class CompactGraph(StopLookup, DerivedData):
+    def __init__(self, stop_names, stop_lat, stop_lon, line_names, offsets, targets, lines, dep_minutes, arr_minutes, bucket_offsets=None):
+        self.stop_names = stop_names
+        self.stop_lat = stop_lat
+        self.stop_lon = stop_lon
+        self.line_names = line_names
+        self.offsets = offsets
+        self.targets = targets
+        self.lines = lines
+        self.dep_minutes = dep_minutes
+        self.arr_minutes = arr_minutes
+        self.bucket_offsets = bucket_offsets #from the snapshot, or computed on first use
+
+        self.nodes = [CompactNode(self, stop_id) for stop_id in range(len(stop_names))]
+        self.edges = CompactEdgeList(self)
+        self.node_index = {node.name: node for node in self.nodes}
+        self.search_keys = None
+        self.route_counts = None #distinct (line, next stop) pairs per stop, counted on first use
+        self.incoming = None #(in_offsets, in_rows, in_sources, in_arr_minutes), built on first use
+        self.derived = {}
+        self.version = 0 #read-only, timetable updates need the object graph
+        self.source = None #sha1 of the csv the graph was built from, None when unknown
+
+    def get_nodes(self):
+        return self.nodes
+
+    def get_edges(self):
+        return self.edges
+
+    def get_edge_range(self, stop_id):
+        """Row range of the outgoing connections of a stop - for engines that read the columns directly"""
+        return self.offsets[stop_id], self.offsets[stop_id + 1]
+
+    def get_bucket_offsets(self):
+        if self.bucket_offsets is None:
+            #rows are sorted by dep_minutes within a stop, so every bucket boundary is one bisection
+            bucket_offsets = array('i')
+            for stop_id in range(len(self.stop_names)):
+                lo, hi = self.get_edge_range(stop_id)
+                bucket_offsets.extend(bisect.bisect_left(self.dep_minutes, bucket * BUCKET_MINUTES, lo, hi) for bucket in range(BUCKET_COUNT))
+            bucket_offsets.append(len(self.targets))
+            self.bucket_offsets = bucket_offsets
+        return self.bucket_offsets
+
+    def get_bucket_range(self, stop_id, bucket):
+        """Row range of the connections of a stop departing in a bucket"""
+        position = stop_id * BUCKET_COUNT + bucket
+        return self.bucket_offsets[position], self.bucket_offsets[position + 1]
+
+    def get_edge_source(self, index):
+        #offsets is sorted, so the owning stop is found by bisection
+        return bisect.bisect_right(self.offsets, index) - 1
+
+    def get_outgoing_edges(self, stop_id):
+        start = self.nodes[stop_id]
+        return [CompactEdge(self, index, start) for index in range(self.offsets[stop_id], self.offsets[stop_id + 1])]
+
+    def get_route_count(self, stop_id):
+        if self.route_counts is None:
+            self.route_counts = array('i', (
+                len({(self.lines[index], self.targets[index]) for index in range(self.offsets[i], self.offsets[i + 1])})
+                for i in range(len(self.stop_names))
+            ))
+        return self.route_counts[stop_id]
+
+    def get_out_degree(self, node):
+        lo, hi = self.get_edge_range(node.id)
+        return hi - lo
+
+    def get_departures(self, node, after_minutes, first_per_route=False):
+        """Same as Node.get_departures, bisecting the dep_minutes column of the stop's row range"""
+        lo, hi = self.get_edge_range(node.id)
+        start = bisect.bisect_left(self.dep_minutes, after_minutes, lo, hi)
+        if not first_per_route:
+            for index in range(start, hi):
+                yield CompactEdge(self, index, node)
+            return
+
+        route_count = self.get_route_count(node.id)
+        dep_minutes, arr_minutes = self.dep_minutes, self.arr_minutes
+        best_arrival, bound = {}, None  #route -> earliest arrival yielded, the latest of those once every route is seen
+        for index in range(start, hi):
+            if len(best_arrival) == route_count:
+                if bound is None:
+                    bound = max(best_arrival.values())
+                if dep_minutes[index] >= bound:
+                    return
+            route = (self.lines[index], self.targets[index])
+            arrival = dep_minutes[index] + (arr_minutes[index] - dep_minutes[index]) % (24 * 60)  #not wrapped at midnight
+            if arrival < best_arrival.get(route, INFINITE_MINUTES):
+                best_arrival[route] = arrival
+                bound = None
+                yield CompactEdge(self, index, node)
+
+    def get_incoming(self):
+        if self.incoming is None:
+            sources = array('i')
+            for stop_id in range(len(self.stop_names)):
+                sources.extend([stop_id] * (self.offsets[stop_id + 1] - self.offsets[stop_id]))
+            rows = sorted(range(len(self.targets)), key=lambda index: (self.targets[index], self.arr_minutes[index]))
+            in_offsets = array('i', [0]) * (len(self.stop_names) + 1)
+            for index in rows:
+                in_offsets[self.targets[index] + 1] += 1
+            for stop_id in range(len(self.stop_names)):
+                in_offsets[stop_id + 1] += in_offsets[stop_id]
+            self.incoming = (in_offsets, array('i', rows), array('i', (sources[index] for index in rows)),
+                             array('h', (self.arr_minutes[index] for index in rows)))
+        return self.incoming
+
+    def get_arrivals(self, node, before_minutes, last_per_route=False):
+        """Same as Node.get_arrivals, over the reverse index"""
+        in_offsets, in_rows, in_sources, in_arr_minutes = self.get_incoming()
+        lo = in_offsets[node.id]
+        end = bisect.bisect_right(in_arr_minutes, before_minutes, lo, in_offsets[node.id + 1])
+        best_departure = {}  #route -> latest departure yielded
+        for position in range(end - 1, lo - 1, -1):
+            index = in_rows[position]
+            if last_per_route:
+                route = (self.lines[index], in_sources[position])
+                departure = self.arr_minutes[index] - (self.arr_minutes[index] - self.dep_minutes[index]) % (24 * 60)
+                if departure <= best_departure.get(route, -INFINITE_MINUTES):
+                    continue
+                best_departure[route] = departure
+            yield CompactEdge(self, index, self.nodes[in_sources[position]])
+
+    @classmethod
+    def from_graph(cls, graph):
+        """Pack an object Graph into columns, keeps the per-stop departure order"""
+        stop_ids = {}
+        stop_names, stop_lat, stop_lon = [], array('d'), array('d')
+        for node in graph.get_nodes():
+            stop_ids[node.name] = len(stop_names)
+            stop_names.append(sys.intern(node.name))
+            stop_lat.append(node.lat)
+            stop_lon.append(node.lon)
+
+        line_ids = {}
+        line_names = []
+        offsets = array('i', [0])
+        targets, lines, dep_minutes, arr_minutes = array('i'), array('i'), array('h'), array('h')
+        for node in graph.get_nodes():
+            for edge in node.get_outgoing_edges():
+                if edge.line not in line_ids:
+                    line_ids[edge.line] = len(line_names)
+                    line_names.append(sys.intern(edge.line))
+                targets.append(stop_ids[edge.end.name])
+                lines.append(line_ids[edge.line])
+                dep_minutes.append(edge.dep_minutes)
+                arr_minutes.append(edge.arr_minutes)
+            offsets.append(len(targets))
+
+        compact = cls(stop_names, stop_lat, stop_lon, line_names, offsets, targets, lines, dep_minutes, arr_minutes)
+        compact.source = graph.source
+        return compact
+
+    def to_graph(self):
+        """Materialize Node/Edge objects - rows are already sorted per stop, so edges are appended without re-sorting"""
+        nodes = [Node(self.stop_names[i], self.stop_lat[i], self.stop_lon[i]) for i in range(len(self.stop_names))]
+        times = [f"{minutes_to_time(minutes)}:00" for minutes in range(2 * 24 * 60)]  #delayed runs may go past midnight
+        line_names = self.line_names
+        targets, lines, dep_minutes, arr_minutes = self.targets, self.lines, self.dep_minutes, self.arr_minutes
+
+        edges = []
+        for stop_id, node in enumerate(nodes):
+            outgoing_edges = node.outgoing_edges
+            for index in range(self.offsets[stop_id], self.offsets[stop_id + 1]):
+                dep, arr = dep_minutes[index], arr_minutes[index]
+                edge = Edge(node, nodes[targets[index]], line_names[lines[index]], times[dep], times[arr], (arr - dep) % (24 * 60), dep, arr)
+                outgoing_edges.append(edge)
+                nodes[targets[index]].incoming_edges.append(edge)
+                edges.append(edge)
+        for node in nodes:
+            node.incoming_edges.sort(key=lambda x: x.arr_minutes)
+
+        graph = Graph(nodes, edges)
+        graph.source = self.source
+        return graph
@@ -0,0 +1,148 @@
+import csv
+import random
+import pytest
+from ingest import ingest_csv
+
+#small synthetic timetable shared by the tests
+#
+#  STOP_COUNT stops on LINE_COUNT lines running both ways all day, one run an hour after midnight so
+#  some cross it; hop times vary from run to run, so later runs of a line overtake earlier ones
+
+STOP_COUNT = 30
+LINE_COUNT = 8
+UNREACHED = 2**31 - 1
+CSV_HEADER = ['', 'company', 'line', 'departure_time', 'arrival_time', 'start_stop', 'end_stop',
+              'start_stop_lat', 'start_stop_lon', 'end_stop_lat', 'end_stop_lon']
+
+
+def clock(minutes):
+    return f"{minutes // 60 % 24:02d}:{minutes % 60:02d}:00"
+
+
+def write_timetable(filename, seed=1):
+    """Write the synthetic connection csv, returns its stop names"""
+    rng = random.Random(seed)
+    names = [f"Stop {i}" for i in range(STOP_COUNT)]
+    coords = {name: (51.05 + rng.random() * 0.1, 16.95 + rng.random() * 0.15) for name in names}
+    rows = []
+    for line in range(LINE_COUNT):
+        route = rng.sample(names, rng.randint(6, 12))
+        hops = [rng.randint(2, 6) for _ in route[1:]]
+        headway = rng.choice([15, 20, 30])
+        for stops, times in ((route, hops), (route[::-1], hops[::-1])):
+            start = rng.randint(0, headway)
+            while start < 24 * 60 + 60:
+                minutes = start
+                for a, b, hop in zip(stops, stops[1:], times):
+                    hop += rng.choice([0, 0, 0, 3, 8])
+                    rows.append([len(rows), 'MPK', str(line + 1), clock(minutes), clock(minutes + hop), a, b, *coords[a], *coords[b]])
+                    minutes += hop
+                start += headway
+    with open(filename, 'w', encoding='utf-8', newline='') as file:
+        writer = csv.writer(file)
+        writer.writerow(CSV_HEADER)
+        writer.writerows(rows)
+    return names
+
+
+def brute_force_arrivals(graph, start_name, start_minutes, last_departure=None):
+    """Earliest arrival, in unwrapped minutes, at every reachable stop name - relaxes every hop until nothing improves
+
+    last_departure - no boarding at start_name after that minute
+    """
+    edges = sorted(graph.get_edges(), key=lambda edge: edge.dep_minutes)  #most labels settle in the first pass
+    earliest = {start_name: start_minutes}
+    changed = True
+    while changed:
+        changed = False
+        for edge in edges:
+            arrival = edge.dep_minutes + edge.travel_time
+            if last_departure is not None and edge.start.name == start_name and edge.dep_minutes > last_departure:
+                continue
+            if earliest.get(edge.start.name, UNREACHED) <= edge.dep_minutes and arrival < earliest.get(edge.end.name, UNREACHED):
+                earliest[edge.end.name] = arrival
+                changed = True
+    return earliest
+
+
+def brute_force_pareto(graph, start_name, end_name, start_minutes, max_transfers=6):
+    """[(travel time, transfers)] of the earliest arrivals with at most 0, 1, ... transfers, each one improving on the last
+
+    a transfer is a change of line, labels are kept per (line, transfers) at every stop
+    """
+    edges = sorted(graph.get_edges(), key=lambda edge: edge.dep_minutes)
+    labels = {start_name: {(None, 0): start_minutes}}
+    changed = True
+    while changed:
+        changed = False
+        for edge in edges:
+            arrival = edge.dep_minutes + edge.travel_time
+            for (line, transfers), time in list(labels.get(edge.start.name, {}).items()):
+                transfers += line is not None and line != edge.line
+                if time <= edge.dep_minutes and transfers <= max_transfers:
+                    end_labels = labels.setdefault(edge.end.name, {})
+                    if arrival < end_labels.get((edge.line, transfers), UNREACHED):
+                        end_labels[(edge.line, transfers)] = arrival
+                        changed = True
+    pareto, best = [], UNREACHED
+    for transfers in range(max_transfers + 1):
+        arrival = min((time for (_, count), time in labels.get(end_name, {}).items() if count <= transfers), default=UNREACHED)
+        if arrival < best:
+            pareto.append((arrival - start_minutes, transfers))
+            best = arrival
+    return pareto
+
+
+def ride(path, start_name, end_name, start_minutes):
+    """Arrival, in unwrapped minutes, of riding path from start_name at start_minutes - asserts the hops connect"""
+    time, stop = start_minutes, start_name
+    for prev_node, edge, node, line in path:
+        assert prev_node.name == stop == edge.start.name and node.name == edge.end.name and line == edge.line
+        time += (edge.dep_minutes - time) % (24 * 60) + edge.travel_time
+        stop = node.name
+    assert stop == end_name
+    return time
+
+
+def build_graph(directory, coords, hops):
+    """Object graph of a hand-made timetable - hops are (line, HH:MM departure, HH:MM arrival, from stop, to stop)"""
+    filename = directory / 'hops.csv'
+    with open(filename, 'w', encoding='utf-8', newline='') as file:
+        writer = csv.writer(file)
+        writer.writerow(CSV_HEADER)
+        for number, (line, departure, arrival, a, b) in enumerate(hops):
+            writer.writerow([number, 'MPK', line, f"{departure}:00", f"{arrival}:00", a, b, *coords[a], *coords[b]])
+    compact, _ = ingest_csv(str(filename), workers=1)
+    return compact.to_graph()
+
+
+@pytest.fixture(scope='session')
+def timetable_csv(tmp_path_factory):
+    filename = tmp_path_factory.mktemp('timetable') / 'connection_graph.csv'
+    write_timetable(filename)
+    return str(filename)
+
+
+@pytest.fixture
+def graph(timetable_csv):
+    """A freshly ingested object graph, tests may change it"""
+    compact, _ = ingest_csv(timetable_csv, workers=1)
+    return compact.to_graph()
+
+
+@pytest.fixture
+def compact_graph(timetable_csv):
+    compact, _ = ingest_csv(timetable_csv, workers=1)
+    return compact
+
+
+@pytest.fixture(scope='session')
+def stop_names():
+    return [f"Stop {i}" for i in range(STOP_COUNT)]
+
+
+@pytest.fixture(scope='session')
+def queries(stop_names):
+    """(start, destination, HH:MM) queries spread over the day"""
+    rng = random.Random(7)
+    return [(*rng.sample(stop_names, 2), f"{rng.randint(0, 23):02d}:{rng.randint(0, 59):02d}") for _ in range(40)]
@@ -0,0 +1,45 @@
+from array import array
+from compact_graph import CompactEdge
+
+#ConnectionTimetable: every connection of a graph in one array sorted by departure, stops as integer ids
+#  arr_minutes is unwrapped (dep_minutes + travel time), so a connection past midnight arrives after 24:00
+#  instead of at the start of the day
+
+
+class ConnectionTimetable:
+    def __init__(self, graph):
+        self.graph = graph
+        self.nodes = list(graph.get_nodes())
+        self.stop_ids = {node.name: stop_id for stop_id, node in enumerate(self.nodes)}
+
+        compact = hasattr(graph, 'get_edge_range')
+        rows = []
+        if compact:
+            #CompactGraph - read the columns, keep row numbers instead of edge views
+            for stop_id in range(len(self.nodes)):
+                lo, hi = graph.get_edge_range(stop_id)
+                rows.extend((graph.dep_minutes[index], graph.arr_minutes[index], stop_id, graph.targets[index], index) for index in range(lo, hi))
+        else:
+            for stop_id, node in enumerate(self.nodes):
+                rows.extend((edge.dep_minutes, edge.arr_minutes, stop_id, self.stop_ids[edge.end.name], edge) for edge in node.get_outgoing_edges())
+
+        rows.sort(key=lambda row: (row[0], (row[1] - row[0]) % (24 * 60)))
+        self.dep_minutes = array('h', (row[0] for row in rows))
+        self.arr_minutes = array('h', (row[0] + (row[1] - row[0]) % (24 * 60) for row in rows))
+        self.sources = array('i', (row[2] for row in rows))
+        self.targets = array('i', (row[3] for row in rows))
+        self.rows = array('i', (row[4] for row in rows)) if compact else None
+        self.edges = None if compact else [row[4] for row in rows]
+
+    def __len__(self):
+        return len(self.dep_minutes)
+
+    def get_edge(self, index):
+        """Edge (or edge view) of the connection at position index"""
+        if self.edges is not None:
+            return self.edges[index]
+        return CompactEdge(self.graph, self.rows[index], self.nodes[self.sources[index]])
+
+
+def get_connection_timetable(graph):
+    return graph.get_derived('connections', ConnectionTimetable)
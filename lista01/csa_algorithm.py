@@ -0,0 +1,83 @@
+import bisect
+from array import array
+from time import perf_counter
+from utils import time_to_minutes
+from instrumentation import emit, elapsed_ms
+from connections import get_connection_timetable
+
+#Connection Scan Algorithm - earliest arrival by one linear pass over all connections sorted by departure
+
+NO_CONNECTION = -1
+UNREACHED = 2**31 - 1
+
+
+def scan_connections(timetable, source, start_total, target=None, targets=None):
+    """Earliest arrival and incoming connection index for every stop, departing source at start_total
+
+    with a target (or a collection of targets) the scan stops once no later connection can improve
+    the arrival at any of them
+    """
+    earliest_arrival = array('i', [UNREACHED]) * len(timetable.nodes)
+    in_connection = array('i', [NO_CONNECTION]) * len(timetable.nodes)
+    earliest_arrival[source] = start_total
+
+    targets = set(targets or ())
+    if target is not None:
+        targets.add(target)
+    bound = max((earliest_arrival[stop_id] for stop_id in targets), default=UNREACHED)  #latest arrival among the targets
+
+    dep_minutes, arr_minutes = timetable.dep_minutes, timetable.arr_minutes
+    sources, stops = timetable.sources, timetable.targets
+    for index in range(bisect.bisect_left(dep_minutes, start_total), len(dep_minutes)):
+        dep = dep_minutes[index]
+        if bound <= dep:
+            break
+        stop_id = stops[index]
+        if earliest_arrival[sources[index]] <= dep and arr_minutes[index] < earliest_arrival[stop_id]:
+            earliest_arrival[stop_id] = arr_minutes[index]
+            in_connection[stop_id] = index
+            if stop_id in targets:
+                bound = max(earliest_arrival[target_id] for target_id in targets)
+
+    return earliest_arrival, in_connection
+
+
+def reconstruct_journey(timetable, in_connection, source, target):
+    """Path in the (prev_node, edge, node, line) shape used by print_path, None if target was not reached"""
+    path = []
+    current = target
+    while current != source:
+        index = in_connection[current]
+        if index == NO_CONNECTION:
+            return None
+        edge = timetable.get_edge(index)
+        path.append((timetable.nodes[timetable.sources[index]], edge, timetable.nodes[current], edge.line))
+        current = timetable.sources[index]
+    path.reverse()
+    return path
+
+
+def find_csa_path(graph, starting_stop_name, destination_stop_name, start_time, criteria):
+    start_algorithm_time = perf_counter()
+    if criteria != 't':
+        print("Error: CSA supports only the time criterion (t)")
+        return None, None
+
+    timetable = get_connection_timetable(graph)
+    source = timetable.stop_ids.get(starting_stop_name)
+    target = timetable.stop_ids.get(destination_stop_name)
+    if source is None or target is None:
+        print("Error: Invalid start or destination stop")
+        return None, None
+
+    start_total = time_to_minutes(start_time)
+    earliest_arrival, in_connection = scan_connections(timetable, source, start_total, target)
+
+    emit('search', engine='csa', criteria=criteria, duration_ms=elapsed_ms(start_algorithm_time))
+
+    path = reconstruct_journey(timetable, in_connection, source, target)
+    if path is None:
+        print("Error reconstructing path")
+        return None, None
+
+    return path, earliest_arrival[target] - start_total
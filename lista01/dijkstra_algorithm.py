@@ -1,11 +1,17 @@
-from datetime import datetime
 import heapq
-from utils import time_to_minutes, print_path, log, reconstruct_path, print_path, calculate_total_travel_time
+from time import perf_counter
+from utils import time_to_minutes, print_path, reconstruct_path, print_path, calculate_total_travel_time
 from graph import Graph, Node, Edge
+from workspace import SearchWorkspace
+from instrumentation import emit, elapsed_ms
+from spatial import WALK_LINE, Footpath, get_footpaths
 
 
-def find_dijkstra_path(graph, starting_stop_name, destination_stop_name, start_time, criteria):
-    start_algorithm_time = datetime.now()
+def find_dijkstra_path(graph, starting_stop_name, destination_stop_name, start_time, criteria, workspace=None, footpath_radius=None):
+    """workspace - a SearchWorkspace to reuse (see get_workspace), a fresh one is allocated otherwise
+    footpath_radius - walking between stops up to this many metres apart (e.g. spatial.FOOTPATH_RADIUS), 0 or None - no walking
+    """
+    start_algorithm_time = perf_counter()
     starting_stop = graph.get_node(starting_stop_name)
     destination_stop = graph.get_node(destination_stop_name)
     
@@ -15,43 +21,51 @@ def find_dijkstra_path(graph, starting_stop_name, destination_stop_name, start_t
     
     start_total = time_to_minutes(start_time)
 
-    distance = {node: float('inf') for node in graph.get_nodes()}
-    previous = {node: (None, None, None) for node in graph.get_nodes()}
-    earliest_arrival = {node: float('inf') for node in graph.get_nodes()}
+    #labels by node.id, valid where stamp == epoch - every queued node is labelled
+    workspace = (workspace or SearchWorkspace(len(graph.get_nodes()))).reset()
+    stamp, epoch = workspace.stamp, workspace.epoch
+    distance, previous, earliest_arrival = workspace.distance, workspace.previous, workspace.arrival
     
-    distance[starting_stop] = 0
-    earliest_arrival[starting_stop] = start_total
+    stamp[starting_stop.id] = epoch
+    distance[starting_stop.id] = 0
+    earliest_arrival[starting_stop.id] = start_total
+    previous[starting_stop.id] = (None, None, None)
     
     visited = set()
+    footpaths = get_footpaths(graph, footpath_radius)
     
     #priority queue: (transfer_count, earliest_arrival, total_cost, current_stop, current_line)
     priority_queue = [(0, 0, start_total, starting_stop, None)]
     heapq.heapify(priority_queue)
+    pushes, pops, stale_pops, edges_scanned, out_edges = 1, 0, 0, 0, 0  #counters for the 'search' event
     
     while priority_queue:
         # current_transfers, current_cost, current_stop, current_line, current_time = heapq.heappop(priority_queue)
         current_transfers, current_cost, current_time, current_stop, current_line = heapq.heappop(priority_queue)
+        pops += 1
         
-        if current_stop in visited and distance[current_stop] < current_cost:
+        if current_stop in visited and distance[current_stop.id] < current_cost:
+            stale_pops += 1
             continue
         
         visited.add(current_stop)
         
         #skip if we've already found a better path to this node
-        if current_time > earliest_arrival[current_stop]:
+        if current_time > earliest_arrival[current_stop.id]:
+            stale_pops += 1
             continue
         
         # ?destination found
         if current_stop == destination_stop:
             break
 
-        for neighbor_edge in current_stop.get_outgoing_edges():
-            
-            dep_total = time_to_minutes(neighbor_edge.dep_time)
-            arr_total = time_to_minutes(neighbor_edge.arr_time)
-            
-            if dep_total < current_time: #consider only edges that depart after current time?
-                continue
+        out_edges += graph.get_out_degree(current_stop)
+
+        #per (line, next stop) only the first departure at or after current time and later ones that overtake it
+        for neighbor_edge in graph.get_departures(current_stop, current_time, first_per_route=True):
+            edges_scanned += 1
+            dep_total = neighbor_edge.dep_minutes
+            arr_total = neighbor_edge.arr_minutes
             
             #something could be wrong here - maybe?
             wait_time = dep_total - current_time # if current_stop != starting_stop else 0 #<- better results but RANDOM
@@ -71,18 +85,34 @@ def find_dijkstra_path(graph, starting_stop_name, destination_stop_name, start_t
             # if neighbor_edge.line == current_line and time_to_minutes(neighbor_edge.dep_time) == current_time:
             #     new_cost -= 2
             
-            if new_cost < distance[neighbor_edge.end]:
-                distance[neighbor_edge.end] = new_cost
-                earliest_arrival[neighbor_edge.end] = arr_total
+            end_id = neighbor_edge.end.id
+            if stamp[end_id] != epoch or new_cost < distance[end_id]:
+                stamp[end_id] = epoch
+                distance[end_id] = new_cost
+                earliest_arrival[end_id] = arr_total
                 # transfers[neighbor_edge.end] = new_transfer_count
-                previous[neighbor_edge.end] = (current_stop, neighbor_edge, neighbor_edge.line)
+                previous[end_id] = (current_stop, neighbor_edge, neighbor_edge.line)
                 heapq.heappush(priority_queue, (new_transfer_count, new_cost, arr_total, neighbor_edge.end, neighbor_edge.line))
-                
-    stop_algorithm_time = datetime.now()
-    log(f"Dijkstra execution time: {stop_algorithm_time - start_algorithm_time} seconds")
-    
+                pushes += 1
+        
+        #walking to a stop nearby - no waiting, and boarding after a walk is a transfer unless nothing was ridden yet
+        if footpaths is not None:
+            for end, walk_minutes in footpaths[current_stop.id]:
+                new_cost = current_cost + walk_minutes
+                end_id = end.id
+                if stamp[end_id] != epoch or new_cost < distance[end_id]:
+                    walk = Footpath(current_stop, end, current_time, walk_minutes)
+                    stamp[end_id] = epoch
+                    distance[end_id] = new_cost
+                    earliest_arrival[end_id] = walk.arr_minutes
+                    previous[end_id] = (current_stop, walk, WALK_LINE)
+                    heapq.heappush(priority_queue, (current_transfers, new_cost, walk.arr_minutes, end, WALK_LINE if current_line is not None else None))
+                    pushes += 1
     
-    path, final_arrival_time = reconstruct_path(previous, starting_stop, destination_stop)
+    path, final_arrival_time = reconstruct_path(workspace, starting_stop, destination_stop)
+    #edges_skipped: departed before the stop was reached or a later departure of a route already scanned
+    emit('search', engine='dijkstra', criteria=criteria, duration_ms=elapsed_ms(start_algorithm_time), pushes=pushes, pops=pops,
+         stale_pops=stale_pops, edges_scanned=edges_scanned, edges_skipped=out_edges - edges_scanned, path_length=len(path) if path else None)
     if path is None:
         print("Error reconstructing path")
         return None, None
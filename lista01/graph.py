@@ -1,5 +1,8 @@
+import re
 import json
 import bisect
+import difflib
+import unicodedata
 
 def time_to_minutes(time_str):
     parts = list(map(int, time_str.split(':')))
@@ -15,22 +18,137 @@ def minutes_to_time(minutes):
     return f"{h:02d}:{m:02d}"
 
 
-#Node: (name, outgoing_edges)
+INFINITE_MINUTES = 2**31 - 1
+
+
+#letters without a unicode decomposition (NFKD leaves them untouched)
+NAME_TRANSLITERATION = str.maketrans({'ł': 'l', 'Ł': 'L', 'ß': 'ss', 'đ': 'd', 'Đ': 'D', 'ø': 'o', 'Ø': 'O'})
+
+def normalize_name(name):
+    """Case- and diacritic-insensitive form of a stop name, e.g. 'Wrocławski  Park' -> 'wroclawski park'"""
+    name = unicodedata.normalize('NFKD', name.translate(NAME_TRANSLITERATION))
+    name = ''.join(c for c in name if not unicodedata.combining(c))
+    return ' '.join(name.casefold().split())
+
+
+#Node: (name, outgoing_edges, incoming_edges)
 class Node:
     def __init__(self, name, lat, lon):
         self.name = name
         self.lat = lat
         self.lon = lon
+        self.id = None #index in graph.nodes, set by the graph
         self.outgoing_edges = []
+        self.incoming_edges = [] #reverse index, sorted by arr_minutes
+        self.route_count = None #distinct (line, next stop) pairs, counted on first use
+        self.incoming_route_count = None #distinct (line, previous stop) pairs
         
     # def add_outgoing_edge(self, edge):
     #     self.outgoing_edges.append(edge)
     
     def add_outgoing_edge(self, edge):
         bisect.insort(self.outgoing_edges, edge, key=lambda x: x.dep_minutes)
+        self.route_count = None
+    
+    def remove_outgoing_edge(self, edge):
+        """Remove this very edge object, found by bisection on its dep_minutes"""
+        edges = self.outgoing_edges
+        i = bisect.bisect_left(edges, edge.dep_minutes, key=lambda x: x.dep_minutes)
+        while edges[i] is not edge:
+            i += 1
+        del edges[i]
+        self.route_count = None
+    
+    def add_incoming_edge(self, edge):
+        bisect.insort(self.incoming_edges, edge, key=lambda x: x.arr_minutes)
+        self.incoming_route_count = None
+    
+    def remove_incoming_edge(self, edge):
+        edges = self.incoming_edges
+        i = bisect.bisect_left(edges, edge.arr_minutes, key=lambda x: x.arr_minutes)
+        while edges[i] is not edge:
+            i += 1
+        del edges[i]
+        self.incoming_route_count = None
         
     def get_outgoing_edges(self):
         return self.outgoing_edges
+    
+    def get_route_count(self):
+        if self.route_count is None:
+            self.route_count = len({(edge.line, edge.end.name) for edge in self.outgoing_edges})
+        return self.route_count
+    
+    def get_departures(self, after_minutes, first_per_route=False, until_minutes=None, best_arrival=None):
+        """Outgoing edges departing at or after after_minutes, in departure order
+
+        outgoing_edges is sorted by dep_minutes, so the first one is found by bisection.
+        first_per_route yields per (line, next stop) pair the first departure and any later one that
+        arrives earlier (it overtook), and stops once every pair has been seen and no later departure
+        can arrive before the arrivals already yielded
+        until_minutes ends the scan before the first departure at or after it, best_arrival is the
+        first_per_route state (route -> earliest arrival yielded) - passing the same dict again continues
+        a scan cut off there (lazy_graph.py)
+        """
+        edges = self.outgoing_edges
+        start = bisect.bisect_left(edges, after_minutes, key=lambda x: x.dep_minutes)
+        stop = len(edges) if until_minutes is None else bisect.bisect_left(edges, until_minutes, start, key=lambda x: x.dep_minutes)
+        if not first_per_route:
+            for i in range(start, stop):
+                yield edges[i]
+            return
+        
+        route_count = self.get_route_count()
+        bound = None  #the latest arrival of best_arrival once every route is seen
+        if best_arrival is None:
+            best_arrival = {}
+        for i in range(start, stop):
+            edge = edges[i]
+            if len(best_arrival) == route_count:
+                if bound is None:
+                    bound = max(best_arrival.values())
+                if edge.dep_minutes >= bound:
+                    return
+            route = (edge.line, edge.end.name)
+            arrival = edge.dep_minutes + edge.travel_time  #not wrapped at midnight
+            if arrival < best_arrival.get(route, INFINITE_MINUTES):
+                best_arrival[route] = arrival
+                bound = None
+                yield edge
+    
+    def get_arrivals(self, before_minutes, last_per_route=False, since_minutes=None, best_departure=None):
+        """Incoming edges arriving at or before before_minutes, latest arrival first - get_departures mirrored
+
+        last_per_route yields per (line, previous stop) pair the last arrival and any earlier one that
+        left later (it was overtaken); since_minutes ends the scan before the first arrival earlier than
+        it, best_departure continues a scan like best_arrival does
+        """
+        edges = self.incoming_edges
+        end = bisect.bisect_right(edges, before_minutes, key=lambda x: x.arr_minutes)
+        stop = 0 if since_minutes is None else bisect.bisect_left(edges, since_minutes, 0, end, key=lambda x: x.arr_minutes)
+        if not last_per_route:
+            for i in range(end - 1, stop - 1, -1):
+                yield edges[i]
+            return
+        
+        if self.incoming_route_count is None:
+            self.incoming_route_count = len({(edge.line, edge.start.name) for edge in edges})
+        bound = None  #the earliest departure of best_departure once every route is seen
+        if best_departure is None:
+            best_departure = {}
+        for i in range(end - 1, stop - 1, -1):
+            edge = edges[i]
+            if len(best_departure) == self.incoming_route_count:
+                if bound is None:
+                    bound = min(best_departure.values())
+                if edge.arr_minutes <= bound:
+                    return
+            route = (edge.line, edge.start.name)
+            departure = edge.arr_minutes - edge.travel_time  #not wrapped at midnight
+            if departure > best_departure.get(route, -INFINITE_MINUTES):
+                best_departure[route] = departure
+                bound = None
+                yield edge
         
     def __eq__(self, other):
         if isinstance(other, Node):
@@ -56,15 +174,15 @@ class Node:
         
 #Edge: (start, end, line, dep_time, arr_time, travel_time)
 class Edge:
-    def __init__(self, start, end, line, dep_time, arr_time, travel_time):
+    def __init__(self, start, end, line, dep_time, arr_time, travel_time, dep_minutes=None, arr_minutes=None):
         self.start = start
         self.end = end
         self.line = line
         self.dep_time = dep_time
         self.arr_time = arr_time
         self.travel_time = travel_time
-        self.dep_minutes = time_to_minutes(dep_time)
-        self.arr_minutes = time_to_minutes(arr_time)
+        self.dep_minutes = dep_minutes if dep_minutes is not None else time_to_minutes(dep_time)
+        self.arr_minutes = arr_minutes if arr_minutes is not None else time_to_minutes(arr_time)
         
     def __eq__(self, other):
         if isinstance(other, Edge):
@@ -85,22 +203,230 @@ class Edge:
 
 
 
-class Graph:
+#name lookups shared by every graph backend - expects self.node_index and self.search_keys
+class StopLookup:
+    def get_node(self, name):
+        return self.node_index.get(name)
+    
+    def get_search_keys(self):
+        if self.search_keys is None:
+            self.search_keys = sorted((normalize_name(name), name) for name in self.node_index)
+        return self.search_keys
+    
+    def find_nodes(self, query, limit=10):
+        """Nodes whose normalized name starts with the normalized query, closest fuzzy matches if none do"""
+        keys = self.get_search_keys()
+        normalized_query = normalize_name(query)
+        
+        matches = []
+        i = bisect.bisect_left(keys, (normalized_query,))
+        while i < len(keys) and len(matches) < limit and keys[i][0].startswith(normalized_query):
+            matches.append(self.node_index[keys[i][1]])
+            i += 1
+        if matches:
+            return matches
+        
+        #fuzzy fallback - linear in the number of stops, only used when the prefix lookup fails
+        names_by_key = {}
+        for key, name in keys:
+            names_by_key.setdefault(key, []).append(name)
+        for key in difflib.get_close_matches(normalized_query, names_by_key, n=limit, cutoff=0.6):
+            matches.extend(self.node_index[name] for name in names_by_key[key])
+        return matches[:limit]
+    
+    def resolve_node(self, query):
+        """Exact name, then normalized name, then an unambiguous prefix - None otherwise"""
+        node = self.get_node(query)
+        if node is not None:
+            return node
+        
+        keys = self.get_search_keys()
+        normalized_query = normalize_name(query)
+        i = bisect.bisect_left(keys, (normalized_query,))
+        if i < len(keys) and keys[i][0] == normalized_query:
+            return self.node_index[keys[i][1]]
+        
+        candidates = self.find_nodes(query, limit=2)
+        if len(candidates) == 1 and normalize_name(candidates[0].name).startswith(normalized_query):
+            return candidates[0]
+        return None
+
+
+
+#structures derived from the whole timetable (sorted connection array, routes, ...), built once per graph
+#expects self.derived = {}
+class DerivedData:
+    def get_derived(self, key, build):
+        if key not in self.derived:
+            self.derived[key] = build(self)
+        return self.derived[key]
+
+
+
+#derived data still valid after timetable updates: what only depends on the stops (updates never add any),
+#and after delays and cancellations alone the landmarks - they only remove hops or shift whole runs, so
+#landmark lower bounds stay admissible
+STOP_DERIVED = ('spatial', 'workspaces')
+UPDATE_SAFE_DERIVED = STOP_DERIVED + ('landmarks',)
+UPDATE_TYPES = ('delay', 'cancel', 'insert')
+MAX_MINUTES = 2 * 24 * 60  #delayed runs may go on into the next day, not beyond it
+#required fields and their types per update type, 'next' and 'until' are optional stop names
+UPDATE_FIELDS = {
+    'delay': {'line': str, 'stop': str, 'dep_time': str, 'minutes': int},
+    'cancel': {'line': str, 'stop': str, 'dep_time': str},
+    'insert': {'line': str, 'start': str, 'end': str, 'dep_time': str, 'arr_time': str},
+}
+
+
+def update_error(update):
+    """Why a timetable update is malformed, None if its shape and types are fine - checked before the graph is touched"""
+    if not isinstance(update, dict):
+        return "malformed update: not an object"
+    kind = update.get('type')
+    if kind not in UPDATE_TYPES:
+        return f"unknown update type {kind!r}"
+    for name, field_type in UPDATE_FIELDS[kind].items():
+        value = update.get(name)
+        if not isinstance(value, field_type) or isinstance(value, bool):
+            return f"malformed update: {name} must be {field_type.__name__}"
+        if name.endswith('_time') and not re.fullmatch(r'\d{1,2}:\d{2}(:\d{2})?', value):
+            return f"malformed update: {name} must be HH:MM"
+    for name in ('next', 'until'):
+        if update.get(name) is not None and not isinstance(update[name], str):
+            return f"malformed update: {name} must be a stop name"
+    return None
+
+
+class Graph(StopLookup, DerivedData):
     def __init__(self, nodes, edges):
+        self.version = 0 #bumped on every change, caches outside graph.derived can key on it
+        self.source = None #sha1 of the csv the graph was built from, None when unknown
         self.nodes = nodes if nodes is not None else []
         self.edges = edges if edges is not None else []
+        self.node_index = {node.name: node for node in self.nodes}
+        for stop_id, node in enumerate(self.nodes):
+            node.id = stop_id
+        self.search_keys = None #sorted (normalized name, name) pairs, built on first search
+        self.derived = {}
         
     def add_node(self, node):
+        node.id = len(self.nodes)
         self.nodes.append(node)
+        self.node_index[node.name] = node
+        self.search_keys = None
+        self.derived.clear()
+        self.version += 1
         
     def add_edge(self, edge):
         self.edges.append(edge)
-        
-    def get_node(self, name):
-        for node in self.nodes:
-            if node.name == name:
-                return node
+        self.derived.clear()
+        self.version += 1
+    
+    def find_hop(self, line, stop_name, dep_time, next_stop_name=None):
+        """Edge of line leaving stop_name at dep_time (HH:MM), towards next_stop_name if given, None if there is none"""
+        node = self.get_node(stop_name)
+        if node is None:
+            return None
+        #a hop delayed past midnight departs at minutes + 24 * 60
+        for minutes in (time_to_minutes(dep_time), time_to_minutes(dep_time) + 24 * 60):
+            for edge in node.get_departures(minutes):
+                if edge.dep_minutes != minutes:
+                    break
+                if edge.line == line and (next_stop_name is None or edge.end.name == next_stop_name):
+                    return edge
         return None
+    
+    def vehicle_run(self, edge, until_stop_name=None):
+        """Hops of the vehicle from edge on, up to the arrival at until_stop_name or the end of its run
+
+        the next hop is the one of the same line leaving edge.end the minute edge arrives, not turning
+        straight back - the same chaining trips.py uses
+        """
+        run, seen = [edge], {id(edge)}
+        while edge.end.name != until_stop_name:
+            edge = next((candidate for candidate in edge.end.get_departures(edge.arr_minutes)
+                         if candidate.dep_minutes == edge.arr_minutes and candidate.line == edge.line and candidate.end.name != edge.start.name), None)
+            if edge is None or id(edge) in seen:
+                break
+            run.append(edge)
+            seen.add(id(edge))
+        return run
+    
+    def apply_updates(self, updates):
+        """Apply a batch of timetable updates in place, returns (applied count, [(update, reason)] rejected)
+
+        updates are dicts (the delta log format, see updates.py):
+          {'type': 'delay', 'line', 'stop', 'dep_time', 'minutes'[, 'next', 'until']} - shift the run
+          {'type': 'cancel', 'line', 'stop', 'dep_time'[, 'next', 'until']} - remove the run
+          {'type': 'insert', 'line', 'start', 'end', 'dep_time', 'arr_time'} - add one hop
+        a run starts at the hop of line leaving stop at dep_time (towards next) and goes on to the
+        arrival at until, or to the end of the vehicle's run; every outgoing_edges and incoming_edges list stays sorted
+        a delay does not wrap at midnight - hops shifted past it depart at 24 * 60 and later
+        """
+        applied, rejected, removed, inserted = 0, [], set(), False
+        #the bookkeeping in finally also runs if an update fails unexpectedly, for the updates applied before it
+        try:
+            for update in updates:
+                error = update_error(update)
+                if error is not None:
+                    rejected.append((update, error))
+                    continue
+                kind = update['type']
+                try:
+                    if kind == 'insert':
+                        start, end = self.get_node(update['start']), self.get_node(update['end'])
+                        if start is None or end is None:
+                            rejected.append((update, "unknown stop"))
+                            continue
+                        dep_minutes, arr_minutes = time_to_minutes(update['dep_time']), time_to_minutes(update['arr_time'])
+                        edge = Edge(start, end, update['line'], f"{minutes_to_time(dep_minutes)}:00", f"{minutes_to_time(arr_minutes)}:00",
+                                    (arr_minutes - dep_minutes) % (24 * 60), dep_minutes, arr_minutes)
+                        self.edges.append(edge)
+                        start.add_outgoing_edge(edge)
+                        end.add_incoming_edge(edge)
+                        inserted = True
+                        applied += 1
+                        continue
+                
+                    edge = self.find_hop(update['line'], update['stop'], update['dep_time'], update.get('next'))
+                    if edge is None:
+                        rejected.append((update, "no such hop"))
+                        continue
+                    run = self.vehicle_run(edge, update.get('until'))
+                    if kind == 'cancel':
+                        for edge in run:
+                            edge.start.remove_outgoing_edge(edge)
+                            edge.end.remove_incoming_edge(edge)
+                            removed.add(id(edge))
+                    else:
+                        #times go on from the run's first departure instead of wrapping, a run delayed past midnight
+                        #departs after the rest of the day (dep_minutes >= 24 * 60), not at its start
+                        minutes = int(update['minutes'])
+                        first = run[0].dep_minutes
+                        shifted = [first + (edge.dep_minutes - first) % (24 * 60) + minutes for edge in run]
+                        if shifted[0] < 0 or shifted[-1] + run[-1].travel_time >= MAX_MINUTES:
+                            rejected.append((update, "delay moves the run out of the timetable"))
+                            continue
+                        for edge, dep_minutes in zip(run, shifted):
+                            edge.start.remove_outgoing_edge(edge)
+                            edge.end.remove_incoming_edge(edge)
+                            edge.dep_minutes = dep_minutes
+                            edge.arr_minutes = dep_minutes + edge.travel_time
+                            edge.dep_time = f"{minutes_to_time(edge.dep_minutes)}:00"
+                            edge.arr_time = f"{minutes_to_time(edge.arr_minutes)}:00"
+                            edge.start.add_outgoing_edge(edge)
+                            edge.end.add_incoming_edge(edge)
+                    applied += 1
+                except (KeyError, ValueError) as error:
+                    rejected.append((update, f"malformed update: {error}"))
+        finally:
+            if removed:
+                self.edges = [edge for edge in self.edges if id(edge) not in removed]
+            if applied:
+                keep = STOP_DERIVED if inserted else UPDATE_SAFE_DERIVED
+                self.derived = {key: value for key, value in self.derived.items() if key in keep}
+                self.version += 1
+        return applied, rejected
         
     def get_nodes(self):
         return self.nodes
@@ -108,6 +434,15 @@ class Graph:
     def get_edges(self):
         return self.edges
     
+    def get_departures(self, node, after_minutes, first_per_route=False):
+        return node.get_departures(after_minutes, first_per_route)
+    
+    def get_arrivals(self, node, before_minutes, last_per_route=False):
+        return node.get_arrivals(before_minutes, last_per_route)
+    
+    def get_out_degree(self, node):
+        return len(node.outgoing_edges)
+    
     def to_json(self, filename):
         """Serialize the graph to JSON file"""
         graph_data = {
@@ -165,5 +500,10 @@ class Graph:
             
             edges.append(edge)
             start_node.add_outgoing_edge(edge)
+            end_node.incoming_edges.append(edge)
+        
+        #one sort per stop instead of an insort per edge
+        for node in nodes:
+            node.incoming_edges.sort(key=lambda x: x.arr_minutes)
         
         return cls(nodes, edges)
\ No newline at end of file
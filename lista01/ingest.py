@@ -0,0 +1,210 @@
+import os
+import io
+import sys
+import csv
+from array import array
+from time import perf_counter
+from concurrent.futures import ProcessPoolExecutor
+from compact_graph import CompactGraph
+from snapshot import file_sha1
+
+#chunked, parallel connection_graph.csv ingestion
+#
+#  the file is split into byte ranges aligned to line starts, every range is parsed in a worker process
+#  into compact int columns with chunk-local stop/line tables, and the parent merges the chunks in file
+#  order into a CompactGraph: global ids, deduplication on packed integer keys and per-stop sorted runs
+#
+#  rows must not contain quoted newlines (connection_graph.csv never does)
+
+CHUNK_SIZE = 8 * 2**20
+MAX_REJECTED_SAMPLES = 5
+COLUMNS = ('start_stop', 'end_stop', 'line', 'departure_time', 'arrival_time',
+           'start_stop_lat', 'start_stop_lon', 'end_stop_lat', 'end_stop_lon')
+
+
+class IngestStats:
+    def __init__(self):
+        self.rows = 0
+        self.rejected = 0
+        self.duplicates = 0
+        self.rejected_samples = []
+        self.seconds = 0.0
+
+    @property
+    def rows_per_second(self):
+        return self.rows / self.seconds if self.seconds else 0.0
+
+    def __str__(self):
+        return (f"{self.rows} rows in {self.seconds:.2f} s ({self.rows_per_second:,.0f} rows/sec), "
+                f"{self.rejected} rejected, {self.duplicates} duplicates")
+
+
+def read_header(filename):
+    with open(filename, 'rb') as f:
+        header = f.readline()
+    names = next(csv.reader([header.decode('utf-8-sig')]))
+    missing = [name for name in COLUMNS if name not in names]
+    if missing:
+        raise ValueError(f"{filename} is missing columns: {', '.join(missing)}")
+    return len(header), [names.index(name) for name in COLUMNS]
+
+
+def split_chunks(filename, data_start, chunk_size):
+    """Byte ranges of roughly chunk_size, each starting at the beginning of a line"""
+    size = os.path.getsize(filename)
+    boundaries = [data_start]
+    with open(filename, 'rb') as f:
+        position = data_start + chunk_size
+        while position < size:
+            f.seek(position)
+            f.readline()
+            position = f.tell()
+            if position >= size:
+                break
+            boundaries.append(position)
+            position += chunk_size
+    boundaries.append(size)
+    return list(zip(boundaries, boundaries[1:]))
+
+
+def parse_seconds(time_str):
+    h, m, s = map(int, time_str.split(':'))
+    return h * 3600 + m * 60 + s
+
+
+def parse_chunk(task):
+    """Parse one byte range into (stops, lines, rows, rejected, samples)
+
+    stops: [(name, lat, lon)] in order of first appearance, lines: [name]
+    rows: flat array of (start, end, line, dep_seconds, arr_seconds) with chunk-local ids
+    """
+    filename, start, end, indices = task
+    with open(filename, 'rb') as f:
+        f.seek(start)
+        text = f.read(end - start).decode('utf-8')
+
+    stop_ids, stops = {}, []
+    line_ids, lines = {}, []
+    rows = array('i')
+    rejected, samples = 0, []
+    i_start, i_end, i_line, i_dep, i_arr, i_start_lat, i_start_lon, i_end_lat, i_end_lon = indices
+
+    for row in csv.reader(io.StringIO(text)):
+        if not row:
+            continue
+        try:
+            start_stop, end_stop, line = row[i_start], row[i_end], row[i_line]
+            dep_seconds, arr_seconds = parse_seconds(row[i_dep]), parse_seconds(row[i_arr])
+            #all four are parsed on every row - a malformed row is rejected even when its stops are known
+            coordinates = float(row[i_start_lat]), float(row[i_start_lon])
+            end_coordinates = float(row[i_end_lat]), float(row[i_end_lon])
+        except (ValueError, IndexError) as e:
+            rejected += 1
+            if len(samples) < MAX_REJECTED_SAMPLES:
+                samples.append(f"{','.join(row)}: {e}")
+            continue
+
+        if start_stop not in stop_ids:
+            stop_ids[start_stop] = len(stops)
+            stops.append((start_stop, *coordinates))
+        if end_stop not in stop_ids:
+            stop_ids[end_stop] = len(stops)
+            stops.append((end_stop, *end_coordinates))
+        if line not in line_ids:
+            line_ids[line] = len(lines)
+            lines.append(line)
+        rows.extend((stop_ids[start_stop], stop_ids[end_stop], line_ids[line], dep_seconds, arr_seconds))
+
+    return stops, lines, rows, rejected, samples
+
+
+def merge_chunks(chunks, stats):
+    """Merge parsed chunks (in file order) into a CompactGraph"""
+    stop_ids, stop_names, stop_lat, stop_lon = {}, [], array('d'), array('d')
+    line_ids, line_names = {}, []
+    seen = set()
+    sources, targets, lines, dep_minutes, arr_minutes = array('i'), array('i'), array('i'), array('h'), array('h')
+
+    #chunks are consumed as they arrive: map local ids to global ones, dedup on the packed integer key
+    #(start, end, line, dep, arr) and append to the unsorted columns
+    for stops, chunk_lines, rows, rejected, samples in chunks:
+        stats.rejected += rejected
+        stats.rejected_samples.extend(samples[:MAX_REJECTED_SAMPLES - len(stats.rejected_samples)])
+        stats.rows += len(rows) // 5 + rejected
+
+        stop_map = []
+        for name, lat, lon in stops:
+            if name not in stop_ids:
+                stop_ids[name] = len(stop_names)
+                stop_names.append(sys.intern(name))
+                stop_lat.append(lat)
+                stop_lon.append(lon)
+            stop_map.append(stop_ids[name])
+        line_map = []
+        for name in chunk_lines:
+            if name not in line_ids:
+                line_ids[name] = len(line_names)
+                line_names.append(sys.intern(name))
+            line_map.append(line_ids[name])
+
+        for i in range(0, len(rows), 5):
+            start, end, line = stop_map[rows[i]], stop_map[rows[i + 1]], line_map[rows[i + 2]]
+            dep_seconds, arr_seconds = rows[i + 3], rows[i + 4]
+            key = (((start << 24 | end) << 20 | line) << 36) | (dep_seconds << 18) | arr_seconds
+            if key in seen:
+                stats.duplicates += 1
+                continue
+            seen.add(key)
+
+            sources.append(start)
+            targets.append(end)
+            lines.append(line)
+            dep_minutes.append(dep_seconds // 60 % (24 * 60))
+            arr_minutes.append(arr_seconds // 60 % (24 * 60))
+
+    #per-stop sorted runs: counting sort by source stop, then sort every run by departure
+    offsets = array('i', bytes(4 * (len(stop_names) + 1)))
+    for start in sources:
+        offsets[start + 1] += 1
+    for stop_id in range(len(stop_names)):
+        offsets[stop_id + 1] += offsets[stop_id]
+
+    order = array('i', bytes(4 * len(sources)))
+    cursor = array('i', offsets)
+    for index, start in enumerate(sources):
+        order[cursor[start]] = index
+        cursor[start] += 1
+    for stop_id in range(len(stop_names)):
+        lo, hi = offsets[stop_id], offsets[stop_id + 1]
+        order[lo:hi] = array('i', sorted(order[lo:hi], key=dep_minutes.__getitem__))
+
+    return CompactGraph(
+        stop_names, stop_lat, stop_lon, line_names, offsets,
+        array('i', (targets[i] for i in order)),
+        array('i', (lines[i] for i in order)),
+        array('h', (dep_minutes[i] for i in order)),
+        array('h', (arr_minutes[i] for i in order)),
+    )
+
+
+def ingest_csv(filename, workers=None, chunk_size=CHUNK_SIZE):
+    """Build a CompactGraph from connection_graph.csv, returns (graph, IngestStats) - graph.source is the csv's sha1
+
+    workers=None uses every core, workers=1 (or a single chunk) parses in this process
+    """
+    stats = IngestStats()
+    start_time = perf_counter()
+
+    data_start, indices = read_header(filename)
+    tasks = [(filename, start, end, indices) for start, end in split_chunks(filename, data_start, chunk_size)]
+    workers = workers or os.cpu_count() or 1
+
+    if workers == 1 or len(tasks) == 1:
+        graph = merge_chunks(map(parse_chunk, tasks), stats)
+    else:
+        with ProcessPoolExecutor(max_workers=min(workers, len(tasks))) as executor:
+            graph = merge_chunks(executor.map(parse_chunk, tasks), stats)
+
+    graph.source = file_sha1(filename)
+    stats.seconds = perf_counter() - start_time
+    return graph, stats
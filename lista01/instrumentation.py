@@ -0,0 +1,117 @@
+import json
+from time import perf_counter, time
+from contextlib import contextmanager
+
+#search instrumentation - per-query counters and timing spans sent to a pluggable sink
+#
+#  an event is a name and a dict of fields, e.g. emit('search', engine='dijkstra', pops=12, duration_ms=0.4)
+#  sinks: NullSink (the default - nothing is formatted or written), JsonLinesSink (one JSON object per
+#  line, machine readable), Aggregator (in-memory counts and per-field totals) and LogSink (one readable
+#  line per event, what the CLI shows)
+#  set_sink installs a sink for the whole process, forked workers inherit it
+#
+#  events: load (get_graph), load_buckets (the lazy graph pulling in more of the day), search (every engine,
+#  heap engines add their counters), reconstruct, preprocessing steps (transfers, travel_matrix) and tabu runs
+
+
+class NullSink:
+    enabled = False
+
+    def emit(self, event, fields):
+        pass
+
+
+class JsonLinesSink:
+    enabled = True
+
+    def __init__(self, file):
+        #a filename is opened for appending, line buffered so forked workers write whole lines
+        self.file = open(file, 'a', buffering=1, encoding='utf-8') if isinstance(file, str) else file
+
+    def emit(self, event, fields):
+        self.file.write(json.dumps({'event': event, 'time': round(time(), 6), **fields}, ensure_ascii=False, default=str) + '\n')
+
+    def close(self):
+        self.file.close()
+
+
+class Aggregator:
+    enabled = True
+
+    def __init__(self):
+        self.counts = {}  #key -> number of events, the key is 'event' or 'event:engine'
+        self.totals = {}  #key -> field -> [sum of its numeric values, number of values]
+
+    def emit(self, event, fields):
+        key = f"{event}:{fields['engine']}" if 'engine' in fields else event
+        self.counts[key] = self.counts.get(key, 0) + 1
+        totals = self.totals.setdefault(key, {})
+        for name, value in fields.items():
+            if isinstance(value, (int, float)) and not isinstance(value, bool):
+                total = totals.setdefault(name, [0, 0])
+                total[0] += value
+                total[1] += 1
+
+    def mean(self, key, field):
+        total, count = self.totals.get(key, {}).get(field, (0, 0))
+        return total / count if count else 0.0
+
+    def summary(self):
+        """{key: {'count': n, field: mean}}"""
+        return {key: {'count': count, **{name: total / n for name, (total, n) in self.totals[key].items()}}
+                for key, count in self.counts.items()}
+
+    def __str__(self):
+        return '\n'.join(f"{key} x{values.pop('count')}: " + ', '.join(f"{name} {value:.3f}" for name, value in values.items())
+                         for key, values in self.summary().items())
+
+
+class LogSink:
+    enabled = True
+
+    def __init__(self, output=print):
+        self.output = output
+
+    def emit(self, event, fields):
+        self.output(f"{event}: " + ', '.join(f"{name}={value}" for name, value in fields.items()))
+
+
+_sink = NullSink()
+
+
+def set_sink(sink):
+    """Install sink (None - the NullSink), returns the previous one"""
+    global _sink
+    previous = _sink
+    _sink = sink if sink is not None else NullSink()
+    return previous
+
+
+def get_sink():
+    return _sink
+
+
+def enabled():
+    return _sink.enabled
+
+
+def emit(event, **fields):
+    if _sink.enabled:
+        _sink.emit(event, fields)
+
+
+def elapsed_ms(start):
+    """Milliseconds since a perf_counter() reading"""
+    return round((perf_counter() - start) * 1000, 3)
+
+
+@contextmanager
+def span(event, **fields):
+    """Times the block and emits event with duration_ms, the block may add fields to the dict it gets"""
+    start = perf_counter()
+    try:
+        yield fields
+    finally:
+        if _sink.enabled:
+            fields['duration_ms'] = elapsed_ms(start)
+            _sink.emit(event, fields)
@@ -0,0 +1,74 @@
+from array import array
+from time import perf_counter
+from utils import time_to_minutes
+from instrumentation import emit, elapsed_ms
+from connections import get_connection_timetable
+from csa_algorithm import NO_CONNECTION, UNREACHED, scan_connections
+
+#one-to-all / one-to-many earliest arrival and isochrones
+#
+#  results are flat arrays indexed by stop id (the position of the node in graph.get_nodes()),
+#  arrivals are unwrapped minutes (UNREACHED for stops that cannot be reached the same day)
+#  and predecessors are stop ids (-1 for the origin and unreached stops)
+
+NO_PREDECESSOR = -1
+
+
+def find_earliest_arrivals(graph, starting_stop_name, start_time, destination_stop_names=None):
+    """(earliest_arrival, predecessor) arrays for every stop, None, None if the origin is unknown
+
+    with destination_stop_names the scan stops as soon as all of them are settled, the arrivals
+    of other stops are then only upper bounds
+    """
+    start_algorithm_time = perf_counter()
+    timetable = get_connection_timetable(graph)
+    source = timetable.stop_ids.get(starting_stop_name)
+    if source is None:
+        print("Error: Invalid start stop")
+        return None, None
+
+    targets = None
+    if destination_stop_names is not None:
+        targets = [timetable.stop_ids[name] for name in destination_stop_names if name in timetable.stop_ids]
+
+    earliest_arrival, in_connection = scan_connections(timetable, source, time_to_minutes(start_time), targets=targets)
+
+    predecessor = array('i', [NO_PREDECESSOR]) * len(in_connection)
+    sources = timetable.sources
+    for stop_id, index in enumerate(in_connection):
+        if index != NO_CONNECTION:
+            predecessor[stop_id] = sources[index]
+
+    emit('search', engine='one_to_all', duration_ms=elapsed_ms(start_algorithm_time))
+    return earliest_arrival, predecessor
+
+
+def stop_path(predecessor, stop_id):
+    """Stop ids from the origin to stop_id following the predecessor array"""
+    stops = [stop_id]
+    while predecessor[stops[-1]] != NO_PREDECESSOR:
+        stops.append(predecessor[stops[-1]])
+    stops.reverse()
+    return stops
+
+
+def isochrone_buckets(graph, earliest_arrival, start_time, step=10, limit=60):
+    """Stops grouped by travel time: [(upper_bound_minutes, [(name, lat, lon, travel_time)])]
+
+    bucket i holds the stops reached in more than step*i and at most step*(i+1) minutes
+    (the first bucket includes the origin), stops beyond limit are left out
+    """
+    start_total = time_to_minutes(start_time)
+    buckets = [(step * (i + 1), []) for i in range((limit + step - 1) // step)]
+    for node, arrival in zip(graph.get_nodes(), earliest_arrival):
+        if arrival == UNREACHED:
+            continue
+        travel_time = arrival - start_total
+        if travel_time > limit:
+            continue
+        bucket = max(travel_time - 1, 0) // step
+        buckets[bucket][1].append((node.name, node.lat, node.lon, travel_time))
+
+    for _, stops in buckets:
+        stops.sort(key=lambda stop: stop[3])
+    return buckets
@@ -0,0 +1,97 @@
+import heapq
+from array import array
+from spatial import FOOTPATH_RADIUS, get_footpaths
+
+#ALT (A*, landmarks, triangle inequality) lower bounds for A*
+#
+#  the static graph keeps the shortest travel_time of any connection between two stops, so a distance
+#  in it never exceeds the time actually spent riding (waiting and transfer penalties only add to that)
+#  footpaths (spatial.py, FOOTPATH_RADIUS) are edges of it too, the searches may walk them
+#  for K landmarks L the distances d(L, v) and d(v, L) to every stop give, by the triangle inequality,
+#  d(v, t) >= max(d(L, t) - d(L, v), d(v, L) - d(t, L)) - an admissible bound in minutes
+
+LANDMARK_COUNT = 8
+UNREACHED = 2**31 - 1
+
+
+class StaticGraph:
+    """Minimum travel time between directly connected stops, forward and reversed adjacency by stop id"""
+    def __init__(self, graph):
+        self.nodes = list(graph.get_nodes())
+        self.stop_ids = {node.name: stop_id for stop_id, node in enumerate(self.nodes)}
+        self.forward = [{} for _ in self.nodes]
+        self.backward = [{} for _ in self.nodes]
+        for stop_id, node in enumerate(self.nodes):
+            forward = self.forward[stop_id]
+            for edge in node.get_outgoing_edges():
+                target = self.stop_ids[edge.end.name]
+                if edge.travel_time < forward.get(target, UNREACHED):
+                    forward[target] = edge.travel_time
+        for stop_id, walks in enumerate(get_footpaths(graph, FOOTPATH_RADIUS) or ()):
+            forward = self.forward[stop_id]
+            for node, walk_minutes in walks:
+                target = self.stop_ids[node.name]
+                if walk_minutes < forward.get(target, UNREACHED):
+                    forward[target] = walk_minutes
+        for stop_id, neighbours in enumerate(self.forward):
+            for target, travel_time in neighbours.items():
+                self.backward[target][stop_id] = travel_time
+
+    def distances(self, source, reverse=False):
+        """Static shortest travel times from source to every stop (to source with reverse)"""
+        adjacency = self.backward if reverse else self.forward
+        distance = array('i', [UNREACHED]) * len(self.nodes)
+        distance[source] = 0
+        queue = [(0, source)]
+        while queue:
+            current, stop_id = heapq.heappop(queue)
+            if current > distance[stop_id]:
+                continue
+            for target, travel_time in adjacency[stop_id].items():
+                if current + travel_time < distance[target]:
+                    distance[target] = current + travel_time
+                    heapq.heappush(queue, (current + travel_time, target))
+        return distance
+
+
+class Landmarks:
+    def __init__(self, graph, count=LANDMARK_COUNT):
+        static = StaticGraph(graph)
+        self.stop_ids = static.stop_ids
+        self.landmarks = []
+        self.from_landmark = []  #d(L, v) for every landmark
+        self.to_landmark = []  #d(v, L)
+
+        #farthest point selection: each new landmark is the stop farthest from the ones chosen so far
+        closest = array('i', [UNREACHED]) * len(static.nodes)
+        start = static.distances(0)
+        candidate = max(range(len(start)), key=lambda stop_id: start[stop_id] if start[stop_id] != UNREACHED else -1)
+        for _ in range(min(count, len(static.nodes))):
+            forward = static.distances(candidate)
+            self.landmarks.append(candidate)
+            self.from_landmark.append(forward)
+            self.to_landmark.append(static.distances(candidate, reverse=True))
+            for stop_id, distance in enumerate(forward):
+                closest[stop_id] = min(closest[stop_id], distance)
+            reachable = [stop_id for stop_id, distance in enumerate(closest) if 0 < distance < UNREACHED]
+            if not reachable:
+                break
+            candidate = max(reachable, key=lambda stop_id: closest[stop_id])
+
+    def lower_bounds(self, target):
+        """Admissible travel time lower bound from every stop to target, as an array indexed by stop id"""
+        bounds = array('i', [0]) * len(self.stop_ids)
+        for forward, backward in zip(self.from_landmark, self.to_landmark):
+            to_target, from_target = forward[target], backward[target]
+            for stop_id in range(len(bounds)):
+                bound = bounds[stop_id]
+                if to_target != UNREACHED and forward[stop_id] != UNREACHED and to_target - forward[stop_id] > bound:
+                    bound = to_target - forward[stop_id]
+                if backward[stop_id] != UNREACHED and from_target != UNREACHED and backward[stop_id] - from_target > bound:
+                    bound = backward[stop_id] - from_target
+                bounds[stop_id] = bound
+        return bounds
+
+
+def get_landmarks(graph):
+    return graph.get_derived('landmarks', Landmarks)
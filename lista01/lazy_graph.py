@@ -0,0 +1,151 @@
+import bisect
+from graph import Graph, Node, Edge, STOP_DERIVED, minutes_to_time
+from compact_graph import BUCKET_MINUTES, BUCKET_COUNT
+from instrumentation import emit
+
+#lazy, time-window-sliced object graph over a CompactGraph (usually the mmap'ed snapshot)
+#
+#  all stops exist from the start, but Edge objects are only made for the departure buckets a query
+#  needs: get_graph(window=...) loads the buckets overlapping the window and every scan prefetches the
+#  next `horizon` minutes
+#  get_departures / get_arrivals yield exactly what the full graph would: a scan runs over the loaded
+#  buckets its stop has connections in, and when it reaches one that is not loaded yet and could still
+#  yield an edge (first_per_route has not seen every route, or a later departure could still arrive
+#  earlier) that bucket is loaded and the scan goes on where it stopped - so every criterion gets the
+#  full graph's result, the window only decides what is loaded up front
+#  route counts (the first_per_route stopping rule) and which departure buckets feed a stop's arrivals
+#  are counted over the whole day when the graph is made
+#  buckets are inserted as blocks, outgoing_edges and incoming_edges stay sorted; every load clears the
+#  derived data built from the smaller timetable and bumps graph.version
+#  only get_departures / get_arrivals extend the window - structures over the whole timetable (connections
+#  for CSA and the travel matrix, trips for RAPTOR and profiles, landmarks, transfers) would silently cut
+#  journeys off at the window, so building any of them loads the full day first
+
+DEFAULT_HORIZON = 120  #minutes
+WINDOW_SAFE_DERIVED = STOP_DERIVED + ('legs', 'routes')  #caches of search results, not timetable structures
+
+
+class WindowedGraph(Graph):
+    def __init__(self, compact, horizon=DEFAULT_HORIZON):
+        super().__init__([Node(compact.stop_names[i], compact.stop_lat[i], compact.stop_lon[i]) for i in range(len(compact.stop_names))], [])
+        self.compact = compact
+        self.source = compact.source
+        self.horizon = horizon
+        self.loaded = [False] * BUCKET_COUNT
+        self.loaded_mask = 0  #bit b - bucket b is loaded
+        self.times = [f"{minutes_to_time(minutes)}:00" for minutes in range(24 * 60)]
+        compact.get_bucket_offsets()
+        self.count_routes()
+
+    def count_routes(self):
+        """Whole-day route counts of every stop and, per stop and arrival bucket, the departure buckets arriving in it"""
+        compact, nodes = self.compact, self.nodes
+        targets, lines, dep_minutes, arr_minutes = compact.targets, compact.lines, compact.dep_minutes, compact.arr_minutes
+        incoming_routes = [set() for _ in nodes]
+        self.arrival_buckets = [[0] * BUCKET_COUNT for _ in nodes]  #bit b - connections departing in bucket b arrive here
+        for stop_id, node in enumerate(nodes):
+            lo, hi = compact.get_edge_range(stop_id)
+            node.route_count = compact.get_route_count(stop_id)
+            for index in range(lo, hi):
+                target = targets[index]
+                incoming_routes[target].add((lines[index], stop_id))
+                self.arrival_buckets[target][arr_minutes[index] // BUCKET_MINUTES] |= 1 << dep_minutes[index] // BUCKET_MINUTES
+        for node, routes in zip(nodes, incoming_routes):
+            node.incoming_route_count = len(routes)
+
+    def loaded_buckets(self):
+        return [bucket for bucket in range(BUCKET_COUNT) if self.loaded[bucket]]
+
+    def load_buckets(self, buckets):
+        """Materialize the connections departing in buckets, returns how many were added"""
+        new_buckets = sorted({bucket for bucket in buckets if not self.loaded[bucket]})
+        if not new_buckets:
+            return 0
+
+        compact, nodes, times = self.compact, self.nodes, self.times
+        targets, lines, dep_minutes, arr_minutes, line_names = compact.targets, compact.lines, compact.dep_minutes, compact.arr_minutes, compact.line_names
+        added, arrived = 0, set()
+        for stop_id, node in enumerate(nodes):
+            for bucket in new_buckets:
+                lo, hi = compact.get_bucket_range(stop_id, bucket)
+                if lo == hi:
+                    continue
+                block = []
+                for index in range(lo, hi):
+                    dep, arr = dep_minutes[index], arr_minutes[index]
+                    end = nodes[targets[index]]
+                    edge = Edge(node, end, line_names[lines[index]], times[dep], times[arr], (arr - dep) % (24 * 60), dep, arr)
+                    block.append(edge)
+                    end.incoming_edges.append(edge)
+                    arrived.add(end)
+                position = bisect.bisect_left(node.outgoing_edges, bucket * BUCKET_MINUTES, key=lambda x: x.dep_minutes)
+                node.outgoing_edges[position:position] = block
+                self.edges.extend(block)
+                added += hi - lo
+        for node in arrived:
+            node.incoming_edges.sort(key=lambda x: x.arr_minutes)
+
+        for bucket in new_buckets:
+            self.loaded[bucket] = True
+            self.loaded_mask |= 1 << bucket
+        self.derived = {key: value for key, value in self.derived.items() if key in STOP_DERIVED}
+        self.version += 1
+        emit('load_buckets', buckets=new_buckets, connections=added)
+        return added
+
+    def load_window(self, start_minutes, end_minutes):
+        """Load every bucket overlapping [start_minutes, end_minutes], wrapping around midnight"""
+        if end_minutes < start_minutes:
+            end_minutes += 24 * 60
+        first, last = start_minutes // BUCKET_MINUTES, end_minutes // BUCKET_MINUTES
+        buckets = range(first, last + 1) if last - first < BUCKET_COUNT else range(BUCKET_COUNT)
+        if not all(self.loaded[bucket % BUCKET_COUNT] for bucket in buckets):
+            self.load_buckets(bucket % BUCKET_COUNT for bucket in buckets)
+
+    def get_departures(self, node, after_minutes, first_per_route=False):
+        self.load_window(after_minutes, after_minutes + self.horizon)
+        best_arrival = {} if first_per_route else None
+        bucket = after_minutes // BUCKET_MINUTES
+        while bucket < BUCKET_COUNT:
+            #scan up to the first bucket this stop departs in that is not loaded
+            end = bucket
+            while end < BUCKET_COUNT and (self.loaded[end] or self.is_empty(node.id, end)):
+                end += 1
+            until = end * BUCKET_MINUTES
+            yield from node.get_departures(after_minutes, first_per_route, until, best_arrival)
+            #the full graph's scan ends before until once every route is seen and none arrives later than until
+            if end == BUCKET_COUNT or (first_per_route and len(best_arrival) == node.route_count and max(best_arrival.values()) <= until):
+                return
+            self.load_buckets([end])
+            bucket, after_minutes = end, max(after_minutes, until)
+
+    def get_arrivals(self, node, before_minutes, last_per_route=False):
+        self.load_window(max(before_minutes - self.horizon, 0), before_minutes)
+        best_departure = {} if last_per_route else None
+        arrival_buckets = self.arrival_buckets[node.id]
+        bucket = min(before_minutes // BUCKET_MINUTES, BUCKET_COUNT - 1)
+        while bucket >= 0:
+            #scan down to the first arrival bucket fed by a departure bucket that is not loaded
+            first = bucket
+            while first >= 0 and not arrival_buckets[first] & ~self.loaded_mask:
+                first -= 1
+            since = (first + 1) * BUCKET_MINUTES
+            yield from node.get_arrivals(before_minutes, last_per_route, since, best_departure)
+            if first < 0 or (last_per_route and len(best_departure) == node.incoming_route_count and min(best_departure.values()) >= since):
+                return
+            self.load_buckets(feeder for feeder in range(BUCKET_COUNT) if arrival_buckets[first] >> feeder & 1)
+            bucket, before_minutes = first, min(before_minutes, since - 1)
+
+    def is_empty(self, stop_id, bucket):
+        lo, hi = self.compact.get_bucket_range(stop_id, bucket)
+        return lo == hi
+
+    def get_derived(self, key, build):
+        if key not in WINDOW_SAFE_DERIVED:
+            self.load_buckets(range(BUCKET_COUNT))
+        return super().get_derived(key, build)
+
+    def apply_updates(self, updates):
+        #updates address whole vehicle runs, so they need the whole timetable
+        self.load_buckets(range(BUCKET_COUNT))
+        return super().apply_updates(updates)
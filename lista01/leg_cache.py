@@ -0,0 +1,82 @@
+from collections import OrderedDict
+from utils import time_to_minutes, minutes_to_time
+from a_algorithm import find_a_star_path
+from workspace import get_workspace
+
+#memoized A* legs
+#
+#  tabu search costs the same (from stop, to stop, departure minute, criteria) legs over and over across
+#  swaps and iterations - the cache keeps the last max_size results in LRU order
+#  with bucket_minutes > 1 departures are rounded down to the bucket start and the leg is searched from
+#  there, so queries within one bucket share a result (fewer searches, approximate arrival times)
+#  the default cache lives in graph.derived, so it is dropped together with the graph's other derived data
+#  unreachable legs are cached too, as (None, None, None) - tabu search asks for them just as often
+
+MAX_LEGS = 4096
+
+
+class LegCache:
+    def __init__(self, max_size=MAX_LEGS, bucket_minutes=1):
+        self.max_size = max_size
+        self.bucket_minutes = bucket_minutes
+        self.legs = OrderedDict()  #key -> (path, arrival minutes, cost)
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def key(self, start_name, dest_name, start_time, criteria, heuristic):
+        minutes = time_to_minutes(start_time)
+        return start_name, dest_name, minutes - minutes % self.bucket_minutes, criteria, heuristic
+
+    def get(self, key):
+        leg = self.legs.get(key)
+        if leg is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.legs.move_to_end(key)
+        return leg
+
+    def put(self, key, leg):
+        self.legs[key] = leg
+        self.legs.move_to_end(key)
+        if len(self.legs) > self.max_size:
+            self.legs.popitem(last=False)
+            self.evictions += 1
+
+    def clear(self):
+        self.legs.clear()
+
+    def hit_ratio(self):
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def __str__(self):
+        return (f"{len(self.legs)} legs cached, {self.hits} hits, {self.misses} misses "
+                f"({self.hit_ratio():.0%} hit ratio), {self.evictions} evictions")
+
+
+def get_leg_cache(graph):
+    return graph.get_derived('legs', lambda graph: LegCache())
+
+
+def find_cached_a_star_path(graph, start_name, dest_name, start_time, criteria, heuristic, cache=None):
+    """find_a_star_path through a LegCache (the graph's default one unless given)
+
+    returns (path, total_travel_time, cost), (None, None, None) when there is no path or a stop is unknown
+    """
+    if cache is None:
+        cache = get_leg_cache(graph)
+
+    key = cache.key(start_name, dest_name, start_time, criteria, heuristic)
+    leg = cache.get(key)
+    if leg is None:
+        result = find_a_star_path(graph, start_name, dest_name, minutes_to_time(key[2]), criteria, heuristic, workspace=get_workspace(graph))
+        path, total_travel_time, cost = result if result is not None else (None, None, None)
+        leg = (path, key[2] + total_travel_time, cost) if path is not None else (None, None, None)
+        cache.put(key, leg)
+
+    path, arrival, cost = leg
+    if path is None:
+        return None, None, None
+    return path, max(arrival - time_to_minutes(start_time), 0), cost
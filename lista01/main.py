@@ -1,9 +1,16 @@
 import random
+import argparse
 from graph import Graph, Node, Edge
-from utils import get_graph, print_path
+from utils import get_graph, print_path, print_profile, log, minutes_to_time, time_to_minutes
+from lazy_graph import DEFAULT_HORIZON
+from instrumentation import LogSink, set_sink
 from dijkstra_algorithm import find_dijkstra_path
 from a_algorithm import find_a_star_path
 from tabu_search import tabu_search
+from profile_algorithm import find_profile
+from arrive_by_algorithm import find_arrive_by_path
+from alternatives_algorithm import find_alternative_paths
+from spatial import FOOTPATH_RADIUS, nearest_stop
 
 #debug 1
 def print_random_nodes_with_edges(graph, num_nodes=10):
@@ -65,12 +72,31 @@ def print_edges_of_node(graph, nodename):
     
 
 
+def resolve_stop(graph, name):
+    node = graph.resolve_node(name)
+    if node is not None:
+        return node.name
+    
+    nearest = nearest_stop(graph, name)
+    if nearest is not None:
+        print(f"Nearest stop to {name}: {nearest[0].name} ({nearest[1]:.0f} m)")
+        return nearest[0].name
+    
+    suggestions = graph.find_nodes(name, limit=5)
+    if suggestions:
+        print(f"Stop '{name}' not found. Did you mean: {', '.join(node.name for node in suggestions)}?")
+    return name
+
+
 def get_user_input():
     print("Choose an algorithm:")
     print("1. Dijkstra")
     print("2. A*")
     print("3. Tabu Search")
     print("4. debug")
+    print("5. Departure window (all optimal journeys)")
+    print("6. Arrive by (latest departure)")
+    print("7. Alternative journeys")
     
     choice = input("Enter the number of the algorithm: ").strip()
     
@@ -81,7 +107,7 @@ def get_user_input():
         criteria = input("Enter criteria (t for time, p for preference): ").strip()
         
         if choice == '2':  # A*
-            heuristic = input("Enter heuristic (euclidean, manhattan, haversine): ").strip()
+            heuristic = input("Enter heuristic (euclidean, manhattan, haversine, alt): ").strip()
             return choice, start_stop, end_stop, start_time, criteria, heuristic
         
         return choice, start_stop, end_stop, start_time, criteria
@@ -92,23 +118,83 @@ def get_user_input():
         criteria = input("Enter criteria (t for time, p for preference): ").strip()
         
         return choice, start_stop, stop_list, start_time, criteria
+    elif choice == '5':
+        start_stop = input("Enter the start stop: ").strip()
+        end_stop = input("Enter the end stop: ").strip()
+        window_start = input("Enter the earliest departure time (HH:MM): ").strip()
+        window_end = input("Enter the latest departure time (HH:MM): ").strip()
+        criteria = input("Enter criteria (t for time, p for preference): ").strip()
+        
+        return choice, start_stop, end_stop, window_start, window_end, criteria
+    elif choice == '6':
+        start_stop = input("Enter the start stop: ").strip()
+        end_stop = input("Enter the end stop: ").strip()
+        arrive_time = input("Enter the latest arrival time (HH:MM): ").strip()
+        criteria = input("Enter criteria (t for time, p for preference): ").strip()
+        
+        return choice, start_stop, end_stop, arrive_time, criteria
+    elif choice == '7':
+        start_stop = input("Enter the start stop: ").strip()
+        end_stop = input("Enter the end stop: ").strip()
+        start_time = input("Enter the start time (HH:MM): ").strip()
+        criteria = input("Enter criteria (t for time, p for preference): ").strip()
+        k = input("Enter the number of alternatives [3]: ").strip()
+        
+        return choice, start_stop, end_stop, start_time, criteria, int(k) if k else 3
     else:
         return choice, None, None, None, None, None
 
+def parse_arguments():
+    parser = argparse.ArgumentParser(description="Public transport route finder")
+    parser.add_argument('--rebuild-cache', action='store_true', help="rebuild the graph snapshot from connection_graph.csv")
+    parser.add_argument('--compact', action='store_true', help="search directly on the memory-mapped compact graph")
+    parser.add_argument('--delta-log', default=None, help="replay this timetable update log onto the graph")
+    parser.add_argument('--lazy', action='store_true', help="ask for the query first and load only the connections of its time window")
+    parser.add_argument('--horizon', type=int, default=DEFAULT_HORIZON, help="minutes of departures the lazy graph prefetches ahead of a scan")
+    parser.add_argument('--walk', type=int, nargs='?', const=FOOTPATH_RADIUS, default=None, metavar='METRES',
+                        help=f"let Dijkstra, A*, arrive-by and alternatives walk between stops up to METRES apart (default {FOOTPATH_RADIUS})")
+    return parser.parse_args()
+
+
+def query_window(user_input, horizon):
+    """(start, end) HH:MM window of the connections a query needs first, None - the whole day
+
+    tabu search (travel matrix), departure windows (rRAPTOR) and ALT landmarks read the whole timetable,
+    the lazy graph would load the full day for them anyway
+    """
+    choice = user_input[0]
+    if choice in ['1', '7'] or (choice == '2' and user_input[5] != 'alt'):
+        return user_input[3], minutes_to_time(time_to_minutes(user_input[3]) + horizon)
+    if choice == '6':
+        return minutes_to_time(max(time_to_minutes(user_input[3]) - horizon, 0)), user_input[3]
+    return None
+
+
 def main():
+    arguments = parse_arguments()
+    set_sink(LogSink(log))  #load, search and reconstruct timings as log lines
+    user_input = get_user_input() if arguments.lazy else None
+    window = query_window(user_input, arguments.horizon) if arguments.lazy and not arguments.compact else None
     print("Initializing graph...")
-    graph = get_graph()
+    graph = get_graph(rebuild=arguments.rebuild_cache, compact=arguments.compact, verbose=True, delta_log=arguments.delta_log,
+                      window=window, horizon=arguments.horizon)
     print(f"Graph loaded with {len(graph.nodes)} nodes and {len(graph.edges)} edges.")
     
-    user_input = get_user_input()
+    if user_input is None:
+        user_input = get_user_input()
+    
+    if user_input[0] in ['1', '2', '5', '6', '7']:
+        user_input = (user_input[0], resolve_stop(graph, user_input[1]), resolve_stop(graph, user_input[2])) + user_input[3:]
+    elif user_input[0] == '3':
+        user_input = (user_input[0], resolve_stop(graph, user_input[1]), [resolve_stop(graph, stop) for stop in user_input[2]]) + user_input[3:]
     
     if user_input[0] == '1':
-        path, total_time = find_dijkstra_path(graph, user_input[1], user_input[2], user_input[3], user_input[4])
+        path, total_time = find_dijkstra_path(graph, user_input[1], user_input[2], user_input[3], user_input[4], footpath_radius=arguments.walk)
         print(f"Dijkstra Path: {path}, Total time: {total_time}")
         print_path(path, user_input[1], user_input[3], total_time)
     
     elif user_input[0] == '2':
-        path, total_time, _ = find_a_star_path(graph, user_input[1], user_input[2], user_input[3], user_input[4], user_input[5])
+        path, total_time, _ = find_a_star_path(graph, user_input[1], user_input[2], user_input[3], user_input[4], user_input[5], footpath_radius=arguments.walk)
         print(f"A* Path: {path}, Total time: {total_time}")
         print_path(path, user_input[1], user_input[3], total_time)
     
@@ -117,6 +203,27 @@ def main():
         print(f"Tabu Search Solution: {solution[0]}, Cost: {solution[1]}")
         print(f"Path: {solution[2]}")
         print_path(solution[2], user_input[1], user_input[3])
+    
+    elif user_input[0] == '5':
+        profile = find_profile(graph, user_input[1], user_input[2], user_input[3], user_input[4], user_input[5])
+        print_profile(profile, user_input[1], user_input[2])
+    
+    elif user_input[0] == '6':
+        path, total_time = find_arrive_by_path(graph, user_input[1], user_input[2], user_input[3], user_input[4], footpath_radius=arguments.walk)
+        print(f"Arrive-by Path: {path}, Total time: {total_time}")
+        if path:
+            print(f"Leave at {minutes_to_time(path[0][1].dep_minutes)} to arrive by {user_input[3]}")
+            print_path(path, user_input[1], minutes_to_time(path[0][1].dep_minutes), total_time)
+        else:
+            print_path(path, user_input[1], user_input[3], total_time)
+    
+    elif user_input[0] == '7':
+        journeys = find_alternative_paths(graph, user_input[1], user_input[2], user_input[3], user_input[4], k=user_input[5], footpath_radius=arguments.walk)
+        if not journeys:
+            print_path(None, user_input[1], user_input[3])
+        for number, (path, total_time) in enumerate(journeys, 1):
+            print(f"\nAlternative {number}:")
+            print_path(path, user_input[1], user_input[3], total_time)
         
     else: #debug!!
         # path, total_time = find_dijkstra_path(graph, "PL. GRUNWALDZKI", "Wrocławski Park Przemysłowy", "14:40", 'p')
@@ -0,0 +1,67 @@
+import bisect
+from time import perf_counter
+from utils import time_to_minutes
+from instrumentation import emit, elapsed_ms
+from trips import get_trip_timetable
+from raptor_algorithm import RaptorLabels, MAX_ROUNDS, run_rounds, reconstruct_journey
+
+#profile queries (rRAPTOR) - every optimal journey departing within a time window in one run
+#
+#  RAPTOR is run once per distinct departure from the origin inside the window, latest first, and the
+#  labels are kept between runs: whatever a later departure reaches is an upper bound for an earlier one,
+#  so a run only records a journey when it arrives strictly earlier (or with fewer transfers)
+
+
+def origin_departures(timetable, source, window_start, window_end):
+    """Distinct departure minutes of any trip from the origin within the window, latest first"""
+    departures = set()
+    for route, index in timetable.stop_routes[source]:
+        column = route.departures[index]
+        for position in range(bisect.bisect_left(column, window_start), bisect.bisect_right(column, window_end)):
+            departures.add(column[position])
+    return sorted(departures, reverse=True)
+
+
+def pareto_filter(profile, criteria):
+    """'t' keeps (departure, arrival) Pareto optimal journeys, 'p' also keeps those with fewer transfers"""
+    kept = []
+    for entry in sorted(profile, key=lambda entry: (-entry[0], entry[0] + entry[2], entry[3])):
+        departure, _, total_travel_time, transfers = entry
+        arrival = departure + total_travel_time
+        dominated = any(
+            other[0] + other[2] <= arrival and (criteria == 't' or other[3] <= transfers)
+            for other in kept
+        )
+        if not dominated:
+            kept.append(entry)
+    return sorted(kept, key=lambda entry: entry[0])
+
+
+def find_profile(graph, starting_stop_name, destination_stop_name, window_start, window_end, criteria, max_rounds=MAX_ROUNDS):
+    """Pareto profile [(departure_minutes, path, total_travel_time, transfers)] sorted by departure"""
+    start_algorithm_time = perf_counter()
+    timetable = get_trip_timetable(graph)
+    source = timetable.stop_ids.get(starting_stop_name)
+    target = timetable.stop_ids.get(destination_stop_name)
+    if source is None or target is None:
+        print("Error: Invalid start or destination stop")
+        return []
+
+    window_end_total = time_to_minutes(window_end)
+    labels = RaptorLabels(len(timetable.nodes), max_rounds)
+    profile = []
+    for start_total in origin_departures(timetable, source, time_to_minutes(window_start), window_end_total):
+        before = [labels.arrivals[k][target] for k in range(max_rounds + 1)]
+        run_rounds(timetable, source, start_total, target, max_rounds, labels, last_departure=window_end_total)
+
+        for k in range(1, max_rounds + 1):
+            arrival = labels.arrivals[k][target]
+            if arrival < before[k] and target in labels.parents[k]:
+                path = reconstruct_journey(timetable, labels, source, target, k)
+                if path is not None:
+                    #the first trip may leave after start_total - the pareto filter drops the duplicate
+                    departure = start_total + (path[0][1].dep_minutes - start_total) % (24 * 60)
+                    profile.append((departure, path, arrival - departure, k - 1))
+
+    emit('search', engine='profile', criteria=criteria, duration_ms=elapsed_ms(start_algorithm_time), journeys=len(profile))
+    return pareto_filter(profile, criteria)
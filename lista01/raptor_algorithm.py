@@ -0,0 +1,145 @@
+from array import array
+from time import perf_counter
+from utils import time_to_minutes
+from instrumentation import emit, elapsed_ms
+from trips import get_trip_timetable
+
+#RAPTOR - round-based public transit routing
+#
+#  round k scans every route serving a stop improved in round k-1 and rides its earliest catchable trip,
+#  so after round k the labels hold the earliest arrival using at most k trips (k-1 transfers)
+#  the rounds that improve the destination form the Pareto set of (arrival time, transfers)
+
+MAX_ROUNDS = 10
+UNREACHED = 2**31 - 1
+
+
+class RaptorLabels:
+    """Per-round arrival labels and the trip segment that set them - kept between runs for profile queries"""
+    def __init__(self, stop_count, max_rounds):
+        self.arrivals = [array('i', [UNREACHED]) * stop_count for _ in range(max_rounds + 1)]
+        self.parents = [{} for _ in range(max_rounds + 1)]  #stop -> (trip, board index, alight index)
+
+
+def run_rounds(timetable, source, start_total, target=None, max_rounds=MAX_ROUNDS, labels=None, last_departure=None):
+    """Run RAPTOR from source at start_total, returns the labels
+
+    passing the labels of a run with a later departure keeps them as upper bounds (rRAPTOR self-pruning)
+    last_departure forbids boarding at the source after that minute (in any round)
+    """
+    if labels is None:
+        labels = RaptorLabels(len(timetable.nodes), max_rounds)
+    arrivals, parents = labels.arrivals, labels.parents
+
+    changed = set()
+    if start_total < arrivals[0][source]:
+        arrivals[0][source] = start_total
+        changed.add(source)
+    marked = set(changed)
+
+    for k in range(1, max_rounds + 1):
+        previous, current, round_parents = arrivals[k - 1], arrivals[k], parents[k]
+
+        #round k starts from round k-1 - only the stops that changed there need copying
+        copied = set()
+        for stop_id in changed:
+            if previous[stop_id] < current[stop_id]:
+                current[stop_id] = previous[stop_id]
+                round_parents.pop(stop_id, None)
+                copied.add(stop_id)
+        changed = copied
+
+        #every route through a marked stop, from the first marked stop along it
+        queue = {}
+        for stop_id in marked:
+            for route, index in timetable.stop_routes[stop_id]:
+                if index < queue.get(route, UNREACHED):
+                    queue[route] = index
+        marked = set()
+
+        for route, index in queue.items():
+            trip = None
+            stops = route.stops
+            for i in range(index, len(stops)):
+                stop_id = stops[i]
+                if trip is not None:
+                    arrival = trip.arr[i]
+                    if arrival < current[stop_id] and (target is None or arrival < current[target]):
+                        current[stop_id] = arrival
+                        round_parents[stop_id] = (trip, board_index, i)
+                        marked.add(stop_id)
+
+                #hop on an earlier trip if we got here in time for one
+                if previous[stop_id] != UNREACHED and (trip is None or previous[stop_id] <= trip.dep[i]):
+                    position = route.earliest_trip(i, previous[stop_id])
+                    if position is not None and last_departure is not None and stop_id == source and route.trips[position].dep[i] > last_departure:
+                        position = None
+                    if position is not None and route.trips[position] is not trip:
+                        trip = route.trips[position]
+                        board_index = i
+
+        changed |= marked
+        if not changed:
+            break
+
+    return labels
+
+
+def reconstruct_journey(timetable, labels, source, target, rounds):
+    """Trips used to reach target in the given round, in the (prev_node, edge, node, line) path shape"""
+    path = []
+    stop_id, k = target, rounds
+    while stop_id != source:
+        while k > 0 and stop_id not in labels.parents[k]:
+            k -= 1
+        if k == 0:
+            return None
+        trip, board_index, alight_index = labels.parents[k][stop_id]
+        segment = [(timetable.nodes[trip.stops[i]], trip.edges[i], timetable.nodes[trip.stops[i + 1]], trip.line) for i in range(board_index, alight_index)]
+        path = segment + path
+        stop_id = trip.stops[board_index]
+        k -= 1
+    return path
+
+
+def pareto_journeys(timetable, labels, source, target, start_total):
+    """(path, total_travel_time, transfers) for every round that improved the target, fewest transfers first"""
+    journeys = []
+    best_arrival = UNREACHED
+    for k in range(1, len(labels.arrivals)):
+        arrival = labels.arrivals[k][target]
+        if target in labels.parents[k] and arrival < best_arrival:
+            path = reconstruct_journey(timetable, labels, source, target, k)
+            if path is not None:
+                best_arrival = arrival
+                journeys.append((path, arrival - start_total, k - 1))
+    return journeys
+
+
+def find_raptor_journeys(graph, starting_stop_name, destination_stop_name, start_time, max_rounds=MAX_ROUNDS):
+    """Pareto set of journeys over (arrival time, transfers) as [(path, total_travel_time, transfers)]"""
+    start_algorithm_time = perf_counter()
+    timetable = get_trip_timetable(graph)
+    source = timetable.stop_ids.get(starting_stop_name)
+    target = timetable.stop_ids.get(destination_stop_name)
+    if source is None or target is None:
+        print("Error: Invalid start or destination stop")
+        return []
+
+    start_total = time_to_minutes(start_time)
+    labels = run_rounds(timetable, source, start_total, target, max_rounds)
+    journeys = pareto_journeys(timetable, labels, source, target, start_total)
+
+    emit('search', engine='raptor', duration_ms=elapsed_ms(start_algorithm_time), journeys=len(journeys))
+    return journeys
+
+
+def find_raptor_path(graph, starting_stop_name, destination_stop_name, start_time, criteria):
+    """Earliest arrival ('t') or fewest transfers ('p', earliest among those) picked from one RAPTOR run"""
+    journeys = find_raptor_journeys(graph, starting_stop_name, destination_stop_name, start_time)
+    if not journeys:
+        print("Error: No path found")
+        return None, None
+
+    path, total_travel_time, _ = journeys[0] if criteria == 'p' else journeys[-1]
+    return path, total_travel_time
@@ -0,0 +1,101 @@
+from collections import OrderedDict
+from utils import time_to_minutes
+from dijkstra_algorithm import find_dijkstra_path
+from a_algorithm import find_a_star_path
+from workspace import get_workspace
+
+#result cache in front of find_dijkstra_path / find_a_star_path
+#
+#  a journey found for departure time t0 that leaves the origin at d is still the answer for any
+#  t0 <= t <= d: every journey possible from t was possible from t0, and waiting shifts all costs alike
+#  entries are filed under (origin, destination, criteria, algorithm, heuristic, t0 bucket); a lookup
+#  checks its own bucket and the one before, so a journey can serve queries past its bucket boundary
+#  eviction is LRU by bucket, bounded by entry count and an estimate of the memory the paths hold
+#  the default cache lives in graph.derived, so a new graph (snapshot reload, timetable update) starts empty
+
+BUCKET_MINUTES = 15
+MAX_ENTRIES = 10000
+MAX_BYTES = 64 * 2**20
+ENTRY_BYTES = 200  #key, entry tuple and list slot
+STEP_BYTES = 120  #one (prev_node, edge, node, line) tuple and its list slot
+
+
+class RouteCache:
+    def __init__(self, max_entries=MAX_ENTRIES, max_bytes=MAX_BYTES, bucket_minutes=BUCKET_MINUTES):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.bucket_minutes = bucket_minutes
+        self.buckets = OrderedDict()  #key -> [(query minute, first departure minute, path, total travel time)]
+        self.entries = 0
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def bucket_key(self, start_name, dest_name, criteria, algorithm, heuristic, minutes):
+        return start_name, dest_name, criteria, algorithm, heuristic, minutes // self.bucket_minutes
+
+    def get(self, start_name, dest_name, criteria, algorithm, heuristic, minutes):
+        """(path, total_travel_time) of a journey still valid when leaving at minutes, None on a miss"""
+        key = self.bucket_key(start_name, dest_name, criteria, algorithm, heuristic, minutes)
+        for bucket in (key, key[:-1] + (key[-1] - 1,)):
+            for query_minutes, departure, path, total_travel_time in self.buckets.get(bucket, ()):
+                if query_minutes <= minutes <= departure:
+                    self.hits += 1
+                    self.buckets.move_to_end(bucket)
+                    return path, total_travel_time - (minutes - query_minutes)
+        self.misses += 1
+        return None
+
+    def put(self, start_name, dest_name, criteria, algorithm, heuristic, minutes, path, total_travel_time):
+        key = self.bucket_key(start_name, dest_name, criteria, algorithm, heuristic, minutes)
+        departure = minutes + (path[0][1].dep_minutes - minutes) % (24 * 60)
+        self.buckets.setdefault(key, []).append((minutes, departure, path, total_travel_time))
+        self.buckets.move_to_end(key)
+        self.entries += 1
+        self.bytes += ENTRY_BYTES + STEP_BYTES * len(path)
+
+        while self.entries > self.max_entries or self.bytes > self.max_bytes:
+            _, evicted = self.buckets.popitem(last=False)
+            self.entries -= len(evicted)
+            self.bytes -= sum(ENTRY_BYTES + STEP_BYTES * len(entry[2]) for entry in evicted)
+            self.evictions += len(evicted)
+
+    def invalidate(self):
+        self.buckets.clear()
+        self.entries = 0
+        self.bytes = 0
+
+    def hit_ratio(self):
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def __str__(self):
+        return (f"{self.entries} journeys cached (~{self.bytes / 2**20:.1f} MB), {self.hits} hits, {self.misses} misses "
+                f"({self.hit_ratio():.0%} hit ratio), {self.evictions} evictions")
+
+
+def get_route_cache(graph):
+    return graph.get_derived('routes', lambda graph: RouteCache())
+
+
+def find_cached_path(graph, starting_stop_name, destination_stop_name, start_time, criteria, algorithm='dijkstra', heuristic='manhattan', cache=None):
+    """(path, total_travel_time) from the cache or from find_dijkstra_path / find_a_star_path"""
+    if cache is None:
+        cache = get_route_cache(graph)
+    if algorithm != 'astar':
+        heuristic = None
+
+    minutes = time_to_minutes(start_time)
+    cached = cache.get(starting_stop_name, destination_stop_name, criteria, algorithm, heuristic, minutes)
+    if cached is not None:
+        return cached
+
+    if algorithm == 'astar':
+        result = find_a_star_path(graph, starting_stop_name, destination_stop_name, start_time, criteria, heuristic, workspace=get_workspace(graph))
+        path, total_travel_time = result[:2] if result else (None, None)
+    else:
+        path, total_travel_time = find_dijkstra_path(graph, starting_stop_name, destination_stop_name, start_time, criteria, get_workspace(graph))
+    if path:
+        cache.put(starting_stop_name, destination_stop_name, criteria, algorithm, heuristic, minutes, path, total_travel_time)
+    return path, total_travel_time
@@ -0,0 +1,305 @@
+import io
+import os
+import json
+import signal
+import asyncio
+import argparse
+import multiprocessing
+from bisect import bisect_left
+from contextlib import redirect_stdout
+from time import perf_counter
+from urllib.parse import urlsplit, parse_qs
+from concurrent.futures import ProcessPoolExecutor
+from utils import get_graph, log, time_to_minutes
+from route_cache import find_cached_path, get_route_cache
+from tabu_search import tabu_search
+from instrumentation import JsonLinesSink, set_sink
+from updates import apply_update_batch
+from compact_graph import CompactGraph
+from spatial import WALK_LINE, nearest_stop
+
+#local routing server - asyncio HTTP/JSON on localhost with the graph loaded once
+#
+#  GET  /route?from=..&to=..&time=HH:MM[&criteria=t|p][&algorithm=dijkstra|astar][&heuristic=manhattan]
+#       (from and to are stop names or 'lat,lon' - the nearest stop)
+#  GET  /tour?start=..&stops=a;b;c&time=HH:MM[&criteria=t|p]
+#  GET  /stops?q=..[&limit=10]
+#  GET  /metrics  - per endpoint request counts and latency histograms
+#  POST /reload   - load the timetable again (also on SIGHUP)
+#  POST /updates  - apply a batch of timetable updates, JSON body {"updates": [...]} (see Graph.apply_updates)
+#
+#  searches run in a forked process pool that inherits the graph, every worker keeps its own route
+#  result cache (route_cache.py) in the graph it serves; a reload loads the new graph,
+#  forks a new pool and swaps both in at once - requests already running finish on the old pool,
+#  which shuts down when they are done
+#  the graph is loaded in a thread; the workers are forked from the event loop thread (forking from a
+#  helper thread would hand the children whatever locks the other threads hold) and their warm-up is
+#  awaited, so the loop keeps serving from the old pool meanwhile; pool_lock lets one pool be started at a time
+#
+#  updates are applied in a thread to a copy of the server's graph - handlers keep resolving stops against
+#  the current one - appended to the delta log (--delta-log) so a reload or restart replays them, and the
+#  copy is swapped in together with a freshly forked pool
+#
+#  usage: python server.py [--port 8080] [--workers 4] [--compact] [--delta-log graph.delta.jsonl]
+
+LATENCY_BUCKETS_MS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000)
+STATUS_TEXT = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed', 500: 'Internal Server Error'}
+
+_graph = None  #graph of the pool being forked, workers read it
+
+
+def journey(path, start_time, total_travel_time):
+    """JSON-ready description of a (prev_node, edge, node, line) path"""
+    legs = [{'from': prev_node.name, 'to': node.name, 'line': line, 'departure': edge.dep_time[:5], 'arrival': edge.arr_time[:5]}
+            for prev_node, edge, node, line in path]
+    lines = []
+    for leg in legs:
+        if not lines or lines[-1] != leg['line']:
+            lines.append(leg['line'])
+    rides = [line for line in lines if line != WALK_LINE]
+    return {'start_time': start_time, 'travel_time': total_travel_time, 'transfers': max(len(rides) - 1, 0), 'lines': lines, 'legs': legs}
+
+
+def route_worker(algorithm, start, end, start_time, criteria, heuristic):
+    """Journey through this worker's result cache, with whether it was a cache hit"""
+    cache = get_route_cache(_graph)
+    hits = cache.hits
+    with redirect_stdout(io.StringIO()):  #the engines print their errors
+        path, total_travel_time = find_cached_path(_graph, start, end, start_time, criteria, algorithm, heuristic, cache)
+    if not path:
+        return None, cache.hits > hits
+    return journey(path, start_time, total_travel_time), cache.hits > hits
+
+
+def tour_worker(start, stops, start_time, criteria):
+    with redirect_stdout(io.StringIO()):
+        stop_list, cost, path = tabu_search(_graph, start, stops, start_time, criteria)
+    if not path:
+        return None
+    result = journey(path, start_time, (time_to_minutes(path[-1][1].arr_time) - time_to_minutes(start_time)) % (24 * 60))
+    result.update({'order': stop_list, 'cost': cost})
+    return result
+
+
+class LatencyHistogram:
+    def __init__(self):
+        self.counts = [0] * (len(LATENCY_BUCKETS_MS) + 1)
+        self.total = 0
+        self.total_ms = 0.0
+
+    def add(self, milliseconds):
+        self.counts[bisect_left(LATENCY_BUCKETS_MS, milliseconds)] += 1
+        self.total += 1
+        self.total_ms += milliseconds
+
+    def to_json(self):
+        buckets = {f"le_{bound}ms": count for bound, count in zip(LATENCY_BUCKETS_MS, self.counts)}
+        buckets['inf'] = self.counts[-1]
+        return {'count': self.total, 'mean_ms': round(self.total_ms / self.total, 3) if self.total else 0.0, 'buckets': buckets}
+
+
+class HttpError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+class RoutingServer:
+    def __init__(self, workers=None, compact=False, delta_log=None):
+        self.workers = workers or os.cpu_count() or 1
+        self.compact = compact
+        self.delta_log = delta_log
+        self.graph = None
+        self.pool = None
+        self.generation = 0
+        self.histograms = {}
+        self.reloading = None
+        self.pool_lock = asyncio.Lock()
+        self.cache_hits = 0  #route result caches of the workers, counted here
+        self.cache_misses = 0
+
+    async def start_pool(self, graph):
+        """Fork a pool for graph and swap both in once every worker is up, the old pool finishes its queued searches first
+
+        the caller holds pool_lock
+        """
+        global _graph
+        _graph = graph
+        pool = ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context('fork'))
+        #the first submit forks every worker here, in the loop thread, while _graph is this graph
+        await asyncio.gather(*[asyncio.wrap_future(pool.submit(os.getpid)) for _ in range(self.workers)])
+        old_pool = self.pool
+        self.graph, self.pool = graph, pool
+        self.generation += 1
+        if old_pool is not None:
+            old_pool.shutdown(wait=False)
+
+    def updated_graph(self, graph, updates):
+        """A copy of graph with updates applied and logged, and apply_update_batch's result - graph is left alone"""
+        copy = CompactGraph.from_graph(graph).to_graph()
+        copy.version = graph.version
+        return copy, apply_update_batch(copy, updates, self.delta_log)
+
+    async def reload(self):
+        """Load the timetable again without blocking the event loop, concurrent reloads share one load"""
+        if self.reloading is None:
+            self.reloading = asyncio.ensure_future(self.load())
+            self.reloading.add_done_callback(lambda _: setattr(self, 'reloading', None))
+        return await asyncio.shield(self.reloading)
+
+    async def load(self):
+        loop = asyncio.get_running_loop()
+        graph = await loop.run_in_executor(None, lambda: get_graph(compact=self.compact, delta_log=self.delta_log))
+        async with self.pool_lock:
+            await self.start_pool(graph)
+        log(f"Graph generation {self.generation} loaded: {len(graph.nodes)} stops")
+        return self.generation
+
+    def resolve(self, name):
+        node = self.graph.resolve_node(name) if name else None
+        if node is None and name:
+            nearest = nearest_stop(self.graph, name)  #'lat,lon' starts from the nearest stop
+            node = nearest[0] if nearest is not None else None
+        if node is None:
+            suggestions = [node.name for node in self.graph.find_nodes(name or '', limit=5)]
+            raise HttpError(404, f"Unknown stop '{name}'" + (f", did you mean: {', '.join(suggestions)}" if suggestions else ''))
+        return node.name
+
+    async def search(self, function, *args):
+        #the pool is picked up once, a reload in the meantime does not affect this request
+        pool = self.pool
+        return await asyncio.get_running_loop().run_in_executor(pool, function, *args)
+
+    async def handle_route(self, query):
+        start, end = self.resolve(query.get('from')), self.resolve(query.get('to'))
+        start_time = query.get('time', '12:00')
+        algorithm = query.get('algorithm', 'dijkstra')
+        if algorithm not in ('dijkstra', 'astar'):
+            raise HttpError(400, f"Unknown algorithm '{algorithm}'")
+        result, hit = await self.search(route_worker, algorithm, start, end, start_time, query.get('criteria', 't'), query.get('heuristic', 'manhattan'))
+        self.cache_hits += hit
+        self.cache_misses += not hit
+        if result is None:
+            raise HttpError(404, "No path found")
+        return result
+
+    async def handle_tour(self, query):
+        start = self.resolve(query.get('start'))
+        stops = [self.resolve(stop) for stop in query.get('stops', '').split(';') if stop]
+        if not stops:
+            raise HttpError(400, "No stops given")
+        result = await self.search(tour_worker, start, stops, query.get('time', '12:00'), query.get('criteria', 't'))
+        if result is None:
+            raise HttpError(404, "No tour found")
+        return result
+
+    async def handle_stops(self, query):
+        limit = int(query.get('limit', 10))
+        return [{'name': node.name, 'lat': node.lat, 'lon': node.lon} for node in self.graph.find_nodes(query.get('q', ''), limit=limit)]
+
+    async def handle_metrics(self, query):
+        lookups = self.cache_hits + self.cache_misses
+        return {'generation': self.generation,
+                'endpoints': {path: histogram.to_json() for path, histogram in self.histograms.items()},
+                'route_cache': {'hits': self.cache_hits, 'misses': self.cache_misses, 'hit_ratio': round(self.cache_hits / lookups, 3) if lookups else 0.0}}
+
+    async def handle_reload(self, query):
+        return {'generation': await self.reload()}
+
+    async def handle_updates(self, query):
+        updates = query.get('updates')
+        if not isinstance(updates, list):
+            raise HttpError(400, "Expected a JSON body {\"updates\": [...]}")
+        if self.reloading is not None:
+            await asyncio.shield(self.reloading)  #apply to the graph being loaded, not the one it replaces
+        if not hasattr(self.graph, 'apply_updates'):
+            raise HttpError(400, "Timetable updates need the object graph, the server runs with --compact")
+        async with self.pool_lock:  #one batch at a time, each on top of the last
+            graph, (applied, rejected) = await asyncio.get_running_loop().run_in_executor(None, self.updated_graph, self.graph, updates)
+            if applied:
+                await self.start_pool(graph)
+        return {'applied': applied, 'rejected': [{'update': update, 'reason': reason} for update, reason in rejected],
+                'version': self.graph.version, 'generation': self.generation}
+
+    ROUTES = {
+        ('GET', '/route'): handle_route,
+        ('GET', '/tour'): handle_tour,
+        ('GET', '/stops'): handle_stops,
+        ('GET', '/metrics'): handle_metrics,
+        ('POST', '/reload'): handle_reload,
+        ('POST', '/updates'): handle_updates,
+    }
+    ENDPOINTS = {path for _, path in ROUTES}
+
+    async def handle_connection(self, reader, writer):
+        start = perf_counter()
+        path = None
+        try:
+            request_line = await reader.readline()
+            method, target, _ = request_line.decode('utf-8', 'replace').split(' ', 2)  #lenient: raw utf-8 in the url is accepted
+            headers = {}
+            while True:
+                line = await reader.readline()
+                if line in (b'\r\n', b'\n', b''):
+                    break
+                name, _, value = line.decode('latin-1').partition(':')
+                headers[name.strip().lower()] = value.strip()
+            body = await reader.readexactly(int(headers.get('content-length', 0)))
+
+            url = urlsplit(target)
+            path = url.path
+            query = {name: values[-1] for name, values in parse_qs(url.query).items()}
+            if body and headers.get('content-type', '').startswith('application/json'):
+                query.update(json.loads(body))
+
+            handler = self.ROUTES.get((method, path))
+            if handler is None:
+                raise HttpError(405 if path in self.ENDPOINTS else 404, f"No endpoint {method} {path}")
+            status, payload = 200, await handler(self, query)
+        except HttpError as error:
+            status, payload = error.status, {'error': str(error)}
+        except (ValueError, KeyError, json.JSONDecodeError) as error:
+            status, payload = 400, {'error': f"Malformed request: {error}"}
+        except Exception as error:  #keep serving, the client gets the reason
+            status, payload = 500, {'error': repr(error)}
+
+        data = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+        writer.write(f"HTTP/1.1 {status} {STATUS_TEXT.get(status, '')}\r\nContent-Type: application/json; charset=utf-8\r\n"
+                     f"Content-Length: {len(data)}\r\nConnection: close\r\n\r\n".encode('latin-1') + data)
+        try:
+            await writer.drain()
+        finally:
+            writer.close()
+
+        if path in self.ENDPOINTS:
+            self.histograms.setdefault(path, LatencyHistogram()).add((perf_counter() - start) * 1000)
+
+    async def serve(self, host, port):
+        await self.load()
+        server = await asyncio.start_server(self.handle_connection, host, port)
+        loop = asyncio.get_running_loop()
+        loop.add_signal_handler(signal.SIGHUP, lambda: asyncio.ensure_future(self.reload()))
+        log(f"Serving on http://{host}:{port} with {self.workers} workers")
+        async with server:
+            await server.serve_forever()
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description="Local public transport routing server")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--workers', type=int, default=None, help="search processes (default: one per core)")
+    parser.add_argument('--compact', action='store_true', help="serve from the memory-mapped compact graph")
+    parser.add_argument('--trace', default=None, help="append load and search events to this file as JSON lines")
+    parser.add_argument('--delta-log', default=None, help="timetable update log, replayed on load and appended to by POST /updates")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    arguments = parse_arguments()
+    if arguments.trace:
+        set_sink(JsonLinesSink(arguments.trace))
+    try:
+        asyncio.run(RoutingServer(arguments.workers, arguments.compact, arguments.delta_log).serve(arguments.host, arguments.port))
+    except KeyboardInterrupt:
+        pass
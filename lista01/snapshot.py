@@ -0,0 +1,187 @@
+import os
+import sys
+import mmap
+import struct
+import hashlib
+from array import array
+from compact_graph import CompactGraph, BUCKET_COUNT
+
+#binary graph snapshot - a CompactGraph laid out so it can be mmap'ed and used without parsing
+#
+#  header: magic, format version, byte order, fingerprint of the source csv (size, mtime, sha1), counts
+#  then 8-byte aligned sections in native byte order:
+#    stop_lat, stop_lon (float64), offsets (int32, per-stop sorted ranges), targets, lines (int32),
+#    dep_minutes, arr_minutes (int16), stop and line string tables (int32 offsets + utf-8 bytes),
+#    bucket_offsets (int32, the per-stop ranges split into hourly departure buckets)
+
+SNAPSHOT_MAGIC = b'RFGRAPH\0'
+SNAPSHOT_VERSION = 2
+HEADER_FORMAT = '<8sIBxxxQq20sxxxxIIIII'
+HEADER_SIZE = struct.calcsize(HEADER_FORMAT)
+MTIME_OFFSET = struct.calcsize('<8sIBxxxQ')
+BYTE_ORDERS = {'little': 0, 'big': 1}
+
+
+def file_sha1(filename):
+    digest = hashlib.sha1()
+    with open(filename, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.digest()
+
+
+def source_fingerprint(filename, sha1=None):
+    """(size, mtime_ns, sha1) of the csv the snapshot was built from"""
+    stat = os.stat(filename)
+    return stat.st_size, stat.st_mtime_ns, sha1 if sha1 is not None else file_sha1(filename)
+
+
+def read_header(filename):
+    with open(filename, 'rb') as f:
+        data = f.read(HEADER_SIZE)
+    if len(data) < HEADER_SIZE:
+        return None
+    magic, version, byte_order, size, mtime_ns, sha1, n_stops, n_lines, n_edges, stop_bytes, line_bytes = struct.unpack(HEADER_FORMAT, data)
+    if magic != SNAPSHOT_MAGIC:
+        return None
+    return {
+        'version': version,
+        'byte_order': byte_order,
+        'source': (size, mtime_ns, sha1),
+        'counts': (n_stops, n_lines, n_edges, stop_bytes, line_bytes),
+    }
+
+
+def is_snapshot_fresh(filename, source_filename):
+    """Snapshot exists, has the current format and was built from the current csv
+
+    size and mtime are compared first; the sha1 is only recomputed when they differ,
+    so touching the csv without changing it keeps the snapshot
+    """
+    if not os.path.exists(filename):
+        return False
+    header = read_header(filename)
+    if header is None or header['version'] != SNAPSHOT_VERSION or header['byte_order'] != BYTE_ORDERS[sys.byteorder]:
+        return False
+    if not os.path.exists(source_filename):
+        return True  #nothing to compare against - the snapshot is all we have
+
+    size, mtime_ns, sha1 = header['source']
+    stat = os.stat(source_filename)
+    if stat.st_size != size:
+        return False
+    if stat.st_mtime_ns == mtime_ns:
+        return True
+    if file_sha1(source_filename) != sha1:
+        return False
+
+    #same content with a new mtime - remember it so the hash is not recomputed on every start
+    with open(filename, 'r+b') as f:
+        f.seek(MTIME_OFFSET)
+        f.write(struct.pack('<q', stat.st_mtime_ns))
+    return True
+
+
+def pack_strings(strings):
+    offsets = array('i', [0])
+    data = bytearray()
+    for string in strings:
+        data += string.encode('utf-8')
+        offsets.append(len(data))
+    return offsets, bytes(data)
+
+
+def unpack_strings(offsets, data):
+    return [sys.intern(bytes(data[offsets[i]:offsets[i + 1]]).decode('utf-8')) for i in range(len(offsets) - 1)]
+
+
+def aligned(length):
+    return (length + 7) & ~7
+
+
+def section_layout(counts):
+    """(name, typecode, item count) of every section, in file order"""
+    n_stops, n_lines, n_edges, stop_bytes, line_bytes = counts
+    return [
+        ('stop_lat', 'd', n_stops),
+        ('stop_lon', 'd', n_stops),
+        ('offsets', 'i', n_stops + 1),
+        ('targets', 'i', n_edges),
+        ('lines', 'i', n_edges),
+        ('dep_minutes', 'h', n_edges),
+        ('arr_minutes', 'h', n_edges),
+        ('stop_name_offsets', 'i', n_stops + 1),
+        ('stop_name_bytes', 'B', stop_bytes),
+        ('line_name_offsets', 'i', n_lines + 1),
+        ('line_name_bytes', 'B', line_bytes),
+        ('bucket_offsets', 'i', n_stops * BUCKET_COUNT + 1),
+    ]
+
+
+def write_snapshot(graph, filename, source_filename=None, sha1=None):
+    """Write a CompactGraph to filename, stamped with the fingerprint of source_filename"""
+    stop_name_offsets, stop_name_bytes = pack_strings(graph.stop_names)
+    line_name_offsets, line_name_bytes = pack_strings(graph.line_names)
+    counts = (len(graph.stop_names), len(graph.line_names), len(graph.targets), len(stop_name_bytes), len(line_name_bytes))
+    size, mtime_ns, sha1 = source_fingerprint(source_filename, sha1) if source_filename and os.path.exists(source_filename) else (0, 0, bytes(20))
+
+    sections = {
+        'stop_lat': array('d', graph.stop_lat),
+        'stop_lon': array('d', graph.stop_lon),
+        'offsets': array('i', graph.offsets),
+        'targets': array('i', graph.targets),
+        'lines': array('i', graph.lines),
+        'dep_minutes': array('h', graph.dep_minutes),
+        'arr_minutes': array('h', graph.arr_minutes),
+        'stop_name_offsets': stop_name_offsets,
+        'stop_name_bytes': stop_name_bytes,
+        'line_name_offsets': line_name_offsets,
+        'line_name_bytes': line_name_bytes,
+        'bucket_offsets': array('i', graph.get_bucket_offsets()),
+    }
+
+    #write to a temporary file first so a crash never leaves a half-written snapshot behind
+    temporary_filename = filename + '.tmp'
+    with open(temporary_filename, 'wb') as f:
+        f.write(struct.pack(HEADER_FORMAT, SNAPSHOT_MAGIC, SNAPSHOT_VERSION, BYTE_ORDERS[sys.byteorder], size, mtime_ns, sha1, *counts))
+        f.write(bytes(aligned(HEADER_SIZE) - HEADER_SIZE))
+        for name, _, _ in section_layout(counts):
+            data = sections[name]
+            data = data.tobytes() if isinstance(data, array) else data
+            f.write(data)
+            f.write(bytes(aligned(len(data)) - len(data)))
+    os.replace(temporary_filename, filename)
+
+
+def load_snapshot(filename):
+    """mmap a snapshot and wrap its columns in a CompactGraph - only the string tables are decoded, graph.source is the stamped sha1"""
+    header = read_header(filename)
+    if header is None or header['version'] != SNAPSHOT_VERSION:
+        raise ValueError(f"{filename} is not a version {SNAPSHOT_VERSION} graph snapshot")
+
+    with open(filename, 'rb') as f:
+        mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    buffer = memoryview(mapped)
+
+    columns = {}
+    position = aligned(HEADER_SIZE)
+    for name, typecode, count in section_layout(header['counts']):
+        length = count * struct.calcsize(typecode)
+        columns[name] = buffer[position:position + length].cast(typecode)
+        position += aligned(length)
+
+    graph = CompactGraph(
+        unpack_strings(columns['stop_name_offsets'], columns['stop_name_bytes']),
+        columns['stop_lat'],
+        columns['stop_lon'],
+        unpack_strings(columns['line_name_offsets'], columns['line_name_bytes']),
+        columns['offsets'],
+        columns['targets'],
+        columns['lines'],
+        columns['dep_minutes'],
+        columns['arr_minutes'],
+        columns['bucket_offsets'],
+    )
+    sha1 = header['source'][2]
+    graph.source = sha1 if sha1 != bytes(20) else None  #written without a source csv
+    return graph
@@ -0,0 +1,145 @@
+import math
+import heapq
+from array import array
+from utils import minutes_to_time
+
+#spatial index over stop coordinates - a uniform grid in local metres
+#
+#  coordinates are projected once around the network's mean latitude (equirectangular, at city scale the
+#  error is far below the size of a platform), every stop goes to the grid cell of its projected position
+#  and a query only looks at the cells its radius, or a growing ring of cells, can reach - never at all stops
+#  footpaths are walking edges between stops within a radius, ceil(metres / WALKING_SPEED) minutes long,
+#  built once per radius; the index lives in graph.derived and only depends on the stops
+
+METRES_PER_DEGREE = 111000
+CELL_SIZE = 250  #metres
+WALKING_SPEED = 80  #metres per minute, ~4.8 km/h
+FOOTPATH_RADIUS = 250  #metres, the walking radius when walking is asked for (the engines walk only when given one)
+WALK_LINE = 'walk'  #line of footpath legs in paths
+
+
+#Edge-like walking leg, made per search when a footpath improves a stop
+class Footpath:
+    __slots__ = ('start', 'end', 'dep_minutes', 'arr_minutes', 'travel_time')
+    line = WALK_LINE
+
+    def __init__(self, start, end, dep_minutes, travel_time):
+        self.start = start
+        self.end = end
+        self.dep_minutes = dep_minutes
+        self.arr_minutes = (dep_minutes + travel_time) % (24 * 60)
+        self.travel_time = travel_time
+
+    @property
+    def dep_time(self):
+        return f"{minutes_to_time(self.dep_minutes)}:00"
+
+    @property
+    def arr_time(self):
+        return f"{minutes_to_time(self.arr_minutes)}:00"
+
+    def __repr__(self):
+        return f"Footpath(start={self.start.name}, end={self.end.name}, dep_time={self.dep_time}, arr_time={self.arr_time}, travel_time={self.travel_time})"
+
+
+class SpatialIndex:
+    def __init__(self, graph, cell_size=CELL_SIZE):
+        self.nodes = list(graph.get_nodes())
+        self.cell_size = cell_size
+        mean_lat = sum(node.lat for node in self.nodes) / len(self.nodes) if self.nodes else 0.0
+        self.x_scale = METRES_PER_DEGREE * math.cos(math.radians(mean_lat))
+        self.x = array('d', (node.lon * self.x_scale for node in self.nodes))
+        self.y = array('d', (node.lat * METRES_PER_DEGREE for node in self.nodes))
+
+        self.cells = {}  #(cell x, cell y) -> stop ids
+        for stop_id in range(len(self.nodes)):
+            self.cells.setdefault(self.cell(self.x[stop_id], self.y[stop_id]), []).append(stop_id)
+        self.bounds = (min((cx for cx, _ in self.cells), default=0), max((cx for cx, _ in self.cells), default=0),
+                       min((cy for _, cy in self.cells), default=0), max((cy for _, cy in self.cells), default=0))
+        self.footpath_lists = {}  #radius -> footpaths per stop id
+
+    def cell(self, x, y):
+        return math.floor(x / self.cell_size), math.floor(y / self.cell_size)
+
+    def project(self, lat, lon):
+        return lon * self.x_scale, lat * METRES_PER_DEGREE
+
+    def ring(self, cx, cy, r):
+        """Stop ids in the cells exactly r cells away (Chebyshev) from (cx, cy), clipped to the occupied bounds"""
+        min_cx, max_cx, min_cy, max_cy = self.bounds
+        for dx in range(max(-r, min_cx - cx), min(r, max_cx - cx) + 1):
+            if abs(dx) == r:
+                dys = range(max(-r, min_cy - cy), min(r, max_cy - cy) + 1)
+            else:
+                dys = [dy for dy in (-r, r) if min_cy <= cy + dy <= max_cy]
+            for dy in dys:
+                yield from self.cells.get((cx + dx, cy + dy), ())
+
+    def within(self, lat, lon, radius):
+        """[(metres, node)] of the stops within radius metres, nearest first"""
+        x, y = self.project(lat, lon)
+        cx, cy = self.cell(x, y)
+        reach = math.ceil(radius / self.cell_size)
+        found = []
+        for r in range(reach + 1):
+            for stop_id in self.ring(cx, cy, r):
+                metres = math.hypot(self.x[stop_id] - x, self.y[stop_id] - y)
+                if metres <= radius:
+                    found.append((metres, stop_id))
+        return [(metres, self.nodes[stop_id]) for metres, stop_id in sorted(found)]
+
+    def nearest(self, lat, lon, k=1):
+        """[(metres, node)] of the k stops nearest to (lat, lon), nearest first"""
+        x, y = self.project(lat, lon)
+        cx, cy = self.cell(x, y)
+        min_cx, max_cx, min_cy, max_cy = self.bounds
+        last_ring = max(cx - min_cx, max_cx - cx, cy - min_cy, max_cy - cy)  #reaches every occupied cell
+        candidates = []
+        r = max(0, min_cx - cx, cx - max_cx, min_cy - cy, cy - max_cy)  #first ring touching the bounds
+        #every stop outside rings 0..r is more than r cells away - stop once k candidates are closer than that
+        while r <= last_ring:
+            candidates.extend((math.hypot(self.x[stop_id] - x, self.y[stop_id] - y), stop_id) for stop_id in self.ring(cx, cy, r))
+            if len(candidates) >= k and heapq.nsmallest(k, candidates)[-1][0] <= r * self.cell_size:
+                break
+            r += 1
+        return [(metres, self.nodes[stop_id]) for metres, stop_id in heapq.nsmallest(k, candidates)]
+
+    def footpaths(self, radius=FOOTPATH_RADIUS):
+        """Per stop id, [(node, walking minutes)] to every other stop within radius metres"""
+        if radius not in self.footpath_lists:
+            lists = []
+            for stop_id, node in enumerate(self.nodes):
+                lists.append([(other, math.ceil(metres / WALKING_SPEED)) for metres, other in self.within(node.lat, node.lon, radius)
+                              if other is not node])
+            self.footpath_lists[radius] = lists
+        return self.footpath_lists[radius]
+
+
+def get_spatial_index(graph):
+    return graph.get_derived('spatial', SpatialIndex)
+
+
+def get_footpaths(graph, radius):
+    """Footpaths per stop id of the graph's index, None when radius is 0 or None"""
+    return get_spatial_index(graph).footpaths(radius) if radius else None
+
+
+def nearest_stop(graph, text):
+    """(node, metres) of the stop nearest to a 'lat,lon' text, None if text is not a coordinate pair"""
+    coordinates = parse_coordinates(text)
+    if coordinates is None or not graph.get_nodes():
+        return None
+    metres, node = get_spatial_index(graph).nearest(*coordinates)[0]
+    return node, metres
+
+
+def parse_coordinates(text):
+    """(lat, lon) from 'lat,lon' text, None if it is not a coordinate pair"""
+    parts = text.split(',')
+    if len(parts) != 2:
+        return None
+    try:
+        lat, lon = float(parts[0]), float(parts[1])
+    except ValueError:
+        return None
+    return (lat, lon) if -90 <= lat <= 90 and -180 <= lon <= 180 else None
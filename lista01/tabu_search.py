@@ -1,72 +1,396 @@
+import os
 import math
-from utils import minutes_to_time, time_to_minutes, print_path, log, reconstruct_path, calculate_total_travel_time
-from a_algorithm import find_a_star_path
+import random
+import multiprocessing
+from collections import deque
+from time import monotonic, perf_counter
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeoutError
+from utils import minutes_to_time, time_to_minutes, print_path, reconstruct_path, calculate_total_travel_time
+from instrumentation import emit, elapsed_ms
+from leg_cache import find_cached_a_star_path, get_leg_cache
+from csa_algorithm import UNREACHED, find_csa_path
 
+#move types, each generating (new_stop_list, first changed index, last changed index)
+#  swap     - any two stops exchanged (the original neighbourhood)
+#  adjacent - neighbouring stops exchanged
+#  insert   - or-opt, a run of 1-3 stops moved elsewhere
+#  reverse  - 2-opt, a run of stops visited backwards
+MAX_SEGMENT = 3
 
-def generate_neighbourhood(stop_list, tabu_list):
-    neighbourhood = []
-    
+
+def swap_moves(stop_list):
     for i in range(len(stop_list)):
         for j in range(i + 1, len(stop_list)):
             new_stop_list = stop_list.copy()
             new_stop_list[i], new_stop_list[j] = new_stop_list[j], new_stop_list[i]  # swap
-            
-            if tuple(new_stop_list) not in tabu_list:
-                neighbourhood.append(new_stop_list)
-    
-    return neighbourhood
+            yield new_stop_list, i, j
+
+
+def adjacent_moves(stop_list):
+    for i in range(len(stop_list) - 1):
+        new_stop_list = stop_list.copy()
+        new_stop_list[i], new_stop_list[i + 1] = new_stop_list[i + 1], new_stop_list[i]
+        yield new_stop_list, i, i + 1
+
+
+def insert_moves(stop_list):
+    for length in range(1, MAX_SEGMENT + 1):
+        for i in range(len(stop_list) - length + 1):
+            segment = stop_list[i:i + length]
+            rest = stop_list[:i] + stop_list[i + length:]
+            for j in range(len(rest) + 1):
+                if j != i:
+                    yield rest[:j] + segment + rest[j:], min(i, j), max(i, j) + length - 1
+
+
+def reverse_moves(stop_list):
+    for i in range(len(stop_list)):
+        for j in range(i + 2, len(stop_list)):  #j == i + 1 is an adjacent swap
+            yield stop_list[:i] + stop_list[i:j + 1][::-1] + stop_list[j + 1:], i, j
+
+
+MOVE_TYPES = {'swap': swap_moves, 'adjacent': adjacent_moves, 'insert': insert_moves, 'reverse': reverse_moves}
+
+
+def generate_moves(stop_list, tabu_list, move_types=('swap',)):
+    """Non-tabu neighbours as (new_stop_list, first changed index, last changed index), each neighbour once"""
+    seen = set()
+    for move_type in move_types:
+        for new_stop_list, first, last in MOVE_TYPES[move_type](stop_list):
+            key = tuple(new_stop_list)
+            if key not in seen and key not in tabu_list:
+                seen.add(key)
+                yield new_stop_list, first, last
+
+
+def generate_neighbourhood(stop_list, tabu_list):
+    return [new_stop_list for new_stop_list, _, _ in generate_moves(stop_list, tabu_list)]
+
+
+class TabuList:
+    """FIFO tabu list with hashed membership"""
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.order = deque()
+        self.members = set()
+
+    def __contains__(self, solution):
+        return solution in self.members
+
+    def __len__(self):
+        return len(self.order)
 
+    def append(self, solution):
+        self.order.append(solution)
+        self.members.add(solution)
+        if len(self.order) > self.max_size:
+            self.members.discard(self.order.popleft())
 
-def calculate_cost(graph, starting_stop, stop_list, start_time, optimalization_criteria):
+
+def calculate_cost(graph, starting_stop, stop_list, start_time, optimalization_criteria, cache=None):
     stop_list = [starting_stop] + stop_list + [starting_stop]  #include start/end stop
     total_cost = 0
     total_path = []
     current_start_time = start_time
 
     for i in range(len(stop_list) - 1):
-        path, total_travel_time, route_cost = find_a_star_path(graph, stop_list[i], stop_list[i + 1], current_start_time, optimalization_criteria, 'manhattan')
+        path, total_travel_time, route_cost = find_cached_a_star_path(graph, stop_list[i], stop_list[i + 1], current_start_time, optimalization_criteria, 'manhattan', cache)
+        if path is None:
+            return float('inf'), total_path
         current_start_time = minutes_to_time(time_to_minutes(current_start_time) + total_travel_time)
         total_cost += route_cost
         total_path += path
 
     return total_cost, total_path
 
-#DOCUMENT THIS
-#fix a star finding inconsistent times/solutions
-def tabu_search(graph, starting_stop, stop_list, start_time, optimalization_criteria):
-    current_best_solution = (stop_list, float('inf'), [])
-    tabu_list = []
-    best_solution = current_best_solution
-    
+
+def calculate_matrix_cost(matrix, starting_stop, stop_list, start_time):
+    """Travel minutes of the tour read from a TravelTimeMatrix, no searches"""
+    start_total = time_to_minutes(start_time)
+    arrival = matrix.tour_arrival([matrix.index[stop] for stop in [starting_stop] + stop_list], start_total)
+    return float('inf') if arrival == UNREACHED else arrival - start_total
+
+
+def reconstruct_tour(graph, starting_stop, stop_list, start_time):
+    """Earliest arrival legs of a tour (what the matrix estimates), returns (total travel minutes, path)"""
+    stop_list = [starting_stop] + stop_list + [starting_stop]
+    total_travel_time = 0
+    total_path = []
+    current_start_time = start_time
+
+    for i in range(len(stop_list) - 1):
+        path, travel_time = find_csa_path(graph, stop_list[i], stop_list[i + 1], current_start_time, 't')
+        if path is None:
+            return float('inf'), total_path
+        current_start_time = minutes_to_time(time_to_minutes(current_start_time) + travel_time)
+        total_travel_time += travel_time
+        total_path += path
+
+    return total_travel_time, total_path
+
+
+def leg_function(graph, optimalization_criteria, cache=None, matrix=None):
+    """leg(from_stop, to_stop, minutes) -> (arrival minutes, cost, path), path is None for matrix lookups
+
+    an unreachable leg arrives at UNREACHED with cost inf
+    """
+    if matrix is not None:
+        def leg(from_stop, to_stop, minutes):
+            arrival = matrix.arrival(matrix.index[from_stop], matrix.index[to_stop], minutes)
+            if arrival == UNREACHED:
+                return arrival, float('inf'), None
+            return arrival, arrival - minutes, None
+    else:
+        def leg(from_stop, to_stop, minutes):
+            if minutes == UNREACHED:  #an earlier leg had no path
+                return minutes, float('inf'), None
+            path, total_travel_time, route_cost = find_cached_a_star_path(graph, from_stop, to_stop, minutes_to_time(minutes), optimalization_criteria, 'manhattan', cache)
+            if path is None:
+                return UNREACHED, float('inf'), None
+            return minutes + total_travel_time, route_cost, path
+    return leg
+
+
+class TourState:
+    """A tour evaluated leg by leg: times[i] / costs[i] - time at and cost up to tour stop i"""
+    def __init__(self, leg, starting_stop, stop_list, start_total):
+        self.stop_list = stop_list
+        self.stops = [starting_stop] + stop_list + [starting_stop]
+        self.times = [start_total]
+        self.costs = [0]
+        self.paths = []
+        for i in range(len(self.stops) - 1):
+            arrival, cost, path = leg(self.stops[i], self.stops[i + 1], self.times[-1])
+            self.times.append(arrival)
+            self.costs.append(self.costs[-1] + cost)
+            self.paths.append(path)
+
+    def total_cost(self):
+        return self.costs[-1]
+
+    def total_path(self):
+        return [step for path in self.paths if path for step in path]
+
+    def neighbour_cost(self, leg, stop_list, first, last):
+        """Cost of the tour with stop_list changed between first and last (stop_list indices)"""
+        return neighbour_cost(leg, self.stops, self.times, self.costs, stop_list, first, last)
+
+
+def neighbour_cost(leg, stops, times, costs, stop_list, first, last):
+    """Cost of a neighbour of the tour (stops, times, costs)
+
+    legs before first come from the prefix, past last the old suffix is reused as soon as
+    the new tour reaches an unchanged stop at the same time
+    """
+    new_stops = [stops[0]] + stop_list + [stops[0]]
+    time, cost = times[first], costs[first]
+    for i in range(first, len(new_stops) - 1):
+        time, leg_cost, _ = leg(new_stops[i], new_stops[i + 1], time)
+        cost += leg_cost
+        if cost == float('inf'):
+            return cost
+        if i > last and time == times[i + 1]:
+            return cost + costs[-1] - costs[i + 1]
+    return cost
+
+
+def cost_moves(task):
+    """Costs of a chunk of moves in a worker process (the search settings are inherited through fork)"""
+    stops, times, costs, moves = task
+    graph, optimalization_criteria, matrix = _search
+    leg = leg_function(graph, optimalization_criteria, None, matrix)
+    return [neighbour_cost(leg, stops, times, costs, stop_list, first, last) for stop_list, first, last in moves]
+
+
+def best_move(current_state, leg, tabu_list, move_types, deadline=None, executor=None, workers=1):
+    """Cheapest non-tabu neighbour as (stop_list, cost), (None, inf) if there is none or the deadline passed"""
+    best_neighbour, best_neighbour_cost = None, float('inf')
+    moves = generate_moves(current_state.stop_list, tabu_list, move_types)
+
+    if executor is not None:
+        moves = list(moves)
+        size = max(1, -(-len(moves) // (workers * 4)))
+        chunks = [moves[i:i + size] for i in range(0, len(moves), size)]
+        futures = [executor.submit(cost_moves, (current_state.stops, current_state.times, current_state.costs, chunk)) for chunk in chunks]
+        for position, (chunk, future) in enumerate(zip(chunks, futures)):
+            try:
+                chunk_costs = future.result(timeout=max(0.0, deadline - monotonic()) if deadline is not None else None)
+            except FutureTimeoutError:  #an alias of the builtin TimeoutError only since Python 3.11
+                #time is up - chunks not started yet are dropped, running ones finish in the background
+                for pending in futures[position:]:
+                    pending.cancel()
+                return None, float('inf')
+            for (new_solution, _, _), total_cost in zip(chunk, chunk_costs):
+                if best_neighbour is None or total_cost < best_neighbour_cost:
+                    best_neighbour, best_neighbour_cost = new_solution, total_cost
+        return best_neighbour, best_neighbour_cost
+
+    for new_solution, first, last in moves:
+        if deadline is not None and monotonic() > deadline:
+            return None, float('inf')
+        total_cost = current_state.neighbour_cost(leg, new_solution, first, last)
+        if best_neighbour is None or total_cost < best_neighbour_cost:
+            best_neighbour, best_neighbour_cost = new_solution, total_cost
+    return best_neighbour, best_neighbour_cost
+
+
+def run_tabu(leg, starting_stop, stop_list, start_total, move_types=('swap',), deadline=None, trace=None, started=None, executor=None, workers=1):
+    """One tabu trajectory from stop_list, returns the best TourState found (None if no move was made)
+
+    stops at the deadline (monotonic clock) with the best state so far, trace gets
+    (iteration, best cost, seconds since started) after every iteration
+    """
+    current_state = TourState(leg, starting_stop, stop_list, start_total)
+    best_state = None
+
     max_tabu_size = max(7, len(stop_list))  #prevent large factorial growth
+    tabu_list = TabuList(max_tabu_size)
     max_iterations = 100
     iteration = 0
-    
+
     while len(tabu_list) < max_tabu_size and iteration < max_iterations:
-        neighbourhood = generate_neighbourhood(current_best_solution[0], tabu_list)
-        
-        if not neighbourhood:  #stop if no new valid swaps exist
+        if deadline is not None and monotonic() > deadline:
+            break
+        #neighbours are costed incrementally against the current solution
+        best_neighbour, _ = best_move(current_state, leg, tabu_list, move_types, deadline, executor, workers)
+        if best_neighbour is None:  #stop if no new valid moves exist (or time is up)
             break
-        
-        costs = {}
-        for new_solution in neighbourhood:
-            total_cost, total_path = calculate_cost(graph, starting_stop, new_solution, start_time, optimalization_criteria)
-            costs[tuple(new_solution)] = [total_cost, total_path]  #store as tuple for performance
-        
-        best_neighbour = min(costs, key=lambda x: costs[x][0])
-        best_neighbour_cost = costs[best_neighbour][0]
-        best_neighbour_path = costs[best_neighbour][1]
-
-        current_best_solution = (list(best_neighbour), best_neighbour_cost, best_neighbour_path)
+
+        current_state = TourState(leg, starting_stop, best_neighbour, start_total)
 
         #fifo
-        tabu_list.append(best_neighbour)
-        if len(tabu_list) > max_tabu_size:
-            tabu_list.pop(0)
+        tabu_list.append(tuple(best_neighbour))
+
+        if best_state is None or current_state.total_cost() < best_state.total_cost():
+            best_state = current_state
 
-        if current_best_solution[1] < best_solution[1]:
-            best_solution = current_best_solution
-        
         iteration += 1
+        if trace is not None:
+            trace.append((iteration, best_state.total_cost(), monotonic() - (started or 0)))
+
+    return best_state
+
+
+def solution_path(graph, starting_stop, stop_list, start_time, optimalization_criteria, cache=None, matrix=None, best_state=None):
+    """(stop_list, cost, path) of a final solution - legs are searched here when only costs were looked up"""
+    if matrix is not None:  #travel time lookups only, the path is searched for the final solution
+        return (stop_list,) + reconstruct_tour(graph, starting_stop, stop_list, start_time)
+    if best_state is not None:
+        return stop_list, best_state.total_cost(), best_state.total_path()
+    return (stop_list,) + calculate_cost(graph, starting_stop, stop_list, start_time, optimalization_criteria, cache)
+
+
+#DOCUMENT THIS
+#fix a star finding inconsistent times/solutions
+def tabu_search(graph, starting_stop, stop_list, start_time, optimalization_criteria, cache=None, matrix=None, move_types=('swap',)):
+    started = perf_counter()
+    leg = leg_function(graph, optimalization_criteria, cache, matrix)
+    best_state = run_tabu(leg, starting_stop, stop_list, time_to_minutes(start_time), move_types)
+
+    best_solution = (stop_list, float('inf'), [])
+    if best_state is not None:
+        best_solution = solution_path(graph, starting_stop, best_state.stop_list, start_time, optimalization_criteria, cache, matrix, best_state)
 
+    cache = cache if cache is not None else get_leg_cache(graph)
+    emit('tabu', stops=len(stop_list), cost=best_solution[1], duration_ms=elapsed_ms(started),
+         legs_cached=len(cache.legs), leg_hits=cache.hits, leg_misses=cache.misses)
     return best_solution
+
+
+def greedy_order(leg, starting_stop, stop_list, start_total):
+    """Nearest neighbour tour - always go to the stop reached cheapest from where we are"""
+    order, remaining = [], list(stop_list)
+    current, time = starting_stop, start_total
+    while remaining:
+        legs = [(leg(current, stop, time), stop) for stop in remaining]
+        (time, _, _), current = min(legs, key=lambda item: item[0][1])
+        order.append(current)
+        remaining.remove(current)
+    return order
+
+
+def run_trajectories(task):
+    """Tabu trajectories from new starting orders until the deadline, in a worker process
+
+    the first trajectory starts from the given order, the next ones from seeded shuffles
+    returns (best stop_list, best cost, trace [(trajectory, iteration, best cost, elapsed)])
+    """
+    worker, stop_list, seed, deadline, started = task
+    graph, optimalization_criteria, matrix = _search
+    starting_stop, start_total, move_types = _tour
+    leg = leg_function(graph, optimalization_criteria, None, matrix)
+    rng = random.Random(seed)
+
+    best_order, best_cost, trace = None, float('inf'), []
+    trajectory = 0
+    while monotonic() < deadline:
+        trajectory_trace = []
+        state = run_tabu(leg, starting_stop, stop_list, start_total, move_types, deadline, trajectory_trace, started)
+        trace += [(f"{worker}.{trajectory}", iteration, min(cost, best_cost), elapsed) for iteration, cost, elapsed in trajectory_trace]
+        if state is not None and state.total_cost() < best_cost:
+            best_order, best_cost = state.stop_list, state.total_cost()
+
+        trajectory += 1
+        stop_list = stop_list.copy()
+        rng.shuffle(stop_list)
+
+    return best_order, best_cost, trace
+
+
+_search = None  #(graph, optimalization_criteria, matrix), set before the pool forks
+_tour = None  #(starting_stop, start minutes, move_types)
+
+
+def parallel_tabu_search(graph, starting_stop, stop_list, start_time, optimalization_criteria, time_budget=10.0,
+                         starts=None, workers=None, seed=0, matrix=None, move_types=('swap',)):
+    """Multi-start tabu search in forked worker processes within time_budget seconds
+
+    starts - independent trajectories run at once (default one per worker): the first starts from
+    stop_list, the second from a greedy nearest neighbour order, the rest from seeded shuffles, and a
+    worker whose trajectory ends early keeps restarting from new shuffles until the budget is spent
+    starts=1 runs a single trajectory and spreads its neighbour costing over the workers instead
+    returns ((stop_list, cost, path), trace) - trace is [(trajectory, iteration, best cost, elapsed seconds)]
+    with the best cost of that worker so far, ready to plot
+    """
+    global _search, _tour
+    _search = (graph, optimalization_criteria, matrix)
+    start_total = time_to_minutes(start_time)
+    _tour = (starting_stop, start_total, move_types)
+    workers = workers or os.cpu_count() or 1
+    starts = starts or workers
+    fork = 'fork' in multiprocessing.get_all_start_methods()
+
+    started = monotonic()
+    deadline = started + time_budget
+    leg = leg_function(graph, optimalization_criteria, None, matrix)
+
+    if starts == 1:
+        trace = []
+        executor = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('fork')) if fork and workers > 1 else None
+        try:
+            state = run_tabu(leg, starting_stop, stop_list, start_total, move_types, deadline, trace, started, executor, workers)
+        finally:
+            if executor is not None:
+                executor.shutdown(cancel_futures=True)
+        results = [(state.stop_list, state.total_cost(), [("0.0",) + entry for entry in trace])] if state is not None else []
+    else:
+        rng = random.Random(seed)
+        orders = [list(stop_list), greedy_order(leg, starting_stop, stop_list, start_total)]
+        while len(orders) < starts:
+            orders.append(rng.sample(stop_list, len(stop_list)))
+        tasks = [(worker, orders[worker], seed + worker, deadline, started) for worker in range(starts)]
+
+        if fork and starts > 1:
+            with ProcessPoolExecutor(max_workers=min(workers, starts), mp_context=multiprocessing.get_context('fork')) as executor:
+                results = list(executor.map(run_trajectories, tasks))
+        else:
+            results = [run_trajectories(task) for task in tasks]
+
+    trace = sorted((entry for _, _, worker_trace in results for entry in worker_trace), key=lambda entry: entry[3])
+    found = [(cost, order) for order, cost, _ in results if order is not None]
+    if not found:
+        return (stop_list, float('inf'), []), trace
+
+    best_cost, best_order = min(found, key=lambda item: item[0])
+    emit('parallel_tabu', cost=best_cost, trajectories=len({entry[0] for entry in trace}), workers=len(results), duration_ms=round((monotonic() - started) * 1000, 3))
+    return solution_path(graph, starting_stop, best_order, start_time, optimalization_criteria, None, matrix), trace
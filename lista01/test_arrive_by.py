@@ -0,0 +1,35 @@
+from arrive_by_algorithm import find_arrive_by_path
+from utils import time_to_minutes
+from conftest import UNREACHED, build_graph, brute_force_arrivals, ride
+
+COORDS = {'S': (51.10, 17.00), 'A': (51.11, 17.01), 'B': (51.12, 17.02), 'C': (51.13, 17.03), 'D': (51.14, 17.04)}
+#leaving at 09:00 with two transfers, or at 06:30 with one
+HOPS = [('1', '09:00', '09:10', 'S', 'A'), ('2', '09:10', '09:20', 'A', 'B'), ('3', '09:20', '09:30', 'B', 'D'),
+        ('4', '06:30', '06:40', 'S', 'C'), ('5', '06:40', '06:50', 'C', 'D')]
+
+
+def lines(path):
+    return [line for _, _, _, line in path]
+
+
+def test_transfer_penalty_grows_with_transfers(tmp_path):
+    graph = build_graph(tmp_path, COORDS, HOPS)
+    path, _ = find_arrive_by_path(graph, 'S', 'D', '12:00', 't')
+    assert lines(path) == ['1', '2', '3']
+    #100 + 200 for the second transfer outweighs leaving 150 minutes earlier with one, as in the forward engines
+    path, travel_time = find_arrive_by_path(graph, 'S', 'D', '12:00', 'p')
+    assert lines(path) == ['4', '5'] and travel_time == 20
+
+
+def test_leaves_as_late_as_the_brute_force_allows(graph, queries):
+    for start, end, arrive_time in queries:
+        minutes = time_to_minutes(arrive_time)
+        path, travel_time = find_arrive_by_path(graph, start, end, arrive_time, 't')
+        if path is None:
+            assert brute_force_arrivals(graph, start, 0).get(end, UNREACHED) > minutes
+            continue
+        departure = path[0][1].dep_minutes
+        assert ride(path, start, end, departure) == departure + travel_time <= minutes
+        assert brute_force_arrivals(graph, start, departure + 1).get(end, UNREACHED) > minutes
+        path, _ = find_arrive_by_path(graph, start, end, arrive_time, 'p')
+        assert ride(path, start, end, path[0][1].dep_minutes) <= minutes
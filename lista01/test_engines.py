@@ -0,0 +1,157 @@
+import pytest
+from array import array
+from utils import time_to_minutes, minutes_to_time
+from ingest import ingest_csv
+from conftest import UNREACHED, brute_force_arrivals, brute_force_pareto, ride
+from csa_algorithm import find_csa_path
+from raptor_algorithm import find_raptor_journeys, find_raptor_path
+from profile_algorithm import find_profile
+from isochrone import find_earliest_arrivals
+from a_algorithm import find_a_star_path
+from landmarks import get_landmarks
+from trip_based_algorithm import find_trip_based_journeys, find_trip_based_path
+from dijkstra_algorithm import find_dijkstra_path
+from alternatives_algorithm import DEFAULT_K, MAX_SIMILARITY, find_alternative_paths, ride_signature, similarity
+
+#every engine against a brute-force earliest arrival on the synthetic timetable
+#
+#  only queries arriving before midnight are compared - the engines that keep one label per stop wrap
+#  the day there, the brute force does not
+
+
+def same_day(graph, queries):
+    """(start, destination, HH:MM, start minutes, earliest arrival) of the queries reachable before midnight"""
+    for start, end, start_time in queries:
+        minutes = time_to_minutes(start_time)
+        arrival = brute_force_arrivals(graph, start, minutes).get(end)
+        if arrival is not None and arrival < 24 * 60:
+            yield start, end, start_time, minutes, arrival
+
+
+def test_csa_is_earliest_arrival(graph, queries):
+    for start, end, start_time, minutes, arrival in same_day(graph, queries):
+        path, travel_time = find_csa_path(graph, start, end, start_time, 't')
+        assert travel_time == arrival - minutes and ride(path, start, end, minutes) == arrival
+
+
+def test_raptor_rounds_are_the_transfer_pareto_set(graph, queries):
+    for start, end, start_time, minutes, arrival in same_day(graph, queries):
+        journeys = find_raptor_journeys(graph, start, end, start_time)
+        assert [(travel_time, transfers) for _, travel_time, transfers in journeys] == brute_force_pareto(graph, start, end, minutes)
+        for path, travel_time, _ in journeys:
+            assert ride(path, start, end, minutes) == minutes + travel_time
+        assert find_raptor_path(graph, start, end, start_time, 't')[1] == arrival - minutes
+        assert find_raptor_path(graph, start, end, start_time, 'p')[1] == journeys[0][1]
+
+
+def test_profile_holds_the_earliest_arrival_of_every_departure(graph, queries):
+    for start, end, start_time, minutes, _ in same_day(graph, queries[:20]):
+        window_end = minutes + 60
+        profile = find_profile(graph, start, end, start_time, minutes_to_time(window_end), 't')
+        for departure, path, travel_time, _ in profile:
+            assert minutes <= departure <= window_end
+            assert ride(path, start, end, departure) == departure + travel_time
+        #later departures arrive strictly later, or they would dominate the earlier ones
+        arrivals = [departure + travel_time for departure, _, travel_time, _ in profile]
+        assert arrivals == sorted(set(arrivals)) and [entry[0] for entry in profile] == sorted({entry[0] for entry in profile})
+        #leaving at any minute of the window the profile is as good as boarding within the window allows - it may
+        #be better by staying on a vehicle that passes the origin again after the window, but never beats leaving then
+        for leave in range(minutes, window_end + 1, 5):
+            within = brute_force_arrivals(graph, start, leave, last_departure=window_end).get(end, UNREACHED)
+            if within < 24 * 60:
+                best = min(arrival for (departure, *_), arrival in zip(profile, arrivals) if departure >= leave)
+                assert brute_force_arrivals(graph, start, leave)[end] <= best <= within
+
+
+def test_one_to_all_is_earliest_arrival_everywhere(graph, queries):
+    for start, end, start_time in queries[:10]:
+        expected = brute_force_arrivals(graph, start, time_to_minutes(start_time))
+        earliest_arrival, _ = find_earliest_arrivals(graph, start, start_time)
+        assert {node.name: earliest_arrival[node.id] for node in graph.get_nodes() if earliest_arrival[node.id] != UNREACHED} == expected
+        #with destinations the scan may stop early, but theirs are final
+        earliest_arrival, _ = find_earliest_arrivals(graph, start, start_time, [end])
+        assert earliest_arrival[graph.get_node(end).id] == expected.get(end, UNREACHED)
+
+
+class NoLandmarks:
+    """Landmarks giving 0 everywhere - A* without a heuristic"""
+    def __init__(self, landmarks):
+        self.stop_ids = landmarks.stop_ids
+
+    def lower_bounds(self, target):
+        return array('i', [0]) * len(self.stop_ids)
+
+
+def test_landmark_bounds_are_admissible(graph, stop_names):
+    landmarks = get_landmarks(graph)
+    for end in stop_names[:6]:
+        bounds = landmarks.lower_bounds(landmarks.stop_ids[end])
+        for start in stop_names:
+            for minutes in (6 * 60, 12 * 60 + 30, 18 * 60):
+                arrival = brute_force_arrivals(graph, start, minutes).get(end)
+                if arrival is not None:
+                    assert bounds[landmarks.stop_ids[start]] <= arrival - minutes
+
+
+@pytest.mark.parametrize('criteria', ['t', 'p'])
+def test_alt_costs_what_a_star_without_heuristic_costs(graph, timetable_csv, queries, criteria):
+    blind = ingest_csv(timetable_csv, workers=1)[0].to_graph()
+    blind.derived['landmarks'] = NoLandmarks(get_landmarks(graph))
+    for start, end, start_time, minutes, arrival in same_day(graph, queries):
+        path, travel_time, cost = find_a_star_path(graph, start, end, start_time, criteria, 'alt')
+        assert cost == find_a_star_path(blind, start, end, start_time, criteria, 'alt')[2]
+        assert ride(path, start, end, minutes) == minutes + travel_time >= arrival
+
+
+def test_trip_based_rounds_are_the_transfer_pareto_set(graph, queries, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)  #the transfers are saved to the working directory
+    for start, end, start_time, minutes, arrival in same_day(graph, queries):
+        journeys = find_trip_based_journeys(graph, start, end, start_time)
+        assert [(travel_time, transfers) for _, travel_time, transfers in journeys] == brute_force_pareto(graph, start, end, minutes)
+        for path, travel_time, _ in journeys:
+            assert ride(path, start, end, minutes) == minutes + travel_time
+        assert find_trip_based_path(graph, start, end, start_time, 't')[1] == arrival - minutes
+
+
+def line_changes(path):
+    return sum(1 for (*_, line), (*_, next_line) in zip(path, path[1:]) if line != next_line)
+
+
+def test_alternatives_are_valid_diverse_and_start_with_the_best(graph, queries):
+    for start, end, start_time, minutes, arrival in same_day(graph, queries):
+        journeys = find_alternative_paths(graph, start, end, start_time, 't')
+        assert 1 <= len(journeys) <= DEFAULT_K
+        costs = [travel_time + 10 * line_changes(path) for path, travel_time in journeys]
+        assert costs == sorted(costs)
+        for i, (path, travel_time) in enumerate(journeys):
+            assert ride(path, start, end, minutes) == minutes + travel_time >= arrival
+            assert all(similarity(ride_signature(path), ride_signature(other)) <= MAX_SIMILARITY for other, _ in journeys[:i])
+        #with room for enough labels per stop the first journey is never worse than the single-label searches
+        path, travel_time = find_alternative_paths(graph, start, end, start_time, 't', k=8)[0]
+        dijkstra_path, dijkstra_time = find_dijkstra_path(graph, start, end, start_time, 't')
+        best = min(dijkstra_time + 10 * line_changes(dijkstra_path), find_a_star_path(graph, start, end, start_time, 't', 'alt')[2])
+        assert travel_time + 10 * line_changes(path) <= best
+
+
+@pytest.mark.parametrize('backend', ['graph', 'compact_graph'])
+def test_first_departure_per_route_keeps_the_earliest_arrival(request, backend):
+    graph = request.getfixturevalue(backend)
+    for node in graph.get_nodes():
+        for minutes in range(0, 24 * 60, 97):
+            best = {}
+            for edge in node.get_outgoing_edges():
+                if edge.dep_minutes >= minutes:
+                    route = (edge.line, edge.end.name)
+                    best[route] = min(best.get(route, UNREACHED), edge.dep_minutes + edge.travel_time)
+            scanned = {}
+            for edge in graph.get_departures(node, minutes, first_per_route=True):
+                route = (edge.line, edge.end.name)
+                scanned[route] = min(scanned.get(route, UNREACHED), edge.dep_minutes + edge.travel_time)
+            assert scanned == best
+
+
+@pytest.mark.parametrize('criteria', ['t', 'p'])
+def test_dijkstra_paths_ride_as_reported(graph, queries, criteria):
+    for start, end, start_time, minutes, arrival in same_day(graph, queries):
+        path, travel_time = find_dijkstra_path(graph, start, end, start_time, criteria)
+        assert ride(path, start, end, minutes) == minutes + travel_time >= arrival
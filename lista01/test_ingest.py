@@ -0,0 +1,45 @@
+import csv
+from ingest import ingest_csv
+from conftest import CSV_HEADER
+
+
+def hops(compact):
+    return [(compact.stop_names[stop_id], compact.stop_names[compact.targets[index]], compact.line_names[compact.lines[index]],
+             compact.dep_minutes[index], compact.arr_minutes[index])
+            for stop_id in range(len(compact.stop_names)) for index in range(*compact.get_edge_range(stop_id))]
+
+
+def minutes(text):
+    h, m, _ = map(int, text.split(':'))
+    return (h * 60 + m) % (24 * 60)
+
+
+def test_ingest_keeps_every_distinct_row(timetable_csv):
+    compact, stats = ingest_csv(timetable_csv, workers=1)
+    with open(timetable_csv, encoding='utf-8') as f:
+        rows = [(row['start_stop'], row['end_stop'], row['line'], minutes(row['departure_time']), minutes(row['arrival_time']))
+                for row in csv.DictReader(f)]
+    assert stats.rows == len(rows) and stats.rejected == 0 and stats.duplicates == len(rows) - len(set(rows))
+    assert sorted(hops(compact)) == sorted(set(rows))
+    for stop_id in range(len(compact.stop_names)):
+        departures = compact.dep_minutes[slice(*compact.get_edge_range(stop_id))]
+        assert list(departures) == sorted(departures)
+
+
+def test_chunks_and_workers_give_the_same_graph(timetable_csv):
+    compact, _ = ingest_csv(timetable_csv, workers=1)
+    chunked, stats = ingest_csv(timetable_csv, workers=3, chunk_size=4096)
+    assert list(chunked.stop_names) == list(compact.stop_names) and list(chunked.line_names) == list(compact.line_names)
+    assert hops(chunked) == hops(compact) and stats.rows == ingest_csv(timetable_csv, workers=1)[1].rows
+
+
+def test_duplicates_and_malformed_rows_are_counted(tmp_path):
+    filename = tmp_path / 'rows.csv'
+    row = [0, 'MPK', '1', '10:00:00', '10:05:00', 'A', 'B', '51.1', '17.0', '51.2', '17.1']
+    with open(filename, 'w', encoding='utf-8', newline='') as file:
+        writer = csv.writer(file)
+        writer.writerow(CSV_HEADER)
+        writer.writerows([row, [1] + row[1:], [2, 'MPK', '1', 'noon', '10:05:00'] + row[5:], [3] + row[1:8] + ['east'] + row[9:]])
+    compact, stats = ingest_csv(str(filename), workers=1)
+    assert (stats.rows, stats.duplicates, stats.rejected, len(stats.rejected_samples)) == (4, 1, 2, 2)
+    assert hops(compact) == [('A', 'B', '1', 600, 605)]
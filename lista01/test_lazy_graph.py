@@ -0,0 +1,60 @@
+import pytest
+from compact_graph import CompactGraph, BUCKET_COUNT
+from lazy_graph import WindowedGraph
+from dijkstra_algorithm import find_dijkstra_path
+from a_algorithm import find_a_star_path
+from arrive_by_algorithm import find_arrive_by_path
+from utils import time_to_minutes
+
+
+def summary(path, travel_time):
+    """What a journey is compared by - lazily made edges are other objects than the full graph's"""
+    if path is None:
+        return None
+    return travel_time, [(prev_node.name, edge.line, edge.dep_minutes, node.name) for prev_node, edge, node, _ in path]
+
+
+def windowed(graph, start_minutes, end_minutes):
+    lazy = WindowedGraph(CompactGraph.from_graph(graph), horizon=30)
+    lazy.load_window(start_minutes, end_minutes)
+    return lazy
+
+
+@pytest.mark.parametrize('criteria', ['t', 'p'])
+def test_forward_searches_match_full_graph(graph, queries, criteria):
+    for start, end, start_time in queries:
+        minutes = time_to_minutes(start_time)
+        expected = summary(*find_dijkstra_path(graph, start, end, start_time, criteria))
+        assert summary(*find_dijkstra_path(windowed(graph, minutes, minutes + 30), start, end, start_time, criteria)) == expected
+        expected = summary(*find_a_star_path(graph, start, end, start_time, criteria, 'manhattan')[:2])
+        assert summary(*find_a_star_path(windowed(graph, minutes, minutes + 30), start, end, start_time, criteria, 'manhattan')[:2]) == expected
+
+
+@pytest.mark.parametrize('criteria', ['t', 'p'])
+def test_arrive_by_matches_full_graph(graph, queries, criteria):
+    for start, end, arrive_time in queries:
+        minutes = time_to_minutes(arrive_time)
+        expected = summary(*find_arrive_by_path(graph, start, end, arrive_time, criteria))
+        lazy = windowed(graph, max(minutes - 30, 0), minutes)
+        assert summary(*find_arrive_by_path(lazy, start, end, arrive_time, criteria)) == expected
+
+
+def test_scans_match_full_graph(graph):
+    lazy = windowed(graph, 12 * 60, 12 * 60)
+    for node in graph.get_nodes():
+        lazy_node = lazy.get_node(node.name)
+        for minutes in (0, 5 * 60 + 41, 12 * 60 + 30, 23 * 60 + 50):
+            for first in (False, True):
+                full = [(edge.line, edge.end.name, edge.dep_minutes) for edge in graph.get_departures(node, minutes, first)]
+                assert [(edge.line, edge.end.name, edge.dep_minutes) for edge in lazy.get_departures(lazy_node, minutes, first)] == full
+                #arrivals in the same minute may come in another order
+                full = sorted((edge.line, edge.start.name, edge.arr_minutes) for edge in graph.get_arrivals(node, minutes, first))
+                assert sorted((edge.line, edge.start.name, edge.arr_minutes) for edge in lazy.get_arrivals(lazy_node, minutes, first)) == full
+
+
+def test_window_loads_only_what_the_search_needs(graph, queries):
+    start, end, _ = queries[0]
+    lazy = windowed(graph, 20 * 60, 20 * 60 + 30)
+    find_dijkstra_path(lazy, start, end, '20:00', 't')
+    assert not any(lazy.loaded[:20])
+    assert len(lazy.loaded_buckets()) < BUCKET_COUNT
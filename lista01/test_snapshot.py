@@ -0,0 +1,59 @@
+import os
+import shutil
+import pytest
+from snapshot import is_snapshot_fresh, load_snapshot, read_header, write_snapshot
+
+COLUMNS = ('stop_names', 'stop_lat', 'stop_lon', 'line_names', 'offsets', 'targets', 'lines', 'dep_minutes', 'arr_minutes')
+
+
+@pytest.fixture
+def source_csv(timetable_csv, tmp_path):
+    """A copy of the timetable the tests may touch and change"""
+    filename = str(tmp_path / 'connection_graph.csv')
+    shutil.copy(timetable_csv, filename)
+    return filename
+
+
+def test_snapshot_round_trip(compact_graph, source_csv, tmp_path):
+    filename = str(tmp_path / 'graph.bin')
+    write_snapshot(compact_graph, filename, source_csv)
+    loaded = load_snapshot(filename)
+    for name in COLUMNS:
+        assert list(getattr(loaded, name)) == list(getattr(compact_graph, name)), name
+    assert list(loaded.bucket_offsets) == list(compact_graph.get_bucket_offsets())
+    edge = lambda edge: (edge.start.name, edge.end.name, edge.line, edge.dep_time, edge.arr_time, edge.travel_time)
+    assert [edge(e) for e in loaded.to_graph().get_edges()] == [edge(e) for e in compact_graph.to_graph().get_edges()]
+
+
+def test_snapshot_freshness(compact_graph, source_csv, tmp_path):
+    filename = str(tmp_path / 'graph.bin')
+    assert not is_snapshot_fresh(filename, source_csv)
+    write_snapshot(compact_graph, filename, source_csv)
+    assert is_snapshot_fresh(filename, source_csv)
+
+    #touched but unchanged - still fresh, and the new mtime is remembered
+    stat = os.stat(source_csv)
+    os.utime(source_csv, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+    assert is_snapshot_fresh(filename, source_csv)
+    assert read_header(filename)['source'][1] == stat.st_mtime_ns + 10**9
+
+    #changed in place with the same size, then grown
+    with open(source_csv, 'r+b') as f:
+        f.seek(-2, os.SEEK_END)
+        last = f.read(1)
+        f.seek(-2, os.SEEK_END)
+        f.write(b'1' if last != b'1' else b'2')
+    assert not is_snapshot_fresh(filename, source_csv)
+    write_snapshot(compact_graph, filename, source_csv)
+    with open(source_csv, 'a', encoding='utf-8') as f:
+        f.write('\n')
+    assert not is_snapshot_fresh(filename, source_csv)
+
+
+def test_not_a_snapshot(tmp_path):
+    filename = str(tmp_path / 'graph.bin')
+    with open(filename, 'wb') as f:
+        f.write(b'not a graph snapshot at all' * 10)
+    assert read_header(filename) is None and not is_snapshot_fresh(filename, filename)
+    with pytest.raises(ValueError):
+        load_snapshot(filename)
@@ -0,0 +1,48 @@
+import math
+from conftest import build_graph
+from spatial import FOOTPATH_RADIUS, WALK_LINE, get_spatial_index, nearest_stop
+from dijkstra_algorithm import find_dijkstra_path
+from a_algorithm import find_a_star_path
+from arrive_by_algorithm import find_arrive_by_path
+
+#A and B are two platforms ~55 m apart, every other pair is over a kilometre apart
+COORDS = {'S': (51.10, 17.00), 'A': (51.11, 17.00), 'B': (51.1105, 17.00), 'D': (51.12, 17.00)}
+#line X to A, and another vehicle of line X on from B
+HOPS = [('X', '10:00', '10:05', 'S', 'A'), ('X', '10:10', '10:15', 'B', 'D')]
+
+
+def test_no_walking_unless_asked(tmp_path):
+    graph = build_graph(tmp_path, COORDS, HOPS)
+    assert find_dijkstra_path(graph, 'S', 'D', '09:55', 't') == (None, None)
+    assert find_a_star_path(graph, 'S', 'D', '09:55', 't', 'manhattan')[0] is None
+
+
+def test_boarding_after_a_walk_is_a_transfer(tmp_path):
+    graph = build_graph(tmp_path, COORDS, HOPS)
+    path, travel_time = find_dijkstra_path(graph, 'S', 'D', '09:55', 'p', footpath_radius=FOOTPATH_RADIUS)
+    assert [line for _, _, _, line in path] == ['X', WALK_LINE, 'X'] and travel_time == 20
+    path, _, cost = find_a_star_path(graph, 'S', 'D', '09:55', 'p', 'manhattan', footpath_radius=FOOTPATH_RADIUS)
+    assert [line for _, _, _, line in path] == ['X', WALK_LINE, 'X']
+    assert cost >= 100  #one transfer penalty, not a stay on board
+
+
+def test_walk_before_the_first_ride_is_no_transfer(tmp_path):
+    graph = build_graph(tmp_path, COORDS, HOPS)
+    path, _, cost = find_a_star_path(graph, 'A', 'D', '10:00', 'p', 'manhattan', footpath_radius=FOOTPATH_RADIUS)
+    assert [line for _, _, _, line in path] == [WALK_LINE, 'X'] and cost < 100
+
+
+def test_arrive_by_walks_both_ways(tmp_path):
+    graph = build_graph(tmp_path, COORDS, HOPS)
+    path, travel_time = find_arrive_by_path(graph, 'S', 'D', '10:20', 't', footpath_radius=FOOTPATH_RADIUS)
+    assert path[0][1].dep_minutes == 10 * 60 and travel_time == 15
+
+
+def test_nearest_and_radius_match_brute_force(graph):
+    index = get_spatial_index(graph)
+    for lat, lon in [(51.08, 17.01), (51.10, 16.90), (51.2, 17.2)]:
+        x, y = index.project(lat, lon)
+        distances = sorted((math.hypot(index.x[stop_id] - x, index.y[stop_id] - y), node.name) for stop_id, node in enumerate(index.nodes))
+        assert [node.name for _, node in index.nearest(lat, lon, k=3)] == [name for _, name in distances[:3]]
+        assert sorted(node.name for _, node in index.within(lat, lon, 3000)) == sorted(name for metres, name in distances if metres <= 3000)
+    assert nearest_stop(graph, 'not a coordinate') is None
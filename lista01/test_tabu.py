@@ -0,0 +1,33 @@
+from concurrent.futures import Future
+from time import monotonic
+from tabu_search import TabuList, TourState, best_move
+
+
+def leg(from_stop, to_stop, minutes):
+    """Legs cost their distance along a line of stops"""
+    cost = abs(from_stop - to_stop)
+    return minutes + cost, cost, None
+
+
+class StalledExecutor:
+    """Futures that never finish, as when every worker is still busy"""
+    def __init__(self):
+        self.futures = []
+
+    def submit(self, function, task):
+        self.futures.append(Future())
+        return self.futures[-1]
+
+
+def test_best_move_gives_up_at_the_deadline():
+    state = TourState(leg, 0, [3, 1, 2], 0)
+    executor = StalledExecutor()
+    assert best_move(state, leg, TabuList(7), ('swap',), monotonic(), executor) == (None, float('inf'))
+    assert executor.futures and all(future.cancelled() for future in executor.futures)
+
+
+def test_best_move_finds_the_cheapest_swap():
+    state = TourState(leg, 0, [3, 1, 2], 0)
+    assert state.total_cost() == 3 + 2 + 1 + 2
+    stop_list, cost = best_move(state, leg, TabuList(7), ('swap',))
+    assert cost == 6 and stop_list in ([1, 3, 2], [3, 2, 1])
@@ -0,0 +1,34 @@
+from ingest import ingest_csv
+from snapshot import write_snapshot, load_snapshot, file_sha1
+from transfers import build_trip_transfers, read_transfers
+from trips import get_trip_timetable
+
+
+def test_source_is_recorded_on_ingest_and_load(timetable_csv, tmp_path):
+    compact, _ = ingest_csv(timetable_csv, workers=1)
+    assert compact.source == file_sha1(timetable_csv)
+    assert compact.to_graph().source == compact.source
+    filename = str(tmp_path / 'graph.bin')
+    write_snapshot(compact, filename, timetable_csv, compact.source)
+    assert load_snapshot(filename).source == compact.source
+    write_snapshot(compact, filename)
+    assert load_snapshot(filename).source is None
+
+
+def test_transfers_are_reused_only_for_the_same_source(graph, tmp_path):
+    filename = str(tmp_path / 'graph.transfers.bin')
+    computed = build_trip_transfers(graph, filename)
+    timetable = get_trip_timetable(graph)
+    assert read_transfers(filename, timetable, graph.source) is not None
+    assert list(build_trip_transfers(graph, filename).to_trips) == list(computed.to_trips)
+    #another csv's transfers, or none recorded - never read
+    assert read_transfers(filename, timetable, bytes(20)) is None
+    graph.source = None
+    assert read_transfers(filename, timetable, graph.source) is None
+
+
+def test_updated_graph_does_not_write_transfers(graph, tmp_path):
+    filename = str(tmp_path / 'graph.transfers.bin')
+    graph.version += 1
+    build_trip_transfers(graph, filename)
+    assert not (tmp_path / 'graph.transfers.bin').exists()
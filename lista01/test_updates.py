@@ -0,0 +1,116 @@
+import random
+from compact_graph import CompactGraph
+from dijkstra_algorithm import find_dijkstra_path
+from csa_algorithm import find_csa_path
+from graph import UPDATE_SAFE_DERIVED
+from updates import apply_update_batch, replay_delta_log
+from utils import minutes_to_time, time_to_minutes
+from connections import get_connection_timetable
+from landmarks import get_landmarks
+from conftest import build_graph, brute_force_arrivals
+
+COORDS = {'A': (51.10, 17.00), 'B': (51.11, 17.01), 'C': (51.12, 17.02)}
+#run 1 ends before midnight, run 2 crosses it
+HOPS = [('1', '23:40', '23:50', 'A', 'B'), ('1', '23:50', '23:58', 'B', 'C'),
+        ('1', '23:55', '00:05', 'A', 'B'), ('1', '00:05', '00:10', 'B', 'C')]
+
+
+def hops(graph):
+    return sorted((edge.start.name, edge.dep_minutes, edge.arr_minutes) for edge in graph.get_edges())
+
+
+def test_delay_across_midnight_does_not_wrap(tmp_path):
+    graph = build_graph(tmp_path, COORDS, HOPS)
+    assert graph.apply_updates([{'type': 'delay', 'line': '1', 'stop': 'A', 'dep_time': '23:40', 'minutes': 10}]) == (1, [])
+    assert hops(graph) == [('A', 1430, 1440), ('A', 1435, 5), ('B', 5, 10), ('B', 1440, 1448)]
+    #still caught before midnight, arriving the next day - and not there at the start of the day
+    path, travel_time = find_dijkstra_path(graph, 'A', 'C', '23:30', 't')
+    assert travel_time == 38 and [edge.dep_minutes for _, edge, _, _ in path] == [1430, 1440]
+    path, travel_time = find_dijkstra_path(graph, 'B', 'C', '00:00', 't')
+    assert [edge.dep_minutes for _, edge, _, _ in path] == [5]
+    path, travel_time = find_dijkstra_path(graph, 'B', 'C', '23:59', 't')
+    assert travel_time == 9
+
+    #a run already crossing midnight stays chained, and a delayed hop is found again by its HH:MM time
+    assert graph.apply_updates([{'type': 'delay', 'line': '1', 'stop': 'A', 'dep_time': '23:55', 'minutes': 3}]) == (1, [])
+    assert hops(graph) == [('A', 1430, 1440), ('A', 1438, 1448), ('B', 1440, 1448), ('B', 1448, 1453)]
+    assert len(graph.vehicle_run(graph.find_hop('1', 'B', '00:08'))) == 1
+    assert len(graph.vehicle_run(graph.find_hop('1', 'A', '23:58'))) == 2
+    assert hops(CompactGraph.from_graph(graph).to_graph()) == hops(graph)
+
+
+def test_delay_out_of_the_timetable_is_rejected(tmp_path):
+    graph = build_graph(tmp_path, COORDS, HOPS)
+    for minutes in (2 * 24 * 60, -24 * 60):
+        applied, rejected = graph.apply_updates([{'type': 'delay', 'line': '1', 'stop': 'A', 'dep_time': '23:40', 'minutes': minutes}])
+        assert applied == 0 and rejected[0][1] == "delay moves the run out of the timetable"
+    assert graph.version == 0 and hops(graph) == hops(build_graph(tmp_path, COORDS, HOPS))
+
+
+def random_updates(graph, rng, count):
+    """Delays, cancellations and inserted hops of existing stops, with a few malformed ones among them"""
+    updates = []
+    for _ in range(count):
+        edge = rng.choice(graph.get_edges())
+        kind = rng.choice(['delay', 'delay', 'cancel', 'insert', 'bad'])
+        if kind == 'insert':
+            start, end = rng.sample(graph.get_nodes(), 2)
+            dep_minutes = rng.randrange(24 * 60 - 30)
+            updates.append({'type': 'insert', 'line': 'X', 'start': start.name, 'end': end.name,
+                            'dep_time': minutes_to_time(dep_minutes), 'arr_time': minutes_to_time(dep_minutes + rng.randint(1, 20))})
+        elif kind == 'bad':
+            updates.append({'type': 'delay', 'line': edge.line, 'stop': edge.start.name, 'dep_time': 'noon', 'minutes': 5})
+        else:
+            update = {'type': kind, 'line': edge.line, 'stop': edge.start.name, 'dep_time': minutes_to_time(edge.dep_minutes),
+                      'next': edge.end.name, 'until': rng.choice([None, edge.end.name])}
+            if kind == 'delay':
+                update['minutes'] = rng.randint(-3, 20)
+            updates.append(update)
+    return updates
+
+
+def check_indexes(graph):
+    """Every edge is in its start's outgoing and its end's incoming list once, and the lists are sorted"""
+    edges = {id(edge) for edge in graph.get_edges()}
+    outgoing = [edge for node in graph.get_nodes() for edge in node.get_outgoing_edges()]
+    incoming = [edge for node in graph.get_nodes() for edge in node.incoming_edges]
+    assert len(edges) == len(graph.get_edges()) == len(outgoing) == len(incoming)
+    assert {id(edge) for edge in outgoing} == edges == {id(edge) for edge in incoming}
+    for node in graph.get_nodes():
+        assert all(edge.start is node for edge in node.get_outgoing_edges()) and all(edge.end is node for edge in node.incoming_edges)
+        departures = [edge.dep_minutes for edge in node.get_outgoing_edges()]
+        arrivals = [edge.arr_minutes for edge in node.incoming_edges]
+        assert departures == sorted(departures) and arrivals == sorted(arrivals)
+
+
+def test_update_batches_keep_the_graph_consistent(graph, compact_graph, queries, tmp_path):
+    rng = random.Random(5)
+    log = str(tmp_path / 'graph.delta.jsonl')
+    for batch in range(5):
+        get_connection_timetable(graph)
+        get_landmarks(graph)
+        updates = random_updates(graph, rng, 20)
+        version = graph.version
+        applied, rejected = apply_update_batch(graph, updates, log)
+        assert applied + len(rejected) == len(updates) and applied > 0
+        assert graph.version == version + 1
+        assert 'connections' not in graph.derived and set(graph.derived) <= set(UPDATE_SAFE_DERIVED)
+        check_indexes(graph)
+    #searches see the changed timetable, and the log replays it onto a fresh graph
+    for start, end, start_time in queries[:10]:
+        minutes = time_to_minutes(start_time)
+        arrival = brute_force_arrivals(graph, start, minutes).get(end)
+        path, travel_time = find_csa_path(graph, start, end, start_time, 't')
+        assert (arrival is None and path is None) or travel_time == arrival - minutes
+    fresh = compact_graph.to_graph()
+    replay_delta_log(fresh, log)
+    assert sorted((edge.start.name, edge.end.name, edge.line, edge.dep_minutes, edge.arr_minutes) for edge in fresh.get_edges()) == \
+        sorted((edge.start.name, edge.end.name, edge.line, edge.dep_minutes, edge.arr_minutes) for edge in graph.get_edges())
+
+
+def test_malformed_updates_leave_the_graph_alone(graph):
+    edges = [(edge.start.name, edge.line, edge.dep_minutes) for edge in graph.get_edges()]
+    applied, rejected = graph.apply_updates([{'type': 'delay', 'line': '1'}, 'delay', {'type': 'cancel', 'line': '1', 'stop': 'Nowhere', 'dep_time': '10:00'}])
+    assert applied == 0 and len(rejected) == 3 and graph.version == 0
+    assert [(edge.start.name, edge.line, edge.dep_minutes) for edge in graph.get_edges()] == edges
+    check_indexes(graph)
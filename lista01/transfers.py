@@ -0,0 +1,149 @@
+import os
+import sys
+import struct
+from array import array
+from time import perf_counter
+from utils import GRAPH_SNAPSHOT_FILE
+from instrumentation import emit, elapsed_ms
+from trips import get_trip_timetable
+
+#trip-to-trip transfers for trip-based routing
+#
+#  for every trip t and stop index i a transfer goes to the earliest trip u of every route serving
+#  that stop, kept only if it is useful:
+#    - no U-turns: u's next stop is not t's previous stop reachable in time (change there instead)
+#    - no dominated transfers: riding u must improve the earliest arrival at some stop compared to
+#      staying on t or taking a transfer found at a later stop of t (stops are processed backwards)
+#  positions (trip, index) are flattened as trip_base[trip] + index, transfers are CSR by position
+#
+#  the result is persisted next to the graph snapshot, stamped with the sha1 of the csv the graph was built from
+
+TRANSFERS_FILE = os.path.splitext(GRAPH_SNAPSHOT_FILE)[0] + ".transfers.bin"
+TRANSFERS_MAGIC = b'RFTRANS\0'
+TRANSFERS_VERSION = 2
+HEADER_FORMAT = '<8sIB3x20sIII'
+HEADER_SIZE = struct.calcsize(HEADER_FORMAT)
+UNREACHED = 2**31 - 1
+
+
+class TripTransfers:
+    def __init__(self, timetable, offsets, to_trips, to_indices):
+        self.timetable = timetable
+        self.trip_base = array('i', [0])
+        for trip in timetable.trips:
+            self.trip_base.append(self.trip_base[-1] + len(trip.stops))
+        self.offsets = offsets  #per position, into to_trips / to_indices
+        self.to_trips = to_trips
+        self.to_indices = to_indices
+
+    def __len__(self):
+        return len(self.to_trips)
+
+    def get_transfers(self, trip, index):
+        """(trip id, stop index) pairs to change to when getting off trip at stop index"""
+        position = self.trip_base[trip.id] + index
+        return zip(self.to_trips[self.offsets[position]:self.offsets[position + 1]],
+                   self.to_indices[self.offsets[position]:self.offsets[position + 1]])
+
+
+def compute_transfers(timetable):
+    """Pruned transfers of every trip as (offsets, to_trips, to_indices) arrays"""
+    offsets, to_trips, to_indices = array('i', [0]), array('i'), array('i')
+    stop_routes = timetable.stop_routes
+
+    for trip in timetable.trips:
+        stops, arr = trip.stops, trip.arr
+        earliest = {}  #stop -> earliest arrival from trip after the current index
+        found = []
+        for i in range(len(stops) - 1, 0, -1):
+            stop_id = stops[i]
+            if arr[i] < earliest.get(stop_id, UNREACHED):
+                earliest[stop_id] = arr[i]
+
+            kept = []
+            for route, j in stop_routes[stop_id]:
+                if j == len(route.stops) - 1:
+                    continue  #nothing to ride after j
+                position = route.earliest_trip(j, arr[i])
+                if position is None or (route is trip.route and j == i and position >= trip.position):
+                    continue  #staying on trip is never worse than a later trip of its own route
+                #an earlier trip of the same route can be caught when it was overtaken (bunching) - it is kept
+                other = route.trips[position]
+                if other is trip:
+                    continue
+                #U-turn: going straight back to where we came from - changing there is never worse
+                if other.stops[j + 1] == stops[i - 1] and arr[i - 1] <= other.dep[j + 1]:
+                    continue
+
+                useful = False
+                for k in range(j + 1, len(other.stops)):
+                    if other.arr[k] < earliest.get(other.stops[k], UNREACHED):
+                        earliest[other.stops[k]] = other.arr[k]
+                        useful = True
+                if useful:
+                    kept.append((other.id, j))
+            found.append(kept)
+
+        #found is per stop index from the back; index 0 never alights
+        found.append([])
+        for kept in reversed(found):
+            for other_id, j in kept:
+                to_trips.append(other_id)
+                to_indices.append(j)
+            offsets.append(len(to_trips))
+
+    return offsets, to_trips, to_indices
+
+
+def write_transfers(filename, timetable, offsets, to_trips, to_indices, stamp):
+    temporary_filename = filename + '.tmp'
+    with open(temporary_filename, 'wb') as f:
+        f.write(struct.pack(HEADER_FORMAT, TRANSFERS_MAGIC, TRANSFERS_VERSION, sys.byteorder == 'big', stamp,
+                            len(timetable.trips), len(offsets), len(to_trips)))
+        for data in (offsets, to_trips, to_indices):
+            f.write(data.tobytes())
+    os.replace(temporary_filename, filename)
+
+
+def read_transfers(filename, timetable, stamp):
+    """(offsets, to_trips, to_indices) from filename if it matches the timetable and stamp, else None"""
+    if stamp is None or not os.path.exists(filename):
+        return None
+    with open(filename, 'rb') as f:
+        data = f.read()
+    if len(data) < HEADER_SIZE:
+        return None
+    magic, version, big_endian, file_stamp, n_trips, n_offsets, n_transfers = struct.unpack(HEADER_FORMAT, data[:HEADER_SIZE])
+    if (magic, version, big_endian, file_stamp, n_trips) != (TRANSFERS_MAGIC, TRANSFERS_VERSION, sys.byteorder == 'big', stamp, len(timetable.trips)):
+        return None
+    if n_offsets != sum(len(trip.stops) for trip in timetable.trips) + 1 or len(data) != HEADER_SIZE + 4 * (n_offsets + 2 * n_transfers):
+        return None
+
+    columns = memoryview(data)[HEADER_SIZE:].cast('i')
+    return (array('i', columns[:n_offsets]),
+            array('i', columns[n_offsets:n_offsets + n_transfers]),
+            array('i', columns[n_offsets + n_transfers:]))
+
+
+def build_trip_transfers(graph, filename=TRANSFERS_FILE):
+    """TripTransfers of the graph, loaded from filename when it was built from the same csv, else computed and saved
+
+    the csv is the one recorded on the graph when it was ingested or loaded (graph.source); a graph without one,
+    or changed by timetable updates (version > 0), no longer matches any file, its transfers are only computed
+    """
+    start_time = perf_counter()
+    timetable = get_trip_timetable(graph)
+    stamp = graph.source if not graph.version else None
+
+    columns = read_transfers(filename, timetable, stamp)
+    computed = columns is None
+    if computed:
+        columns = compute_transfers(timetable)
+        if stamp is not None:
+            write_transfers(filename, timetable, *columns, stamp)
+    emit('transfers', computed=computed, transfers=len(columns[1]), trips=len(timetable.trips), duration_ms=elapsed_ms(start_time))
+    return TripTransfers(timetable, *columns)
+
+
+def get_trip_transfers(graph):
+    return graph.get_derived('trip_transfers', build_trip_transfers)
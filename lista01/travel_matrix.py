@@ -0,0 +1,83 @@
+import bisect
+from array import array
+from time import perf_counter
+from utils import time_to_minutes
+from instrumentation import emit, elapsed_ms
+from connections import get_connection_timetable
+from csa_algorithm import UNREACHED, scan_connections
+
+#time-dependent travel-time matrix for a fixed set of stops
+#
+#  one one-to-many CSA scan per (origin stop, departure slot) fills a flat array indexed
+#  [origin][destination][slot] with the earliest arrival (unwrapped minutes) when leaving at the slot
+#  between two slots the arrival is interpolated linearly (never earlier than the arrival from the
+#  previous slot, which is always reachable by waiting); past the last slot the last one is used
+#  times are plain travel minutes, transfers are not penalized
+
+SLOT_MINUTES = 15
+HORIZON_MINUTES = 6 * 60
+
+
+class TravelTimeMatrix:
+    def __init__(self, stops, slots):
+        self.stops = stops  #stop names, matrix index -> name
+        self.index = {name: i for i, name in enumerate(stops)}
+        self.slots = slots  #array of slot departure minutes, ascending
+        self.arrivals = array('i', [UNREACHED]) * (len(stops) * len(stops) * len(slots))
+
+    def offset(self, origin, destination):
+        return (origin * len(self.stops) + destination) * len(self.slots)
+
+    def arrival(self, origin, destination, minutes):
+        """Earliest arrival at destination leaving origin (matrix indices) at minutes, UNREACHED if unknown"""
+        if origin == destination:
+            return minutes
+        offset = self.offset(origin, destination)
+        k = bisect.bisect_right(self.slots, minutes) - 1
+        if k < 0:
+            return self.arrivals[offset]
+        if k + 1 >= len(self.slots):
+            arrival = self.arrivals[offset + k]
+            return arrival if arrival == UNREACHED else max(arrival, minutes)
+
+        before, after = self.arrivals[offset + k], self.arrivals[offset + k + 1]
+        if after == UNREACHED:
+            return UNREACHED
+        if before == UNREACHED:
+            return after
+        fraction = (minutes - self.slots[k]) / (self.slots[k + 1] - self.slots[k])
+        return max(before, round(before + (after - before) * fraction), minutes)
+
+    def tour_arrival(self, order, start_minutes):
+        """Arrival back at order[0] after visiting order (matrix indices) in sequence, UNREACHED if a leg is missing"""
+        time = start_minutes
+        for i in range(len(order)):
+            time = self.arrival(order[i], order[(i + 1) % len(order)], time)
+            if time == UNREACHED:
+                return UNREACHED
+        return time
+
+
+def build_travel_time_matrix(graph, stop_names, start_time, slot_minutes=SLOT_MINUTES, horizon_minutes=HORIZON_MINUTES):
+    """TravelTimeMatrix over stop_names for departures every slot_minutes from start_time to start_time + horizon_minutes"""
+    start_algorithm_time = perf_counter()
+    timetable = get_connection_timetable(graph)
+    stop_ids = [timetable.stop_ids[name] for name in stop_names]
+
+    start_total = time_to_minutes(start_time)
+    slots = array('i', range(start_total, start_total + horizon_minutes + 1, slot_minutes))
+    matrix = TravelTimeMatrix(list(stop_names), slots)
+
+    for origin, source in enumerate(stop_ids):
+        targets = [stop_id for stop_id in stop_ids if stop_id != source]
+        for k, slot in enumerate(slots):
+            #connections are minutes of one day, later slots are scanned on the wrapped clock
+            day = slot - slot % (24 * 60)
+            earliest_arrival, _ = scan_connections(timetable, source, slot - day, targets=targets)
+            for destination, stop_id in enumerate(stop_ids):
+                arrival = earliest_arrival[stop_id]
+                if arrival != UNREACHED:
+                    matrix.arrivals[matrix.offset(origin, destination) + k] = arrival + day
+
+    emit('travel_matrix', stops=len(stop_ids), slots=len(slots), duration_ms=elapsed_ms(start_algorithm_time))
+    return matrix
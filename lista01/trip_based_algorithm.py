@@ -0,0 +1,132 @@
+from array import array
+from time import perf_counter
+from utils import time_to_minutes
+from instrumentation import emit, elapsed_ms
+from transfers import get_trip_transfers
+
+#trip-based routing - breadth first search over trip segments along the precomputed transfers
+#
+#  round n holds the trip segments reachable with n-1 transfers; reached[route][index] is the first trip
+#  of the route boarded at or before that stop index, so a segment only covers the stops no earlier
+#  boarding of the same trip (or of an earlier trip of its route) already covers
+#  the rounds that improve the arrival at the destination give the (arrival, transfers) Pareto set
+
+MAX_ROUNDS = 10
+UNREACHED = 2**31 - 1
+
+
+class Segment:
+    __slots__ = ('trip', 'begin', 'end', 'parent', 'alight')
+
+    def __init__(self, trip, begin, end, parent, alight):
+        self.trip = trip
+        self.begin = begin  #boarding stop index
+        self.end = end  #last stop index worth scanning
+        self.parent = parent  #segment changed from, None in the first round
+        self.alight = alight  #stop index the parent segment was left at
+
+
+def run_trip_based(transfers, source, start_total, target, max_rounds=MAX_ROUNDS):
+    """[(segment, alight index, arrival, transfers)] for every round that improved the arrival at target"""
+    timetable = transfers.timetable
+    if source == target:
+        return []
+    reached = {}  #route id -> per stop index, the first trip (position) already boarded at or before it
+    target_indices = {}
+    for route, index in timetable.stop_routes[target]:
+        target_indices.setdefault(route.id, []).append(index)
+
+    def covered(trip, index):
+        route_reached = reached.get(trip.route.id)
+        return route_reached is not None and route_reached[index] <= trip.position
+
+    def enqueue(trip, index, queue, parent, alight):
+        route_reached = reached.get(trip.route.id)
+        if route_reached is None:
+            route_reached = reached[trip.route.id] = array('i', [UNREACHED]) * len(trip.stops)
+        #this trip and the later ones of its route are covered from index on, up to where they already were
+        end = index
+        while end < len(trip.stops) and route_reached[end] > trip.position:
+            route_reached[end] = trip.position
+            end += 1
+        if end > index:
+            queue.append(Segment(trip, index, min(end, len(trip.stops) - 1), parent, alight))
+
+    queue = []
+    for route, index in timetable.stop_routes[source]:
+        if index < len(route.stops) - 1:
+            position = route.earliest_trip(index, start_total)
+            if position is not None:
+                enqueue(route.trips[position], index, queue, None, None)
+
+    trips = timetable.trips
+    best_arrival, journeys = UNREACHED, []
+    for n in range(1, max_rounds + 1):
+        best_in_round = None
+        for segment in queue:
+            trip = segment.trip
+            for index in target_indices.get(trip.route.id, ()):
+                if segment.begin < index <= segment.end and trip.arr[index] < best_arrival:
+                    best_arrival = trip.arr[index]
+                    best_in_round = (segment, index)
+
+        next_queue = []
+        for segment in queue:
+            trip = segment.trip
+            for index in range(segment.begin + 1, segment.end + 1):
+                if trip.arr[index] >= best_arrival:
+                    break
+                for other_id, other_index in transfers.get_transfers(trip, index):
+                    #boarding after the best arrival so far cannot help
+                    other = trips[other_id]
+                    if other.arr[other_index + 1] < best_arrival and not covered(other, other_index):
+                        enqueue(other, other_index, next_queue, segment, index)
+
+        if best_in_round is not None:
+            journeys.append(best_in_round + (best_arrival, n - 1))
+        if not next_queue:
+            break
+        queue = next_queue
+
+    return journeys
+
+
+def reconstruct_journey(timetable, segment, alight):
+    """Trip legs of a segment chain in the (prev_node, edge, node, line) path shape"""
+    path = []
+    while segment is not None:
+        trip = segment.trip
+        leg = [(timetable.nodes[trip.stops[i]], trip.edges[i], timetable.nodes[trip.stops[i + 1]], trip.line) for i in range(segment.begin, alight)]
+        path = leg + path
+        segment, alight = segment.parent, segment.alight
+    return path
+
+
+def find_trip_based_journeys(graph, starting_stop_name, destination_stop_name, start_time, max_rounds=MAX_ROUNDS):
+    """Pareto set of journeys over (arrival time, transfers) as [(path, total_travel_time, transfers)]"""
+    start_algorithm_time = perf_counter()
+    transfers = get_trip_transfers(graph)
+    timetable = transfers.timetable
+    source = timetable.stop_ids.get(starting_stop_name)
+    target = timetable.stop_ids.get(destination_stop_name)
+    if source is None or target is None:
+        print("Error: Invalid start or destination stop")
+        return []
+
+    start_total = time_to_minutes(start_time)
+    journeys = [(reconstruct_journey(timetable, segment, alight), arrival - start_total, transfer_count)
+                for segment, alight, arrival, transfer_count in run_trip_based(transfers, source, start_total, target, max_rounds)]
+
+    emit('search', engine='trip_based', duration_ms=elapsed_ms(start_algorithm_time), journeys=len(journeys))
+    return journeys
+
+
+def find_trip_based_path(graph, starting_stop_name, destination_stop_name, start_time, criteria):
+    """Earliest arrival ('t') or fewest transfers ('p', earliest among those) picked from one run"""
+    journeys = find_trip_based_journeys(graph, starting_stop_name, destination_stop_name, start_time)
+    if not journeys:
+        print("Error: No path found")
+        return None, None
+
+    path, total_travel_time, _ = journeys[0] if criteria == 'p' else journeys[-1]
+    return path, total_travel_time
@@ -0,0 +1,129 @@
+import bisect
+from array import array
+
+#vehicle trips and routes inferred from the hop-by-hop timetable
+#
+#  a trip is a chain of hops of the same line where the arrival at a stop is the departure from it
+#  (same minute), never turning straight back to the previous stop
+#  a route groups the trips of a line that serve the same stop sequence, sorted so that no trip
+#  overtakes another (trips that would are moved to a separate route)
+#  times along a trip are unwrapped minutes, so trips running past midnight keep increasing
+
+
+class Trip:
+    def __init__(self, trip_id, line, edges, stops):
+        self.id = trip_id
+        self.line = line
+        self.edges = edges  #hops in order, edges[i] goes from stops[i] to stops[i + 1]
+        self.stops = stops
+        self.route = None
+        self.position = None  #index in route.trips
+
+        #arrival and departure at every stop of the trip
+        self.dep = array('i')
+        self.arr = array('i')
+        time = edges[0].dep_minutes
+        self.arr.append(time)
+        for edge in edges:
+            time += (edge.dep_minutes - time) % (24 * 60)  #waiting at the stop, 0 for chained hops
+            self.dep.append(time)
+            time += edge.travel_time
+            self.arr.append(time)
+        self.dep.append(time)
+
+
+class Route:
+    def __init__(self, route_id, line, stops):
+        self.id = route_id
+        self.line = line
+        self.stops = stops
+        self.trips = []
+        self.departures = None  #departures[i] - departure at stop i of every trip, in trip order
+
+    def fits(self, trip):
+        """trip can be appended without overtaking the last trip at any stop"""
+        if not self.trips:
+            return True
+        last = self.trips[-1]
+        return all(last.dep[i] <= trip.dep[i] and last.arr[i] <= trip.arr[i] for i in range(len(self.stops)))
+
+    def finalize(self):
+        for position, trip in enumerate(self.trips):
+            trip.position = position
+        self.departures = [array('i', (trip.dep[i] for trip in self.trips)) for i in range(len(self.stops))]
+
+    def earliest_trip(self, stop_index, after_minutes):
+        """Position (in self.trips) of the first trip leaving stop_index at or after after_minutes, None if none does"""
+        position = bisect.bisect_left(self.departures[stop_index], after_minutes)
+        return position if position < len(self.trips) else None
+
+
+def chain_hops(edges):
+    """Split the hops of one line into trips - lists of consecutive edges"""
+    edges = sorted(edges, key=lambda edge: edge.dep_minutes)
+    departures = {}
+    for index, edge in enumerate(edges):
+        departures.setdefault((edge.start.name, edge.dep_minutes), []).append(index)
+
+    successor = [None] * len(edges)
+    has_predecessor = [False] * len(edges)
+    for index, edge in enumerate(edges):
+        for candidate in departures.get((edge.end.name, edge.arr_minutes), ()):
+            if not has_predecessor[candidate] and candidate != index and edges[candidate].end.name != edge.start.name:
+                successor[index] = candidate
+                has_predecessor[candidate] = True
+                break
+
+    trips = []
+    visited = [False] * len(edges)
+    #chain starts first; whatever is left afterwards can only be a cycle, which is cut at its earliest hop
+    for index in [i for i in range(len(edges)) if not has_predecessor[i]] + list(range(len(edges))):
+        if visited[index]:
+            continue
+        trip = []
+        while index is not None and not visited[index]:
+            visited[index] = True
+            trip.append(edges[index])
+            index = successor[index]
+        trips.append(trip)
+    return trips
+
+
+class TripTimetable:
+    def __init__(self, graph):
+        self.nodes = list(graph.get_nodes())
+        self.stop_ids = {node.name: stop_id for stop_id, node in enumerate(self.nodes)}
+
+        by_line = {}
+        for node in self.nodes:
+            for edge in node.get_outgoing_edges():
+                by_line.setdefault(edge.line, []).append(edge)
+
+        self.trips = []
+        for line, edges in by_line.items():
+            for trip_edges in chain_hops(edges):
+                stops = [self.stop_ids[trip_edges[0].start.name]] + [self.stop_ids[edge.end.name] for edge in trip_edges]
+                self.trips.append(Trip(len(self.trips), line, trip_edges, stops))
+
+        #group into routes by (line, stop sequence), splitting off trips that overtake
+        self.routes = []
+        routes_by_key = {}
+        for trip in sorted(self.trips, key=lambda trip: trip.dep[0]):
+            candidates = routes_by_key.setdefault((trip.line, tuple(trip.stops)), [])
+            route = next((route for route in candidates if route.fits(trip)), None)
+            if route is None:
+                route = Route(len(self.routes), trip.line, trip.stops)
+                candidates.append(route)
+                self.routes.append(route)
+            route.trips.append(trip)
+            trip.route = route
+
+        self.stop_routes = [[] for _ in self.nodes]  #(route, index of the stop in the route)
+        for route in self.routes:
+            route.finalize()
+            for index, stop_id in enumerate(route.stops):
+                self.stop_routes[stop_id].append((route, index))
+
+
+def get_trip_timetable(graph):
+    return graph.get_derived('trips', TripTimetable)
@@ -0,0 +1,57 @@
+import os
+import json
+from time import perf_counter, time
+from instrumentation import emit, elapsed_ms
+
+#timetable delta log - batches of Graph.apply_updates updates, one JSON object per line
+#
+#  {"time": 1700000000.0, "updates": [{"type": "delay", "line": "A", "stop": "PL. GRUNWALDZKI", "dep_time": "14:40", "minutes": 3}]}
+#
+#  live updates are appended as they arrive; at startup the log is replayed onto the base graph loaded
+#  from the snapshot, so a restart ends up with the same timetable without rebuilding anything
+#  a line cut short by a crash while writing is skipped
+
+DELTA_LOG_FILE = "graph.delta.jsonl"
+
+
+def append_delta_log(filename, updates):
+    with open(filename, 'a', encoding='utf-8') as f:
+        f.write(json.dumps({'time': round(time(), 3), 'updates': updates}, ensure_ascii=False) + '\n')
+
+
+def read_delta_log(filename):
+    """Update batches of the log in order, [] when there is no log"""
+    if not os.path.exists(filename):
+        return []
+    batches = []
+    with open(filename, encoding='utf-8') as f:
+        for line in f:
+            try:
+                batches.append(json.loads(line)['updates'])
+            except (ValueError, KeyError, TypeError):
+                continue
+    return batches
+
+
+def apply_update_batch(graph, updates, log_filename=None):
+    """graph.apply_updates(updates), appended to the delta log when one is given and anything applied
+
+    returns (applied count, [(update, reason)] rejected), None on a graph that cannot be updated
+    """
+    if not hasattr(graph, 'apply_updates'):
+        print("Error: timetable updates need the object graph (not --compact)")
+        return None
+    start_time = perf_counter()
+    applied, rejected = graph.apply_updates(updates)
+    if applied and log_filename is not None:
+        append_delta_log(log_filename, [update for update in updates if not any(update is bad for bad, _ in rejected)])
+    emit('updates', applied=applied, rejected=len(rejected), version=graph.version, duration_ms=elapsed_ms(start_time))
+    return applied, rejected
+
+
+def replay_delta_log(graph, filename=DELTA_LOG_FILE):
+    """Apply every batch of the log onto graph at once, same return values as apply_update_batch"""
+    batches = read_delta_log(filename)
+    if not batches:
+        return 0, []
+    return apply_update_batch(graph, [update for batch in batches for update in batch])
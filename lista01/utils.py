@@ -1,75 +1,56 @@
 from datetime import datetime
 import os
-import json
-import csv
 from graph import Graph, Node, Edge
-
-GRAPH_JSON_FILE = "graph.json"
-
-def get_graph():
-    if os.path.exists(GRAPH_JSON_FILE):
-        print("Loading graph from JSON cache...")
-        return Graph.from_json(GRAPH_JSON_FILE)
-
-    print("Generating graph from CSV...")
-    unique_nodes = {}
-    unique_edges = set()
-    start_time = datetime.now()
-
-    with open('connection_graph.csv', newline='', encoding='utf-8') as csvfile:
-        reader = csv.DictReader(csvfile)
-        for data_row in reader:
-            try:
-                start = data_row["start_stop"]
-                end = data_row["end_stop"]
-                line = data_row["line"]
-                dep_time = data_row["departure_time"]
-                arr_time = data_row["arrival_time"]
-                start_stop_lat = float(data_row["start_stop_lat"])
-                start_stop_lon = float(data_row["start_stop_lon"])
-                end_stop_lat = float(data_row["end_stop_lat"])
-                end_stop_lon = float(data_row["end_stop_lon"])
-
-                dep_h, dep_m, dep_s = map(int, dep_time.split(":"))
-                arr_h, arr_m, arr_s = map(int, arr_time.split(":"))
-                dep_mins = dep_h * 60 + dep_m
-                arr_mins = arr_h * 60 + arr_m
-                travel_time = abs(arr_mins - dep_mins)
-                
-                if dep_h >= 24:
-                    dep_time = f"{(dep_h-24):02d}:{(dep_m):02d}:00"
-                
-                if arr_h >= 24:
-                    arr_time = f"{(arr_h-24):02d}:{(arr_m):02d}:00"
-
-                if start not in unique_nodes:
-                    unique_nodes[start] = Node(start, start_stop_lat, start_stop_lon)
-                if end not in unique_nodes:
-                    unique_nodes[end] = Node(end, end_stop_lat, end_stop_lon)
-                
-                nodeA = unique_nodes[start]
-                nodeB = unique_nodes[end]
-                
-                edge = Edge(nodeA, nodeB, line, dep_time, arr_time, travel_time)
-                unique_edges.add(edge)
-                
-            except Exception as e:
-                print(f"Error in line {data_row}: {e}")
-
-    for edge in unique_edges:
-        edge.start.add_outgoing_edge(edge)
-        
-    end_time = datetime.now()
-    print(f"Graph initialization execution time: {end_time - start_time} seconds")
-    
-    for node in unique_nodes.values():
-        node.outgoing_edges.sort(key=lambda e: tuple(map(int, e.dep_time.split(":"))))
-
-        
-    graph = Graph(list(unique_nodes.values()), list(unique_edges))
-
-    graph.to_json(GRAPH_JSON_FILE)
-    
+from ingest import ingest_csv
+from snapshot import is_snapshot_fresh, load_snapshot, write_snapshot
+from instrumentation import span
+from updates import replay_delta_log
+from lazy_graph import WindowedGraph, DEFAULT_HORIZON
+
+GRAPH_CSV_FILE = "connection_graph.csv"
+GRAPH_SNAPSHOT_FILE = "graph.bin"
+
+def get_graph(rebuild=False, compact=False, workers=None, verbose=False, delta_log=None, window=None, horizon=DEFAULT_HORIZON):
+    """Graph from the binary snapshot cache, rebuilt from the csv when it changed (or when rebuild is set)
+
+    compact=True returns the mmap'ed CompactGraph as is, otherwise Node/Edge objects are materialized from it
+    workers is the number of csv parsing processes (None - one per core)
+    verbose prints the progress and the rejected rows (the CLI), the 'load' event carries the counts either way
+    delta_log is a timetable update log (updates.py) replayed onto the loaded graph
+    window - a (start, end) pair of HH:MM times, only the departure buckets overlapping it are materialized
+    and searches pull in more as they go (a WindowedGraph, see lazy_graph.py); horizon is how far ahead
+    of a scanned stop the departures are prefetched
+    """
+    with span('load', compact=compact) as event:
+        if not rebuild and is_snapshot_fresh(GRAPH_SNAPSHOT_FILE, GRAPH_CSV_FILE):
+            if verbose:
+                print("Loading graph from binary snapshot...")
+            event['source'] = 'snapshot'
+        else:
+            if verbose:
+                print("Generating graph from CSV...")
+            graph, stats = ingest_csv(GRAPH_CSV_FILE, workers=workers)
+            if verbose:
+                print(f"Graph initialization: {stats}")
+                for sample in stats.rejected_samples:
+                    print(f"  rejected: {sample}")
+            event.update(source='csv', rows=stats.rows, rejected=stats.rejected, duplicates=stats.duplicates)
+            write_snapshot(graph, GRAPH_SNAPSHOT_FILE, GRAPH_CSV_FILE, graph.source)
+
+        graph = load_snapshot(GRAPH_SNAPSHOT_FILE)
+        if window is not None and not compact:
+            graph = WindowedGraph(graph, horizon)
+            graph.load_window(time_to_minutes(window[0]), time_to_minutes(window[1]))
+            event['buckets'] = len(graph.loaded_buckets())
+        elif not compact:
+            graph = graph.to_graph()
+        if delta_log is not None:
+            result = replay_delta_log(graph, delta_log)
+            if result is not None:
+                event['updates'] = result[0]
+                if verbose:
+                    print(f"Replayed {result[0]} timetable updates from {delta_log}, {len(result[1])} rejected")
+        event.update(stops=len(graph.nodes), connections=len(graph.edges))
     return graph
 
 
@@ -96,25 +77,24 @@ def log(message):
     
     
 def reconstruct_path(previous, starting_stop, destination_stop):
-    start_time = datetime.now()
-    path = []
-    current = destination_stop
-    final_arrival_time = None
-    while current != starting_stop:
-        prev_node, edge_used, line_used = previous.get(current, (None, None, None))
-        if prev_node is None:
-            return None
-        print(f'{current} <- {prev_node} ({edge_used.dep_time})')
-        path.append((prev_node, edge_used, current, line_used))
-        current = prev_node
-        
-        #save arrival time of the last edge used
-        if final_arrival_time is None:
-            final_arrival_time = time_to_minutes(edge_used.arr_time)
-    path.reverse()
-    
-    stop_algorithm_time = datetime.now()
-    log(f"Path reconstruction execution time: {stop_algorithm_time - start_time} seconds")
+    """(path, final arrival minutes) along the previous labels, (None, None) if destination was not reached"""
+    with span('reconstruct') as event:
+        path = []
+        current = destination_stop
+        final_arrival_time = None
+        while current != starting_stop:
+            prev_node, edge_used, line_used = previous.get(current, (None, None, None))
+            if prev_node is None:
+                event['path_length'] = None
+                return None, None
+            path.append((prev_node, edge_used, current, line_used))
+            current = prev_node
+            
+            #save arrival time of the last edge used
+            if final_arrival_time is None:
+                final_arrival_time = edge_used.arr_minutes
+        path.reverse()
+        event['path_length'] = len(path)
     return path, final_arrival_time
 
 
@@ -131,6 +111,11 @@ def print_path(path, starting_stop_name, start_time, total_travel_time=0):
     last_arrival_time = start_time
 
     for prev_node, edge, current_node, line in path:
+        if line == 'walk':
+            print(f"  → Walk from {prev_node.name} to {current_node.name} ({edge.travel_time} mins)")
+            current_line = line
+            last_arrival_time = edge.arr_time
+            continue
         if line != current_line:
             print(f"  → Change to line {line} at {prev_node.name}")
             current_line = line
@@ -147,6 +132,22 @@ def print_path(path, starting_stop_name, start_time, total_travel_time=0):
     print(f"\nTotal travel time: {total_travel_time} minutes")
 
 
+
+
+def print_profile(profile, starting_stop_name, destination_stop_name):
+    if not profile:
+        print("No journeys found in the departure window!")
+        return
+
+    print(f"\nJourneys from {starting_stop_name} to {destination_stop_name}:")
+    for departure, path, total_travel_time, transfers in profile:
+        lines = []
+        for _, _, _, line in path:
+            if not lines or lines[-1] != line:
+                lines.append(line)
+        print(f"  Leave at {minutes_to_time(departure)} → arrive at {minutes_to_time(departure + total_travel_time)} "
+              f"({total_travel_time} mins, {transfers} transfers, lines: {' → '.join(lines)})")
+
     
     
 def calculate_total_travel_time(start_time, final_arrival_time):
@@ -0,0 +1,49 @@
+import threading
+from array import array
+
+#reusable search state for find_dijkstra_path / find_a_star_path
+#
+#  the labels live in arrays indexed by node.id, allocated once per workspace instead of one dict per
+#  label over all nodes per query; a slot only counts when its stamp equals the current epoch, so
+#  reset() is O(1) - bumping the epoch forgets every label of the previous search
+#  get_workspace(graph) keeps one workspace per thread in graph.derived, a changed graph gets new ones
+
+INFINITY = float('inf')
+MAX_EPOCH = 2**31 - 1
+NO_PREVIOUS = (None, None, None)
+
+
+class SearchWorkspace:
+    def __init__(self, size):
+        self.size = size
+        self.epoch = 0
+        self.stamp = array('i', [0]) * size
+        #costs and minutes are whole numbers, unlabelled slots are told apart by their stamp
+        self.distance = array('q', [0]) * size
+        self.arrival = array('q', [0]) * size  #earliest arrival (dijkstra)
+        self.transfers = array('q', [0]) * size  #transfer count (a*)
+        self.previous = [NO_PREVIOUS] * size  #(prev_node, edge, line)
+
+    def reset(self):
+        """Forget every label, returns self"""
+        self.epoch += 1
+        if self.epoch > MAX_EPOCH:
+            self.stamp = array('i', [0]) * self.size
+            self.epoch = 1
+        return self
+
+    def get(self, node, default=NO_PREVIOUS):
+        """Previous label of node, the dict.get reconstruct_path expects"""
+        return self.previous[node.id] if self.stamp[node.id] == self.epoch else default
+
+    def get_distance(self, node):
+        return self.distance[node.id] if self.stamp[node.id] == self.epoch else INFINITY
+
+
+def get_workspace(graph):
+    """This thread's workspace for graph"""
+    local = graph.get_derived('workspaces', lambda graph: threading.local())
+    workspace = getattr(local, 'workspace', None)
+    if workspace is None:
+        workspace = local.workspace = SearchWorkspace(len(graph.get_nodes()))
+    return workspace